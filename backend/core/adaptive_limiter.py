@@ -0,0 +1,138 @@
+"""
+自适应并发控制（AIMD）
+按供应商模型限制同时进行的LLM调用：延迟正常时加性增加并发上限，
+遇到 429 或延迟突增时乘性减少，使并发稳定在供应商的实际承载能力附近
+"""
+
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Deque, Dict, Optional
+
+from core.metrics import metrics
+
+ADAPTIVE_CONCURRENCY = os.getenv("ADAPTIVE_CONCURRENCY", "true").lower() == "true"
+INITIAL_LIMIT = float(os.getenv("LLM_CONCURRENCY_INITIAL", "4"))
+MIN_LIMIT = int(os.getenv("LLM_CONCURRENCY_MIN", "1"))
+MAX_LIMIT = int(os.getenv("LLM_CONCURRENCY_MAX", "32"))
+
+# 乘性减少系数
+DECREASE_FACTOR = 0.5
+
+# 延迟超过基线的倍数视为延迟突增
+LATENCY_SPIKE_RATIO = float(os.getenv("LLM_LATENCY_SPIKE_RATIO", "2.0"))
+
+# 基线延迟的指数平均系数（较慢，避免被突增带偏）
+BASELINE_ALPHA = 0.05
+
+
+def is_overload(error: BaseException) -> bool:
+    """供应商过载（限流）错误"""
+    status_code = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    return status_code in (429, 529) or "RateLimit" in type(error).__name__
+
+
+class AIMDLimiter:
+    """单个供应商模型的并发限制器"""
+
+    def __init__(self, name: str, initial: float = INITIAL_LIMIT, min_limit: int = MIN_LIMIT,
+                 max_limit: int = MAX_LIMIT, labels: Optional[dict] = None):
+        self.name = name
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.labels = labels or {"model": name}
+        self.inflight = 0
+        self.baseline: Optional[float] = None
+        self._last_decrease = 0.0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    @property
+    def current_limit(self) -> int:
+        return max(self.min_limit, int(self.limit))
+
+    async def acquire(self):
+        """获取调用名额，超过当前上限时排队等待"""
+        if self.inflight < self.current_limit and not self._waiters:
+            self.inflight += 1
+            self._export()
+            return
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # 名额已分配但等待方被取消：归还名额
+                self._release_slot()
+            elif waiter in self._waiters:
+                self._waiters.remove(waiter)
+            raise
+
+    def release(self, latency: Optional[float] = None, overloaded: bool = False):
+        """归还名额并调整上限；latency 为 None 且未过载表示结果不可用于调整（被取消或普通错误）"""
+        saturated = self.inflight >= self.current_limit
+        now = time.monotonic()
+
+        if overloaded or (latency is not None and self.baseline and latency > self.baseline * LATENCY_SPIKE_RATIO):
+            # 同一过载窗口内只减少一次
+            if now - self._last_decrease >= (self.baseline or 1.0):
+                self.limit = max(float(self.min_limit), self.limit * DECREASE_FACTOR)
+                self._last_decrease = now
+                metrics.inc("llm_concurrency_decreases_total", reason="rate_limit" if overloaded else "latency",
+                            **self.labels)
+        elif latency is not None:
+            if saturated:
+                # 每满一个窗口（约 limit 次成功调用）增加 1
+                self.limit = min(float(self.max_limit), self.limit + 1 / self.limit)
+
+        if latency is not None and not overloaded:
+            self.baseline = latency if self.baseline is None else \
+                (1 - BASELINE_ALPHA) * self.baseline + BASELINE_ALPHA * latency
+
+        self._release_slot()
+
+    def _release_slot(self):
+        self.inflight -= 1
+        while self._waiters and self.inflight < self.current_limit:
+            waiter = self._waiters.popleft()
+            if waiter.done():
+                continue
+            self.inflight += 1
+            waiter.set_result(None)
+        self._export()
+
+    def _export(self):
+        metrics.set("llm_concurrency_limit", self.current_limit, **self.labels)
+        metrics.set("llm_inflight", self.inflight, **self.labels)
+        metrics.set("llm_concurrency_waiting", len(self._waiters), **self.labels)
+
+    def to_dict(self) -> dict:
+        return {
+            "limit": self.current_limit,
+            "inflight": self.inflight,
+            "waiting": len(self._waiters),
+            "baseline_latency": round(self.baseline, 4) if self.baseline is not None else None,
+        }
+
+
+class AdaptiveLimiters:
+    """按供应商模型管理限制器"""
+
+    def __init__(self):
+        self._limiters: Dict[str, AIMDLimiter] = {}
+
+    def get(self, provider: str, model: str) -> AIMDLimiter:
+        key = f"{provider}:{model}"
+        if key not in self._limiters:
+            self._limiters[key] = AIMDLimiter(key, labels={"provider": provider, "model": model})
+        return self._limiters[key]
+
+    def status(self) -> Dict[str, dict]:
+        return {key: limiter.to_dict() for key, limiter in self._limiters.items()}
+
+
+# 全局实例
+adaptive_limiters = AdaptiveLimiters()
@@ -2,14 +2,12 @@
 Agent定义与状态管理 - v0.1.1
 """
 
-from typing import TypedDict, List, Annotated, Literal, Optional
-from langgraph.graph.message import add_messages
-from langchain_anthropic import ChatAnthropic
-from langchain_openai import ChatOpenAI
+import importlib
+from typing import TypedDict, List, Dict, Annotated, Literal, Optional
 
-from core.workflows import ECHO_WORKFLOW, ELON_WORKFLOW, HENRY_WORKFLOW
 from core.audit_store import audit_store
 from core.safety_system import safety_system
+from core.dag_scheduler import append, keep_max
 
 # Agent类型
 class AgentType:
@@ -25,15 +23,16 @@ class AgentType:
     NETWORKER = "networker"
 
 # Agent状态
+# 节点只返回变化的字段；Annotated 中声明的合并函数决定增量如何并入状态
 class AgentState(TypedDict):
     # 通用字段
-    messages: Annotated[List[str], add_messages]
+    messages: Annotated[List[str], append]
     current_agent: str
     task: str
     status: str  # running, thinking, blocked, idle
-    progress: float
+    progress: Annotated[float, keep_max]
     task_id: Optional[str]  # 任务ID，用于审计日志
-    audit_logs: List[str]  # 审计日志列表
+    audit_logs: Annotated[List[str], append]  # 审计日志列表
 
     # Echo专用字段
     tech_tasks: List[dict]
@@ -45,6 +44,7 @@ class AgentState(TypedDict):
     tests: str
     architecture: dict
     elon_output: str
+    review: str
 
     # Henry专用字段
     research: str
@@ -53,16 +53,25 @@ class AgentState(TypedDict):
     networking: str
 
     # 安全字段
-    safety_flags: List[str]
+    safety_flags: Annotated[List[str], append]
     goal_alignment: bool
 
-# Agent工作流映射
+    # 调度报告（各节点耗时、关键路径）
+    schedule: dict
+
+    # 派生任务：按节点名追加的输入要求
+    node_inputs: Dict[str, str]
+
+# Agent工作流映射（工厂函数名，首次使用时才编译）
 AGENT_WORKFLOWS = {
-    AgentType.ECHO: ECHO_WORKFLOW,
-    AgentType.ELON: ELON_WORKFLOW,
-    AgentType.HENRY: HENRY_WORKFLOW,
+    AgentType.ECHO: "create_echo_workflow",
+    AgentType.ELON: "create_elon_workflow",
+    AgentType.HENRY: "create_henry_workflow",
 }
 
+# 已编译的工作流缓存
+_compiled_workflows = {}
+
 # Agent配置
 AGENT_CONFIG = {
     AgentType.ECHO: {
@@ -120,17 +129,6 @@ AGENT_CONFIG = {
     },
 }
 
-# 创建LLM实例
-def get_llm(agent_type: str):
-    """获取对应Agent的LLM实例"""
-    if agent_type in [AgentType.ELON, AgentType.ARCHITECT, AgentType.CODER, AgentType.QA]:
-        return ChatOpenAI(model="gpt-4", temperature=0.2)
-    else:
-        return ChatAnthropic(
-            model="claude-sonnet-4-20250514",
-            temperature=0.3
-        )
-
 # 获取Agent配置
 def get_agent_config(agent_type: str) -> dict:
     """获取Agent配置"""
@@ -188,18 +186,45 @@ def generate_audit_log(task_id: str, agent_type: str, action: str, details: str)
     timestamp = datetime.now().isoformat()
     return f"[{timestamp}] {task_id} | {agent_type} | {action} | {details}"
 
+# 频率限制器（由安全系统实现）
+rate_limiter = safety_system
+
 def rate_limit_check(agent_type: str) -> bool:
     """频率限制检查"""
     # Henry子代理限制
     if agent_type == AgentType.NETWORKER:
-        return rate_limiter.check_henry_rate_limit(agent_type)
+        return rate_limiter.check_henry_rate_limit(agent_type)[0]
 
     # Elon子代理熔断
     if agent_type in [AgentType.CODER, AgentType.QA]:
-        return rate_limiter.check_elon_test_failure(agent_type)
+        return rate_limiter.check_elon_test_failure(agent_type)[0]
 
     return True
 
+def check_fork_request(fork_id: str, agent_type: str, task_text: str, overrides: dict,
+                       node_inputs: dict) -> Optional[str]:
+    """对派生任务执行与新任务相同的安全、目标对齐与频率检查，返回拒绝原因"""
+    extra = [value for key, value in overrides.items() if key != "task" and isinstance(value, str)]
+    extra += [str(value) for value in node_inputs.values()]
+    text = "\n".join([task_text, *extra])
+
+    if safety_check({"task": text, "task_id": fork_id, "progress": 0.0}) != "pass":
+        return "安全检查未通过，派生任务被拒绝"
+    if not goal_alignment_check({"task": text, "task_id": fork_id, "progress": 0.0}):
+        return "目标对齐检查失败，派生任务被拒绝"
+    if not rate_limit_check(agent_type):
+        return "操作频率过高，派生任务被限制"
+    return None
+
+# AI生成内容标签（透明化协议）
+AI_ASSIST_LABEL = "🤖 本内容由AI辅助生成"
+
+def add_ai_assist_label(content: str) -> str:
+    """为AI生成内容附加标签"""
+    if AI_ASSIST_LABEL in content:
+        return content
+    return f"{content}\n\n{AI_ASSIST_LABEL}"
+
 # 获取审计日志
 def get_audit_logs(task_id: str, limit: int = 100) -> List[dict]:
     """获取任务审计日志"""
@@ -227,7 +252,18 @@ def get_all_agent_types():
     """获取所有Agent类型"""
     return list(AGENT_CONFIG.keys())
 
+# 是否存在Agent工作流（不触发编译）
+def has_agent_workflow(agent_type: str) -> bool:
+    """判断Agent是否有工作流"""
+    return agent_type in AGENT_WORKFLOWS
+
 # 获取Agent工作流
 def get_agent_workflow(agent_type: str):
-    """获取Agent工作流"""
-    return AGENT_WORKFLOWS.get(agent_type)
+    """获取Agent工作流，首次使用时导入 core.workflows 并编译"""
+    if agent_type not in AGENT_WORKFLOWS:
+        return None
+
+    if agent_type not in _compiled_workflows:
+        workflows = importlib.import_module("core.workflows")
+        _compiled_workflows[agent_type] = getattr(workflows, AGENT_WORKFLOWS[agent_type])()
+    return _compiled_workflows[agent_type]
@@ -4,24 +4,51 @@
 
 import json
 import sqlite3
-from datetime import datetime
+from datetime import datetime, timedelta
 from typing import List, Optional, Dict, Any
 from pathlib import Path
+from collections import Counter
 from contextlib import contextmanager
 
+from core.dag_scheduler import current_node
+
 # 数据库文件路径
 DB_PATH = Path(__file__).parent.parent / "audit.db"
 
 class AuditStore:
     """审计日志存储类"""
 
-    def __init__(self):
-        self._init_db()
+    def __init__(self, db_path: Path = DB_PATH):
+        self.db_path = db_path
+        # 表结构在应用启动时创建（init_db），首次访问数据库时也会自动创建
+        self._initialized = False
+        # 按工作流节点统计写入次数（节点外的写入记在 None 下）
+        self.write_counts = Counter()
+        # 安全事件与频率限制的写入版本（仪表盘快照据此判断是否需要重新生成）
+        self.revision = 0
+
+    def use_database(self, db_path: Path):
+        """切换数据库文件（回放等场景使用独立数据库）"""
+        self.db_path = db_path
+        self._initialized = False
+
+    def init_db(self):
+        """初始化数据库（幂等）"""
+        if self._initialized:
+            return
+        self._initialized = True
+        try:
+            self._init_db()
+        except Exception:
+            self._initialized = False
+            raise
 
     @contextmanager
     def _get_connection(self):
         """数据库连接上下文管理器"""
-        conn = sqlite3.connect(DB_PATH)
+        if not self._initialized:
+            self.init_db()
+        conn = sqlite3.connect(self.db_path)
         conn.row_factory = sqlite3.Row
         try:
             yield conn
@@ -75,6 +102,7 @@ class AuditStore:
     def log_action(self, task_id: str, agent_type: str, action: str, details: str,
                    severity: str = "info", success: bool = True) -> int:
         """记录审计日志"""
+        self.write_counts[current_node.get()] += 1
         with self._get_connection() as conn:
             cursor = conn.execute("""
                 INSERT INTO audit_logs (
@@ -85,6 +113,8 @@ class AuditStore:
 
     def log_safety_event(self, event_type: str, details: str, task_id: Optional[str] = None):
         """记录安全事件"""
+        self.write_counts[current_node.get()] += 1
+        self.revision += 1
         with self._get_connection() as conn:
             conn.execute("""
                 INSERT INTO safety_events (event_type, details, task_id)
@@ -94,6 +124,8 @@ class AuditStore:
     def log_rate_limit(self, agent_type: str, limit_type: str,
                       limit_value: Optional[int], current_value: int):
         """记录频率限制"""
+        self.write_counts[current_node.get()] += 1
+        self.revision += 1
         now = datetime.now()
         window_end = now.replace(minute=0, second=0, microsecond=0)
         window_start = window_end - timedelta(hours=1)
@@ -0,0 +1,180 @@
+"""
+WebSocket 广播
+客户端按主题订阅（单个任务、单个Agent、全局），每个客户端有独立的有界发送队列与写协程：
+发布消息只入队不等待发送，慢客户端按策略丢弃旧消息或断开，连续的进度更新合并为最新一条；
+每条消息只序列化一次，所有订阅者共享同一个文本帧
+"""
+
+import asyncio
+import itertools
+import os
+from collections import OrderedDict, defaultdict
+from typing import Awaitable, Callable, Dict, Iterable, Optional, Set, Tuple, Union
+
+from core.metrics import metrics
+from core.serialization import dumps_text
+
+# 每个客户端的发送队列上限
+QUEUE_SIZE = int(os.getenv("WS_QUEUE_SIZE", "256"))
+
+# 队列满时的策略：drop 丢弃最旧的消息；disconnect 断开慢客户端
+SLOW_CLIENT_POLICY = os.getenv("WS_SLOW_CLIENT_POLICY", "drop").lower()
+
+# 单条消息发送超时（秒），超时视为客户端失联
+SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "10"))
+
+GLOBAL_TOPIC = "global"
+
+
+def task_topic(task_id: str) -> str:
+    return f"task:{task_id}"
+
+
+def agent_topic(agent_type: str) -> str:
+    return f"agent:{agent_type}"
+
+
+class Client:
+    """单个客户端连接：有界队列 + 写协程"""
+
+    def __init__(self, client_id: str, send: Callable[[str], Awaitable],
+                 close: Optional[Callable[[], Awaitable]] = None,
+                 queue_size: int = QUEUE_SIZE, policy: str = SLOW_CLIENT_POLICY):
+        self.client_id = client_id
+        self._send = send
+        self._close = close
+        self.queue_size = queue_size
+        self.policy = policy
+        self.topics: Set[str] = set()
+        self.dropped = 0
+        self.closed = False
+        self._pending: "OrderedDict[object, str]" = OrderedDict()
+        self._seq = itertools.count()
+        self._ready = asyncio.Event()
+        self._writer = asyncio.create_task(self._write_loop())
+
+    def enqueue(self, message: Union[dict, str], coalesce_key: Optional[str] = None) -> bool:
+        """入队（不等待发送）；coalesce_key 相同的未发送消息只保留最新一条"""
+        if self.closed:
+            return False
+        if not isinstance(message, str):
+            message = dumps_text(message)
+        if coalesce_key is not None and coalesce_key in self._pending:
+            self._pending[coalesce_key] = message
+            metrics.inc("ws_messages_coalesced_total")
+            return True
+
+        if len(self._pending) >= self.queue_size:
+            if self.policy == "disconnect":
+                metrics.inc("ws_slow_client_disconnects_total")
+                asyncio.create_task(self.close())
+                return False
+            self._pending.popitem(last=False)
+            self.dropped += 1
+            metrics.inc("ws_messages_dropped_total")
+
+        key = coalesce_key if coalesce_key is not None else next(self._seq)
+        self._pending[key] = message
+        self._ready.set()
+        return True
+
+    async def _write_loop(self):
+        try:
+            while not self.closed:
+                await self._ready.wait()
+                self._ready.clear()
+                while self._pending and not self.closed:
+                    _, message = self._pending.popitem(last=False)
+                    await asyncio.wait_for(self._send(message), timeout=SEND_TIMEOUT)
+                    metrics.inc("ws_messages_sent_total")
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            print(f"WebSocket client {self.client_id} send failed: {e}")
+            await self.close()
+
+    async def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self._pending.clear()
+        self._ready.set()
+        if self._close:
+            try:
+                await self._close()
+            except Exception:
+                pass
+
+
+class Broadcaster:
+    """主题订阅与广播"""
+
+    def __init__(self):
+        self.clients: Dict[str, Client] = {}
+        self.subscribers: Dict[str, Set[Client]] = defaultdict(set)
+        # 跨进程转发：relay(topics, payload, coalesce_key)，由共享状态后端设置
+        self.relay: Optional[Callable[[Tuple[str, ...], str, Optional[str]], None]] = None
+
+    def connect(self, client_id: str, send: Callable[[str], Awaitable],
+                close: Optional[Callable[[], Awaitable]] = None, topics: Iterable[str] = (GLOBAL_TOPIC,)) -> Client:
+        """登记客户端（同一 client_id 重连时替换旧连接）"""
+        if client_id in self.clients:
+            self.disconnect(self.clients[client_id])
+        client = Client(client_id, send, close)
+        self.clients[client_id] = client
+        for topic in topics:
+            self.subscribe(client, topic)
+        metrics.set("ws_clients", len(self.clients))
+        return client
+
+    def disconnect(self, client: Client):
+        for topic in list(client.topics):
+            self.unsubscribe(client, topic)
+        if self.clients.get(client.client_id) is client:
+            del self.clients[client.client_id]
+        client.closed = True
+        client._writer.cancel()
+        metrics.set("ws_clients", len(self.clients))
+
+    def subscribe(self, client: Client, topic: str):
+        client.topics.add(topic)
+        self.subscribers[topic].add(client)
+
+    def unsubscribe(self, client: Client, topic: str):
+        client.topics.discard(topic)
+        subscribers = self.subscribers.get(topic)
+        if subscribers is not None:
+            subscribers.discard(client)
+            if not subscribers:
+                del self.subscribers[topic]
+
+    def publish(self, topics: Iterable[str], message: dict, coalesce_key: Optional[str] = None) -> int:
+        """向订阅了任一主题的客户端发送一次消息，返回本进程送达的客户端数（只入队，不阻塞调用方）
+
+        设置了 relay 时同时转发给其他进程（多 worker / 多副本）
+        """
+        topics = tuple(topics)
+        metrics.inc("ws_messages_published_total")
+        if self.relay is None and not any(topic in self.subscribers for topic in topics):
+            return 0
+        payload = dumps_text(message)
+        if self.relay is not None:
+            self.relay(topics, payload, coalesce_key)
+        return self.deliver(topics, payload, coalesce_key)
+
+    def deliver(self, topics: Iterable[str], payload: str, coalesce_key: Optional[str] = None) -> int:
+        """只投递给本进程的订阅者（payload 为已序列化的文本帧）"""
+        targets: Set[Client] = set()
+        for topic in topics:
+            targets |= self.subscribers.get(topic, set())
+        delivered = 0
+        for client in targets:
+            if client.closed:
+                self.disconnect(client)
+                continue
+            delivered += client.enqueue(payload, coalesce_key)
+        return delivered
+
+
+# 全局广播实例
+broadcaster = Broadcaster()
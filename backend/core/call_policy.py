@@ -0,0 +1,164 @@
+"""
+LLM调用策略
+按节点/Agent配置截止时间、可重试错误的抖动退避重试，以及基于p95延迟的对冲请求
+"""
+
+import asyncio
+import os
+import random
+import time
+from collections import defaultdict, deque
+from dataclasses import dataclass, replace
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+
+from core.metrics import metrics
+
+# 视为可重试的HTTP状态码
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504, 529}
+
+# 视为可重试的异常类名关键字（兼容 openai / anthropic / httpx 等SDK）
+RETRYABLE_ERROR_NAMES = ("RateLimit", "Timeout", "Connection", "InternalServer", "Overloaded", "ServiceUnavailable")
+
+# 是否启用对冲请求
+HEDGING_ENABLED = os.getenv("LLM_HEDGING", "true").lower() == "true"
+
+
+@dataclass(frozen=True)
+class CallPolicy:
+    """单次LLM调用策略"""
+    timeout: float = 60.0            # 单次尝试超时（秒）
+    deadline: float = 180.0          # 含重试的总截止时间（秒）
+    max_retries: int = 2             # 最大重试次数
+    backoff_base: float = 0.5        # 退避基数（秒）
+    backoff_max: float = 8.0         # 退避上限（秒）
+    hedge: bool = False              # 是否对冲
+    hedge_quantile: float = 0.95     # 对冲延迟取历史延迟的分位数
+    hedge_min_delay: float = 1.0     # 最小对冲延迟（秒）
+    hedge_min_samples: int = 20      # 样本不足时不对冲
+
+
+DEFAULT_POLICY = CallPolicy()
+
+# 各Agent的调用策略
+AGENT_POLICIES: Dict[str, CallPolicy] = {
+    "echo": CallPolicy(timeout=20.0, deadline=60.0),
+}
+
+# 各节点的调用策略（优先于Agent策略）
+NODE_POLICIES: Dict[str, CallPolicy] = {
+    "parse_intention": CallPolicy(timeout=20.0, deadline=60.0),
+    "architect_design": CallPolicy(timeout=90.0, deadline=240.0),
+    "coder_execute": CallPolicy(timeout=120.0, deadline=300.0, hedge=True),
+    "qa_test": CallPolicy(timeout=90.0, deadline=240.0),
+    "reviewer_check": CallPolicy(timeout=90.0, deadline=240.0),
+    "researcher_scan": CallPolicy(timeout=90.0, deadline=240.0, hedge=True),
+    "writer_create": CallPolicy(timeout=90.0, deadline=240.0),
+    "networker_interact": CallPolicy(timeout=60.0, deadline=180.0),
+}
+
+
+def get_call_policy(node: Optional[str] = None, agent_type: Optional[str] = None) -> CallPolicy:
+    """获取调用策略：节点策略 > Agent策略 > 默认策略"""
+    policy = NODE_POLICIES.get(node) or AGENT_POLICIES.get(agent_type) or DEFAULT_POLICY
+    if not HEDGING_ENABLED and policy.hedge:
+        policy = replace(policy, hedge=False)
+    return policy
+
+
+class LatencyTracker:
+    """记录最近的调用延迟，计算分位数"""
+
+    def __init__(self, window: int = 200):
+        self.window = window
+        self._samples: Dict[str, Deque[float]] = defaultdict(lambda: deque(maxlen=self.window))
+
+    def record(self, key: str, seconds: float):
+        self._samples[key].append(seconds)
+
+    def quantile(self, key: str, q: float, min_samples: int = 1) -> Optional[float]:
+        samples = self._samples.get(key)
+        if not samples or len(samples) < min_samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+latency_tracker = LatencyTracker()
+
+
+def is_retryable(error: BaseException) -> bool:
+    """判断错误是否可重试"""
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError, ConnectionError)):
+        return True
+    status_code = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    if status_code in RETRYABLE_STATUS_CODES:
+        return True
+    return any(name in type(error).__name__ for name in RETRYABLE_ERROR_NAMES)
+
+
+def backoff_delay(policy: CallPolicy, attempt: int) -> float:
+    """全抖动指数退避"""
+    return random.uniform(0, min(policy.backoff_max, policy.backoff_base * (2 ** attempt)))
+
+
+async def _hedged(call: Callable[[], Awaitable[Any]], policy: CallPolicy, key: str) -> Any:
+    """发出请求；超过p95延迟仍未返回时再发一个，取先成功的结果"""
+    delay = None
+    if policy.hedge:
+        p = latency_tracker.quantile(key, policy.hedge_quantile, policy.hedge_min_samples)
+        if p is not None:
+            delay = max(p, policy.hedge_min_delay)
+
+    primary = asyncio.ensure_future(call())
+    if delay is None:
+        return await primary
+
+    done, _ = await asyncio.wait({primary}, timeout=delay)
+    if done:
+        return primary.result()
+
+    metrics.inc("llm_hedges_total", node=key)
+    hedge = asyncio.ensure_future(call())
+    pending = {primary, hedge}
+    error: Optional[BaseException] = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is hedge:
+                        metrics.inc("llm_hedge_wins_total", node=key)
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def call_with_policy(call: Callable[[], Awaitable[Any]], policy: CallPolicy, key: str) -> Any:
+    """按策略执行调用：单次超时 + 总截止时间 + 可重试错误退避重试 + 对冲"""
+    started = time.perf_counter()
+    attempt = 0
+    while True:
+        remaining = policy.deadline - (time.perf_counter() - started)
+        attempt_started = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(_hedged(call, policy, key), timeout=min(policy.timeout, remaining))
+            latency_tracker.record(key, time.perf_counter() - attempt_started)
+            metrics.inc("llm_calls_total", node=key)
+            return result
+        except Exception as e:
+            # 超时与失败的尝试也计入延迟样本（超时即为超时值），否则后端变慢时p95偏低、对冲过于激进
+            latency_tracker.record(key, time.perf_counter() - attempt_started)
+            if isinstance(e, asyncio.TimeoutError):
+                metrics.inc("llm_timeouts_total", node=key)
+            delay = backoff_delay(policy, attempt)
+            elapsed = time.perf_counter() - started
+            if attempt >= policy.max_retries or not is_retryable(e) or elapsed + delay >= policy.deadline:
+                metrics.inc("llm_failures_total", node=key)
+                raise
+            attempt += 1
+            metrics.inc("llm_retries_total", node=key)
+            print(f"LLM call {key} failed ({type(e).__name__}: {e}), retry {attempt}/{policy.max_retries} in {delay:.2f}s")
+            await asyncio.sleep(delay)
@@ -0,0 +1,239 @@
+"""
+工作流节点检查点存储模块
+每个节点完成后持久化其状态增量，进程重启或节点异常后可从最后完成的节点继续；
+执行中的工作流由所属进程定期续租，租约过期的工作流才视为中断，恢复前原子地认领
+"""
+
+import json
+import os
+import socket
+import sqlite3
+import time
+import uuid
+from typing import List, Optional, Dict, Any
+from pathlib import Path
+from contextlib import contextmanager
+
+# 数据库文件路径
+DB_PATH = Path(__file__).parent.parent / "checkpoints.db"
+
+# 执行中工作流的租约秒数：所属进程停止续租超过该时间后，其他进程可以认领并恢复
+RUN_LEASE = float(os.getenv("CHECKPOINT_RUN_LEASE", "30"))
+
+# 已结束（完成或失败）的工作流检查点保留秒数，期间可以派生或手动恢复，之后清理
+RUN_RETENTION = float(os.getenv("CHECKPOINT_RETENTION", str(7 * 24 * 3600)))
+
+
+class CheckpointStore:
+    """节点检查点存储类"""
+
+    def __init__(self, db_path: Path = DB_PATH, lease: float = RUN_LEASE, retention: float = RUN_RETENTION):
+        self.db_path = db_path
+        self.lease = lease
+        self.retention = retention
+        # 本进程的标识，写入所执行工作流的 owner 字段
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        # 表结构在应用启动时创建（init_db），首次访问数据库时也会自动创建
+        self._initialized = False
+
+    def init_db(self):
+        """初始化数据库（幂等）"""
+        if self._initialized:
+            return
+        self._initialized = True
+        try:
+            self._init_db()
+        except Exception:
+            self._initialized = False
+            raise
+
+    @contextmanager
+    def _get_connection(self):
+        """数据库连接上下文管理器"""
+        if not self._initialized:
+            self.init_db()
+        conn = sqlite3.connect(self.db_path)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def _init_db(self):
+        """初始化数据库表"""
+        with self._get_connection() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS workflow_runs (
+                    task_id TEXT PRIMARY KEY,
+                    agent_type TEXT NOT NULL,
+                    message TEXT NOT NULL,
+                    initial_state TEXT NOT NULL,
+                    status TEXT DEFAULT 'running',
+                    owner TEXT,
+                    lease_until REAL DEFAULT 0,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+
+            # 旧版本数据库没有 owner / lease_until 字段
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(workflow_runs)")}
+            if "owner" not in columns:
+                conn.execute("ALTER TABLE workflow_runs ADD COLUMN owner TEXT")
+            if "lease_until" not in columns:
+                conn.execute("ALTER TABLE workflow_runs ADD COLUMN lease_until REAL DEFAULT 0")
+
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS node_checkpoints (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    task_id TEXT NOT NULL,
+                    node TEXT NOT NULL,
+                    delta TEXT NOT NULL,
+                    duration REAL DEFAULT 0,
+                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    UNIQUE (task_id, node)
+                )
+            """)
+
+    def start_run(self, task_id: str, agent_type: str, message: str, initial_state: dict):
+        """记录一次工作流执行的初始状态（由本进程持有）"""
+        with self._get_connection() as conn:
+            conn.execute("""
+                INSERT OR REPLACE INTO workflow_runs (
+                    task_id, agent_type, message, initial_state, status, owner, lease_until
+                ) VALUES (?, ?, ?, ?, 'running', ?, ?)
+            """, (task_id, agent_type, message,
+                  json.dumps(initial_state, ensure_ascii=False, default=str),
+                  self.owner, time.time() + self.lease))
+
+    def finish_run(self, task_id: str, status: str):
+        """更新工作流执行状态（completed / failed / running）；重新置为 running 时由本进程持有"""
+        with self._get_connection() as conn:
+            if status == "running":
+                conn.execute("""
+                    UPDATE workflow_runs
+                    SET status = ?, owner = ?, lease_until = ?, updated_at = CURRENT_TIMESTAMP
+                    WHERE task_id = ?
+                """, (status, self.owner, time.time() + self.lease, task_id))
+            else:
+                conn.execute("""
+                    UPDATE workflow_runs
+                    SET status = ?, lease_until = 0, updated_at = CURRENT_TIMESTAMP
+                    WHERE task_id = ?
+                """, (status, task_id))
+
+    def claim_run(self, task_id: str) -> bool:
+        """原子地认领租约已过期的中断（或失败后手动恢复的）工作流，多个进程同时认领时只有一个成功"""
+        now = time.time()
+        with self._get_connection() as conn:
+            cursor = conn.execute("""
+                UPDATE workflow_runs
+                SET owner = ?, lease_until = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE task_id = ? AND status IN ('running', 'failed') AND COALESCE(lease_until, 0) < ?
+            """, (self.owner, now + self.lease, task_id, now))
+            return cursor.rowcount == 1
+
+    def release_run(self, task_id: str):
+        """放弃认领（未能恢复执行时），让其他进程可以立即认领"""
+        with self._get_connection() as conn:
+            conn.execute("""
+                UPDATE workflow_runs SET lease_until = 0
+                WHERE task_id = ? AND owner = ? AND status IN ('running', 'failed')
+            """, (task_id, self.owner))
+
+    def renew_runs(self) -> int:
+        """为本进程执行中的工作流续租，返回续租数量"""
+        with self._get_connection() as conn:
+            cursor = conn.execute("""
+                UPDATE workflow_runs SET lease_until = ?
+                WHERE owner = ? AND status = 'running'
+            """, (time.time() + self.lease, self.owner))
+            return cursor.rowcount
+
+    def release_runs(self):
+        """进程正常退出时释放全部租约，重启后的进程可以立即恢复这些工作流"""
+        with self._get_connection() as conn:
+            conn.execute("""
+                UPDATE workflow_runs SET lease_until = 0
+                WHERE owner = ? AND status = 'running'
+            """, (self.owner,))
+
+    def get_run(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """获取工作流执行记录"""
+        with self._get_connection() as conn:
+            cursor = conn.execute("""
+                SELECT * FROM workflow_runs WHERE task_id = ?
+            """, (task_id,))
+            row = cursor.fetchone()
+            if not row:
+                return None
+            run = dict(row)
+            run["initial_state"] = json.loads(run["initial_state"])
+            return run
+
+    def list_interrupted_runs(self) -> List[Dict[str, Any]]:
+        """获取仍处于运行状态但租约已过期的工作流（所属进程中断时未能结束）"""
+        with self._get_connection() as conn:
+            cursor = conn.execute("""
+                SELECT task_id FROM workflow_runs
+                WHERE status = 'running' AND COALESCE(lease_until, 0) < ?
+                ORDER BY created_at
+            """, (time.time(),))
+            task_ids = [row["task_id"] for row in cursor.fetchall()]
+        return [self.get_run(task_id) for task_id in task_ids]
+
+    def save_node(self, task_id: str, node: str, delta: dict, duration: float = 0.0):
+        """保存节点完成后的状态增量"""
+        with self._get_connection() as conn:
+            conn.execute("""
+                INSERT OR REPLACE INTO node_checkpoints (task_id, node, delta, duration)
+                VALUES (?, ?, ?, ?)
+            """, (task_id, node, json.dumps(delta, ensure_ascii=False, default=str), duration))
+
+    def load_nodes(self, task_id: str) -> Dict[str, dict]:
+        """按完成顺序加载已完成节点的状态增量"""
+        with self._get_connection() as conn:
+            cursor = conn.execute("""
+                SELECT node, delta FROM node_checkpoints
+                WHERE task_id = ?
+                ORDER BY id
+            """, (task_id,))
+            return {row["node"]: json.loads(row["delta"]) for row in cursor.fetchall()}
+
+    def copy_nodes(self, source_task_id: str, target_task_id: str, nodes: List[str],
+                   strip_keys: List[str] = ()):
+        """把源任务中指定节点的检查点复制到目标任务，可去掉被覆盖的字段"""
+        deltas = self.load_nodes(source_task_id)
+        for node, delta in deltas.items():
+            if node not in nodes:
+                continue
+            delta = {k: v for k, v in delta.items() if k not in strip_keys}
+            self.save_node(target_task_id, node, delta)
+
+    def prune_runs(self) -> int:
+        """清理结束超过保留时长的工作流及其检查点，返回清理数量"""
+        with self._get_connection() as conn:
+            task_ids = [row["task_id"] for row in conn.execute("""
+                SELECT task_id FROM workflow_runs
+                WHERE status IN ('completed', 'failed') AND updated_at < datetime('now', ?)
+            """, (f"-{int(self.retention)} seconds",))]
+            for start in range(0, len(task_ids), 500):
+                batch = task_ids[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                conn.execute(f"DELETE FROM node_checkpoints WHERE task_id IN ({placeholders})", batch)
+                conn.execute(f"DELETE FROM workflow_runs WHERE task_id IN ({placeholders})", batch)
+        return len(task_ids)
+
+    def delete_run(self, task_id: str):
+        """删除工作流执行记录及其检查点"""
+        with self._get_connection() as conn:
+            conn.execute("DELETE FROM node_checkpoints WHERE task_id = ?", (task_id,))
+            conn.execute("DELETE FROM workflow_runs WHERE task_id = ?", (task_id,))
+
+
+# 全局检查点存储实例
+checkpoint_store = CheckpointStore()
@@ -0,0 +1,229 @@
+"""
+响应压缩
+ASGI 中间件：按 Accept-Encoding 对超过阈值的文本类响应做 brotli（已安装时）或 gzip 压缩；
+SSE 等事件流、已压缩的响应与小响应原样返回，流式响应逐块压缩并立即刷新
+"""
+
+import gzip
+import os
+import zlib
+from typing import List, Optional, Tuple
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# 小于该字节数的响应不压缩
+MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "5"))
+
+COMPRESSIBLE_TYPES = ("text/", "application/json", "application/javascript", "application/xml", "image/svg+xml")
+
+# 需要逐条实时送达的流，压缩缓冲会打断推送
+EXCLUDED_TYPES = ("text/event-stream",)
+
+Headers = List[Tuple[bytes, bytes]]
+
+
+def accepted_encodings(accept_encoding: str) -> List[str]:
+    """解析 Accept-Encoding，返回 q>0 的编码（小写）"""
+    accepted = []
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                if float(params[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        if name:
+            accepted.append(name.strip().lower())
+    return accepted
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """选择响应编码：优先 br（已安装 brotli 时），其次 gzip"""
+    accepted = accepted_encodings(accept_encoding)
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+def encoded_etag(etag: str, encoding: str) -> str:
+    """编码后表示的 ETag：强 ETag 加上编码后缀，与未编码表示区分；弱 ETag 原样返回"""
+    if etag.startswith("W/") or not etag.endswith('"'):
+        return etag
+    return f'{etag[:-1]}-{encoding}"'
+
+
+def identity_etag(etag: str) -> str:
+    """去掉 encoded_etag 添加的编码后缀，得到未编码表示的 ETag"""
+    for encoding in ("br", "gzip"):
+        suffix = f'-{encoding}"'
+        if etag.endswith(suffix):
+            return etag[:-len(suffix)] + '"'
+    return etag
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    """一次性压缩完整响应体"""
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+class _StreamCompressor:
+    """流式压缩：每块压缩后立即刷新，客户端无需等待整个响应"""
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "br":
+            self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def chunk(self, data: bytes) -> bytes:
+        if self.encoding == "br":
+            return self._compressor.process(data) + self._compressor.flush()
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        if self.encoding == "br":
+            return self._compressor.finish()
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+def _header(headers: Headers, name: bytes) -> Optional[bytes]:
+    for key, value in headers:
+        if key.lower() == name:
+            return value
+    return None
+
+
+def _without(headers: Headers, *names: bytes) -> Headers:
+    return [(key, value) for key, value in headers if key.lower() not in names]
+
+
+def _add_vary(headers: Headers) -> Headers:
+    vary = _header(headers, b"vary")
+    if vary is None:
+        return headers + [(b"vary", b"Accept-Encoding")]
+    if b"accept-encoding" in vary.lower():
+        return headers
+    return _without(headers, b"vary") + [(b"vary", vary + b", Accept-Encoding")]
+
+
+def _encoded_headers(headers: Headers, encoding: str) -> Headers:
+    """压缩后的响应头：去掉 Content-Length，加上 Vary 与 Content-Encoding，强 ETag 改为编码版本"""
+    etag = _header(headers, b"etag")
+    headers = _add_vary(_without(headers, b"content-length", b"etag"))
+    if etag is not None:
+        headers.append((b"etag", encoded_etag(etag.decode("latin-1"), encoding).encode("latin-1")))
+    headers.append((b"content-encoding", encoding.encode()))
+    return headers
+
+
+def should_compress(headers: Headers) -> bool:
+    """按内容类型与是否已编码判断"""
+    if _header(headers, b"content-encoding") is not None:
+        return False
+    content_type = (_header(headers, b"content-type") or b"").decode("latin-1").lower()
+    if content_type.startswith(EXCLUDED_TYPES):
+        return False
+    return content_type.startswith(COMPRESSIBLE_TYPES)
+
+
+class CompressionMiddleware:
+    """按阈值压缩 HTTP 响应（WebSocket 使用 permessage-deflate，不经过这里）"""
+
+    def __init__(self, app, minimum_size: int = MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        accept = _header(scope.get("headers", []), b"accept-encoding")
+        encoding = choose_encoding(accept.decode("latin-1")) if accept else None
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        if_none_match = _header(scope.get("headers", []), b"if-none-match")
+        await self.app(scope, receive, _CompressingSend(send, encoding, self.minimum_size,
+                                                        if_none_match.decode("latin-1") if if_none_match else None))
+
+
+class _CompressingSend:
+    """包装 send：缓存响应头，根据首个响应体决定整体压缩、流式压缩或原样发送"""
+
+    def __init__(self, send, encoding: str, minimum_size: int, if_none_match: Optional[str] = None):
+        self.send = send
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        self.if_none_match = if_none_match
+        self.start: Optional[dict] = None
+        self.passthrough = False
+        self.stream: Optional[_StreamCompressor] = None
+
+    async def __call__(self, message: dict):
+        if message["type"] == "http.response.start":
+            self.start = message
+            headers = list(message.get("headers", []))
+            if message["status"] == 304:
+                message = self._not_modified(message, headers)
+            self.passthrough = message["status"] in (204, 304) or not should_compress(headers)
+            if self.passthrough:
+                await self.send(message)
+            return
+
+        if message["type"] != "http.response.body" or self.passthrough:
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        headers = list(self.start.get("headers", []))
+
+        if self.stream is not None:
+            # 流式响应的后续块
+            data = self.stream.chunk(body) if body else b""
+            if not more_body:
+                data += self.stream.finish()
+            await self.send({"type": "http.response.body", "body": data, "more_body": more_body})
+            return
+
+        if not more_body:
+            # 完整响应：小于阈值时原样发送（内容变大后会压缩，仍需声明随 Accept-Encoding 变化）
+            if len(body) < self.minimum_size:
+                self.passthrough = True
+                await self.send({**self.start, "headers": _add_vary(headers)})
+                await self.send(message)
+                return
+            compressed = compress(body, self.encoding)
+            headers = _encoded_headers(headers, self.encoding)
+            headers.append((b"content-length", str(len(compressed)).encode()))
+            await self.send({**self.start, "headers": headers})
+            await self.send({"type": "http.response.body", "body": compressed, "more_body": False})
+            return
+
+        # 流式响应：去掉 Content-Length，逐块压缩
+        self.stream = _StreamCompressor(self.encoding)
+        await self.send({**self.start, "headers": _encoded_headers(headers, self.encoding)})
+        await self.send({"type": "http.response.body", "body": self.stream.chunk(body), "more_body": True})
+
+    def _not_modified(self, message: dict, headers: Headers) -> dict:
+        """客户端缓存的是压缩版本时，304 响应返回该版本的 ETag"""
+        etag = _header(headers, b"etag")
+        if etag is None or not self.if_none_match:
+            return message
+        encoded = encoded_etag(etag.decode("latin-1"), self.encoding)
+        if encoded not in (tag.strip() for tag in self.if_none_match.split(",")):
+            return message
+        headers = _add_vary(_without(headers, b"etag")) + [(b"etag", encoded.encode("latin-1"))]
+        return {**message, "headers": headers}
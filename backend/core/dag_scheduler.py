@@ -0,0 +1,305 @@
+"""
+依赖感知的DAG调度器
+节点声明读写的 AgentState 字段，调度器据此推导最大并行DAG、并发执行并报告关键路径
+"""
+
+import asyncio
+import inspect
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple, get_type_hints
+
+
+# 当前正在执行的节点名（在节点函数及其线程内可见，供LLM录制、审计计数等使用）
+current_node: ContextVar[Optional[str]] = ContextVar("current_node", default=None)
+
+
+def append(left: Optional[list], right: Optional[list]) -> list:
+    """追加合并：返回新列表，不修改已交给运行中节点的状态快照"""
+    return list(left or []) + list(right or [])
+
+
+def keep_max(left: Any, right: Any) -> Any:
+    """取最大值合并"""
+    if left is None:
+        return right
+    return max(left, right)
+
+
+def reducers_from(state_type: type) -> Dict[str, Callable[[Any, Any], Any]]:
+    """从 TypedDict 的 Annotated[类型, 合并函数] 声明中提取各字段的合并函数"""
+    reducers = {}
+    for key, hint in get_type_hints(state_type, include_extras=True).items():
+        for meta in getattr(hint, '__metadata__', ()):
+            if callable(meta):
+                reducers[key] = meta
+    return reducers
+
+
+@dataclass
+class NodeSpec:
+    """工作流节点声明"""
+    name: str
+    func: Callable[[dict], Any]
+    reads: Tuple[str, ...] = ()
+    writes: Tuple[str, ...] = ()
+
+    def __post_init__(self):
+        self.reads = tuple(self.reads)
+        self.writes = tuple(self.writes)
+
+
+@dataclass
+class ScheduleReport:
+    """一次调度执行的报告"""
+    workflow: str
+    levels: List[List[str]]
+    durations: Dict[str, float] = field(default_factory=dict)
+    critical_path: List[str] = field(default_factory=list)
+    critical_path_seconds: float = 0.0
+    wall_seconds: float = 0.0
+    restored: List[str] = field(default_factory=list)
+
+    def to_dict(self) -> dict:
+        return {
+            "workflow": self.workflow,
+            "levels": self.levels,
+            "durations": {k: round(v, 4) for k, v in self.durations.items()},
+            "critical_path": self.critical_path,
+            "critical_path_seconds": round(self.critical_path_seconds, 4),
+            "wall_seconds": round(self.wall_seconds, 4),
+            "restored": self.restored,
+        }
+
+
+class WorkflowDAG:
+    """根据节点读写声明推导依赖关系
+
+    声明顺序即语义顺序，节点B依赖于更早声明的节点A，当且仅当：
+    - B 读取 A 写入的字段（写后读）
+    - B 写入 A 读取的字段（读后写，保证A读到旧值）
+    - B 与 A 写入同一字段，且该字段没有合并函数（写后写）
+    """
+
+    def __init__(self, nodes: Iterable[NodeSpec], commutative_keys: Iterable[str] = ()):
+        self.nodes: Dict[str, NodeSpec] = {}
+        for node in nodes:
+            if node.name in self.nodes:
+                raise ValueError(f"重复的节点名称: {node.name}")
+            self.nodes[node.name] = node
+
+        self.order: List[str] = list(self.nodes)
+        self.commutative_keys: Set[str] = set(commutative_keys)
+        self.deps: Dict[str, Set[str]] = self._build_deps()
+
+    def _build_deps(self) -> Dict[str, Set[str]]:
+        """推导每个节点的直接依赖"""
+        deps: Dict[str, Set[str]] = {}
+        for i, name in enumerate(self.order):
+            node = self.nodes[name]
+            reads = set(node.reads)
+            writes = set(node.writes) - self.commutative_keys
+            deps[name] = set()
+            for earlier_name in self.order[:i]:
+                earlier = self.nodes[earlier_name]
+                earlier_writes = set(earlier.writes)
+                if (reads & earlier_writes
+                        or set(node.writes) & set(earlier.reads)
+                        or writes & (earlier_writes - self.commutative_keys)):
+                    deps[name].add(earlier_name)
+
+        # 传递归约：去掉能经由其他依赖间接到达的边
+        for name in self.order:
+            indirect = set()
+            for dep in deps[name]:
+                indirect |= self.ancestors(dep, deps)
+            deps[name] -= indirect
+        return deps
+
+    def ancestors(self, name: str, deps: Optional[Dict[str, Set[str]]] = None) -> Set[str]:
+        """获取节点的全部上游节点"""
+        deps = deps if deps is not None else self.deps
+        result: Set[str] = set()
+        stack = list(deps[name])
+        while stack:
+            current = stack.pop()
+            if current not in result:
+                result.add(current)
+                stack.extend(deps[current])
+        return result
+
+    def descendants(self, name: str) -> Set[str]:
+        """获取节点的全部下游节点"""
+        return {other for other in self.order if name in self.ancestors(other)}
+
+    def affected_nodes(self, keys: Iterable[str] = (), nodes: Iterable[str] = ()) -> Set[str]:
+        """字段或节点输入变化后需要重新计算的节点：直接读取这些字段的节点、指定节点及其全部下游"""
+        keys = set(keys)
+        roots = {name for name in self.order if keys & set(self.nodes[name].reads)}
+        roots |= {name for name in nodes if name in self.nodes}
+
+        affected = set(roots)
+        for name in roots:
+            affected |= self.descendants(name)
+        return affected
+
+    def levels(self) -> List[List[str]]:
+        """按拓扑层级分组，同一层内的节点可以并发执行"""
+        depth: Dict[str, int] = {}
+        for name in self.order:
+            depth[name] = max((depth[d] + 1 for d in self.deps[name]), default=0)
+
+        levels: List[List[str]] = [[] for _ in range(max(depth.values(), default=-1) + 1)]
+        for name in self.order:
+            levels[depth[name]].append(name)
+        return levels
+
+    def critical_path(self, durations: Dict[str, float]) -> Tuple[List[str], float]:
+        """根据各节点耗时计算关键路径（最长路径）"""
+        best: Dict[str, float] = {}
+        prev: Dict[str, Optional[str]] = {}
+        for name in self.order:
+            parent = max(self.deps[name], key=lambda d: best[d], default=None)
+            best[name] = durations.get(name, 0.0) + (best[parent] if parent else 0.0)
+            prev[name] = parent
+
+        if not best:
+            return [], 0.0
+
+        tail = max(self.order, key=lambda n: best[n])
+        path = []
+        current: Optional[str] = tail
+        while current:
+            path.append(current)
+            current = prev[current]
+        return list(reversed(path)), best[tail]
+
+
+class ListenerGroup:
+    """把节点事件依次转发给多个 listener（各自只需实现关心的回调）"""
+
+    def __init__(self, *listeners):
+        self.listeners = [listener for listener in listeners if listener is not None]
+
+    def _forward(self, hook: str, *args):
+        for listener in self.listeners:
+            if hasattr(listener, hook):
+                getattr(listener, hook)(*args)
+
+    def on_node_start(self, name: str):
+        self._forward('on_node_start', name)
+
+    def on_node_end(self, name: str, delta: dict, elapsed: float, state: dict):
+        self._forward('on_node_end', name, delta, elapsed, state)
+
+    def on_node_error(self, name: str, error: BaseException):
+        self._forward('on_node_error', name, error)
+
+
+class DAGWorkflow:
+    """按DAG并发执行节点的工作流，接口与编译后的图保持一致（ainvoke）"""
+
+    def __init__(self, name: str, nodes: Iterable[NodeSpec],
+                 reducers: Optional[Dict[str, Callable[[Any, Any], Any]]] = None):
+        self.name = name
+        self.reducers = dict(reducers or {})
+        self.dag = WorkflowDAG(nodes, commutative_keys=self.reducers)
+
+    async def _run_node(self, node: NodeSpec, state: dict) -> Tuple[dict, float]:
+        """执行单个节点，同步节点放到线程中运行以免阻塞事件循环"""
+        current_node.set(node.name)
+        started = time.perf_counter()
+        if inspect.iscoroutinefunction(node.func):
+            result = await node.func(state)
+        else:
+            result = await asyncio.to_thread(node.func, state)
+        elapsed = time.perf_counter() - started
+
+        # 节点只返回变化的字段，这里只采纳其声明写入的部分
+        result = result or {}
+        delta = {key: result[key] for key in node.writes if key in result}
+        return delta, elapsed
+
+    def _apply(self, state: dict, delta: dict):
+        """把节点增量合并进状态，声明了合并函数的字段交给合并函数处理"""
+        for key, value in delta.items():
+            reducer = self.reducers.get(key)
+            state[key] = reducer(state.get(key), value) if reducer else value
+
+    async def run(self, initial_state: dict, checkpointer=None, listener=None) -> Tuple[dict, ScheduleReport]:
+        """执行工作流，返回最终状态与调度报告
+
+        传入 checkpointer 时，按 task_id 恢复已完成节点的增量并跳过这些节点，
+        每个节点完成后保存其增量。
+        listener 可实现 on_node_start(name) / on_node_end(name, delta, elapsed, state) /
+        on_node_error(name, error)，多个 listener 用 ListenerGroup 组合
+        """
+        dag = self.dag
+        state = dict(initial_state)
+        report = ScheduleReport(workflow=self.name, levels=dag.levels())
+        task_id = state.get('task_id')
+        if not task_id:
+            checkpointer = None
+
+        pending = list(dag.order)
+        done: Set[str] = set()
+
+        if checkpointer:
+            completed = await asyncio.to_thread(checkpointer.load_nodes, task_id)
+            for name in dag.order:
+                if name in completed:
+                    self._apply(state, completed[name])
+                    pending.remove(name)
+                    done.add(name)
+                    report.restored.append(name)
+
+        running: Dict[asyncio.Task, str] = {}
+        started = time.perf_counter()
+
+        try:
+            while pending or running:
+                # 启动所有依赖已满足的节点，每个节点拿到当前状态的快照
+                for name in [n for n in pending if dag.deps[n] <= done]:
+                    pending.remove(name)
+                    if hasattr(listener, 'on_node_start'):
+                        listener.on_node_start(name)
+                    task = asyncio.create_task(self._run_node(dag.nodes[name], dict(state)))
+                    running[task] = name
+
+                finished, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+
+                # 同时完成的节点按声明顺序合并，保证结果确定
+                for task in sorted(finished, key=lambda t: dag.order.index(running[t])):
+                    name = running.pop(task)
+                    try:
+                        delta, elapsed = task.result()
+                    except Exception as e:
+                        if hasattr(listener, 'on_node_error'):
+                            listener.on_node_error(name, e)
+                        raise
+                    self._apply(state, delta)
+                    report.durations[name] = elapsed
+                    done.add(name)
+                    if checkpointer:
+                        await asyncio.to_thread(checkpointer.save_node, task_id, name, delta, elapsed)
+                    if hasattr(listener, 'on_node_end'):
+                        listener.on_node_end(name, delta, elapsed, state)
+        except BaseException:
+            for task in running:
+                task.cancel()
+            raise
+
+        report.wall_seconds = time.perf_counter() - started
+        report.critical_path, report.critical_path_seconds = dag.critical_path(report.durations)
+        return state, report
+
+    async def ainvoke(self, initial_state: dict, checkpointer=None, listener=None) -> dict:
+        """执行工作流并把调度报告写入状态的 schedule 字段"""
+        state, report = await self.run(initial_state, checkpointer=checkpointer, listener=listener)
+        state["schedule"] = report.to_dict()
+        return state
+
+    def invoke(self, initial_state: dict) -> dict:
+        """同步执行工作流"""
+        return asyncio.run(self.ainvoke(initial_state))
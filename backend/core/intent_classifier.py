@@ -0,0 +1,129 @@
+"""
+Echo意图快速分类
+在调用LLM之前用关键词（或可选的本地小模型）判断任务是纯技术还是纯市场，
+置信度足够时直接拆解任务，不确定时才交给LLM
+"""
+
+import asyncio
+import os
+import re
+from dataclasses import dataclass
+from typing import Optional
+
+from core.metrics import metrics
+
+# 是否启用快速分类
+INTENT_FAST_PATH = os.getenv("INTENT_FAST_PATH", "true").lower() == "true"
+
+# 置信度达到阈值才直接分流
+INTENT_CONFIDENCE_THRESHOLD = float(os.getenv("INTENT_CONFIDENCE_THRESHOLD", "0.6"))
+
+# 可选的本地分类模型（joblib 序列化的 scikit-learn 管道，类别为 tech / market / mixed）
+INTENT_MODEL_PATH = os.getenv("INTENT_MODEL_PATH")
+
+# 技术类关键词
+TECH_KEYWORDS = [
+    "api", "接口", "代码", "bug", "修复", "重构", "数据库", "sql", "后端", "前端", "部署",
+    "测试用例", "单元测试", "性能", "架构", "服务", "函数", "模块", "脚本", "python",
+    "javascript", "docker", "缓存", "算法", "依赖", "编译", "报错", "异常", "并发", "sdk",
+]
+
+# 市场类关键词
+MARKET_KEYWORDS = [
+    "推广", "营销", "市场", "宣传", "文案", "推文", "博客", "社区", "用户增长", "品牌",
+    "发布说明", "release notes", "公告", "运营", "社交", "媒体", "twitter", "活动", "竞品",
+    "调研报告", "传播", "粉丝", "广告", "seo",
+]
+
+
+def _keyword_pattern(keywords) -> re.Pattern:
+    """英文关键词要求前后不是字母或数字（避免 capital 命中 api、seoul 命中 seo），中文关键词直接匹配
+
+    中文字符在 Python 正则中也属于 \\w，\\b 无法识别“修复api接口”这类中英混排，因此只按 ASCII 字母数字判断边界
+    """
+    parts = []
+    for keyword in keywords:
+        escaped = re.escape(keyword)
+        parts.append(f"(?<![a-z0-9]){escaped}(?![a-z0-9])" if keyword.isascii() else escaped)
+    return re.compile("|".join(parts))
+
+
+_TECH_PATTERN = _keyword_pattern(TECH_KEYWORDS)
+_MARKET_PATTERN = _keyword_pattern(MARKET_KEYWORDS)
+
+
+@dataclass
+class IntentResult:
+    """分类结果"""
+    label: str          # tech / market / mixed
+    confidence: float
+    source: str         # keywords / model
+
+    @property
+    def confident(self) -> bool:
+        return self.label != "mixed" and self.confidence >= INTENT_CONFIDENCE_THRESHOLD
+
+
+class IntentClassifier:
+    """意图分类器"""
+
+    def __init__(self, model_path: Optional[str] = INTENT_MODEL_PATH):
+        self.model_path = model_path
+        self._model = None
+        self._model_loaded = False
+        self.total = 0
+        self.hits = 0
+
+    def load_model(self):
+        """加载本地模型（阻塞，启动时在线程中预加载），未安装 joblib 或加载失败时只用关键词"""
+        if not self._model_loaded:
+            self._model_loaded = True
+            if self.model_path:
+                try:
+                    import joblib
+                    self._model = joblib.load(self.model_path)
+                except Exception as e:
+                    print(f"Intent model unavailable ({e}), using keywords only")
+        return self._model
+
+    def classify_keywords(self, task: str) -> IntentResult:
+        """按关键词命中数分类：只命中一类时，命中越多置信度越高"""
+        text = task.lower()
+        tech = len(_TECH_PATTERN.findall(text))
+        market = len(_MARKET_PATTERN.findall(text))
+        if tech and market or not (tech or market):
+            return IntentResult("mixed", 0.0, "keywords")
+        hits = max(tech, market)
+        return IntentResult("tech" if tech else "market", hits / (hits + 1), "keywords")
+
+    def classify(self, task: str) -> IntentResult:
+        """分类并记录指标"""
+        result = self.classify_keywords(task)
+        model = self.load_model() if not result.confident else None
+        if model is not None:
+            try:
+                probabilities = model.predict_proba([task])[0]
+                best = probabilities.argmax()
+                result = IntentResult(str(model.classes_[best]), float(probabilities[best]), "model")
+            except Exception as e:
+                # 模型推理失败时沿用关键词结果
+                metrics.inc("echo_intent_model_errors_total")
+                print(f"Intent model prediction failed ({e}), using keywords")
+
+        self.total += 1
+        self.hits += result.confident
+        outcome = "hit" if result.confident else "fallback"
+        metrics.inc("echo_intent_fast_path_total", outcome=outcome, label=result.label, source=result.source)
+        metrics.set("echo_intent_fast_path_hit_rate", self.hits / self.total)
+        metrics.set("echo_intent_confidence_threshold", INTENT_CONFIDENCE_THRESHOLD)
+        return result
+
+    async def aclassify(self, task: str) -> IntentResult:
+        """异步分类：需要加载或调用本地模型时在线程中执行，不阻塞事件循环"""
+        if self.model_path and not self.classify_keywords(task).confident:
+            return await asyncio.to_thread(self.classify, task)
+        return self.classify(task)
+
+
+# 全局分类器实例
+intent_classifier = IntentClassifier()
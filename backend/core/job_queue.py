@@ -0,0 +1,336 @@
+"""
+持久化任务队列
+SQLite 存储的工作流任务队列，供 API 进程与 worker 进程共享：
+- 入队后即落盘，API 进程重启不丢任务
+- worker 领取任务时加租约（可见性超时），租约到期未续期的任务重新可见，由其他 worker 接手（从检查点恢复）
+- worker 把任务状态与事件写入回报表，由 API 进程取走后更新任务记录并推送给订阅者
+"""
+
+import json
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from core.metrics import metrics
+
+# 数据库文件路径
+DB_PATH = Path(os.getenv("JOB_QUEUE_DB", Path(__file__).parent.parent / "jobs.db"))
+
+# 租约时长（秒）：worker 每隔 1/3 租约续期，进程崩溃后最多这么久任务重新可见
+VISIBILITY_TIMEOUT = float(os.getenv("JOB_VISIBILITY_TIMEOUT", "30"))
+
+# 同一任务最多领取次数（反复导致 worker 崩溃的任务不再重试）
+MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+
+# 排队任务数上限，超过时拒绝新任务
+MAX_DEPTH = int(os.getenv("JOB_QUEUE_MAX_DEPTH", "1000"))
+
+# 进入队列的任务状态（排队中或已被领取）
+PENDING_STATUSES = ("queued", "running")
+
+
+class QueueFull(RuntimeError):
+    """队列已满"""
+
+
+class JobPending(RuntimeError):
+    """任务仍在队列中（排队或执行中），不能重复入队"""
+
+
+class JobQueue:
+    """任务队列与回报表"""
+
+    def __init__(self, db_path: Path = DB_PATH, visibility_timeout: float = VISIBILITY_TIMEOUT,
+                 max_attempts: int = MAX_ATTEMPTS, max_depth: int = MAX_DEPTH):
+        self.db_path = db_path
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.max_depth = max_depth
+        # 表结构在应用启动时创建（init_db），首次访问数据库时也会自动创建
+        self._initialized = False
+
+    def init_db(self):
+        """初始化数据库（幂等）"""
+        if self._initialized:
+            return
+        self._initialized = True
+        try:
+            self._init_db()
+        except Exception:
+            self._initialized = False
+            raise
+
+    @contextmanager
+    def _get_connection(self, write: bool = True):
+        """数据库连接上下文管理器
+
+        写操作立即取得写锁（多个进程并发写时等待而不是中途失败）；
+        只读查询使用延迟事务，WAL 模式下不与 worker 的领取、回报争用写锁
+        """
+        if not self._initialized:
+            self.init_db()
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            conn.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+            yield conn
+            conn.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def _init_db(self):
+        """初始化数据库表"""
+        # WAL 模式下 worker 写回报时不阻塞 API 进程读取（需在事务外设置）
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+        finally:
+            conn.close()
+
+        with self._get_connection() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    task_id TEXT NOT NULL UNIQUE,
+                    agent_type TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    priority INTEGER DEFAULT 1,
+                    status TEXT DEFAULT 'queued',
+                    attempts INTEGER DEFAULT 0,
+                    lease_owner TEXT,
+                    visible_at REAL NOT NULL,
+                    enqueued_at REAL NOT NULL,
+                    finished_at REAL,
+                    error TEXT,
+                    result TEXT
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_ready ON jobs (status, priority, id)")
+
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS job_reports (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    task_id TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    data TEXT NOT NULL
+                )
+            """)
+
+    # ===== 入队与领取 =====
+
+    def enqueue(self, task_id: str, agent_type: str, payload: Dict[str, Any], priority: int = 1) -> int:
+        """任务入队（已结束的同一任务再次入队时替换旧记录），返回任务编号
+
+        任务仍在排队或执行中时抛出 JobPending，避免同一任务被两个 worker 同时执行
+        """
+        now = time.time()
+        with self._get_connection() as conn:
+            existing = conn.execute("SELECT status FROM jobs WHERE task_id = ?", (task_id,)).fetchone()
+            if existing is not None and existing["status"] in PENDING_STATUSES:
+                raise JobPending(f"Task {task_id} is already {existing['status']}")
+            depth = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+            if depth >= self.max_depth:
+                metrics.inc("job_queue_rejected_total", agent=agent_type)
+                raise QueueFull(f"Job queue is full ({self.max_depth})")
+            conn.execute("DELETE FROM jobs WHERE task_id = ?", (task_id,))
+            cursor = conn.execute("""
+                INSERT INTO jobs (task_id, agent_type, payload, priority, visible_at, enqueued_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (task_id, agent_type, json.dumps(payload, ensure_ascii=False, default=str), priority, now, now))
+        metrics.inc("job_queue_enqueued_total", agent=agent_type)
+        return cursor.lastrowid
+
+    def claim(self, worker_id: str, agent_limits: Optional[Dict[str, int]] = None) -> Optional[Dict[str, Any]]:
+        """领取一个可见的任务（排队中，或租约已过期）并加租约；没有可领取的任务时返回 None
+
+        agent_limits 为各Agent在所有 worker 上同时执行的上限，已达上限的Agent的任务留在队列中；
+        超过最多领取次数的任务直接标记为失败，并回报给 API 进程
+        """
+        now = time.time()
+        with self._get_connection() as conn:
+            saturated: List[str] = []
+            if agent_limits:
+                # 写锁内统计，多个 worker 同时领取时也不会超过上限
+                running = dict(conn.execute("""
+                    SELECT agent_type, COUNT(*) FROM jobs
+                    WHERE status = 'running' AND visible_at > ?
+                    GROUP BY agent_type
+                """, (now,)).fetchall())
+                saturated = [agent for agent, limit in agent_limits.items() if running.get(agent, 0) >= limit]
+            excluded = f"AND agent_type NOT IN ({','.join('?' * len(saturated))})" if saturated else ""
+
+            while True:
+                row = conn.execute(f"""
+                    SELECT * FROM jobs
+                    WHERE status IN ('queued', 'running') AND visible_at <= ? {excluded}
+                    ORDER BY priority, id
+                    LIMIT 1
+                """, (now, *saturated)).fetchone()
+                if row is None:
+                    return None
+
+                if row["attempts"] >= self.max_attempts:
+                    error = f"Job abandoned after {row['attempts']} attempts"
+                    conn.execute("""
+                        UPDATE jobs SET status = 'failed', lease_owner = NULL, finished_at = ?, error = ?
+                        WHERE id = ?
+                    """, (now, error, row["id"]))
+                    conn.execute("INSERT INTO job_reports (task_id, kind, data) VALUES (?, 'done', ?)",
+                                 (row["task_id"], json.dumps({"status": "failed", "error": error})))
+                    metrics.inc("job_queue_abandoned_total", agent=row["agent_type"])
+                    continue
+
+                conn.execute("""
+                    UPDATE jobs SET status = 'running', attempts = attempts + 1, lease_owner = ?, visible_at = ?
+                    WHERE id = ?
+                """, (worker_id, now + self.visibility_timeout, row["id"]))
+                break
+
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        job["attempts"] += 1
+        metrics.inc("job_queue_claimed_total", agent=job["agent_type"], redelivered=str(job["attempts"] > 1).lower())
+        if job["attempts"] == 1:
+            metrics.inc("job_queue_wait_seconds_total", max(now - job["enqueued_at"], 0.0), agent=job["agent_type"])
+        return job
+
+    def extend(self, worker_id: str, job_ids: List[int]) -> List[int]:
+        """为 worker 仍在执行的任务续租，返回续租成功的任务编号（租约已被他人接手的不在其中）"""
+        if not job_ids:
+            return []
+        placeholders = ",".join("?" * len(job_ids))
+        with self._get_connection() as conn:
+            owned = [row["id"] for row in conn.execute(f"""
+                SELECT id FROM jobs
+                WHERE id IN ({placeholders}) AND status = 'running' AND lease_owner = ?
+            """, (*job_ids, worker_id)).fetchall()]
+            if owned:
+                conn.execute(f"""
+                    UPDATE jobs SET visible_at = ? WHERE id IN ({",".join("?" * len(owned))})
+                """, (time.time() + self.visibility_timeout, *owned))
+        return owned
+
+    def complete(self, job_id: int, worker_id: str, status: str = "completed",
+                 reports: Optional[List[Tuple[str, str, str]]] = None, result: Optional[str] = None) -> bool:
+        """结束任务，并在同一事务中写入剩余回报与最终任务记录（result）；租约已被他人接手时什么都不写"""
+        with self._get_connection() as conn:
+            cursor = conn.execute("""
+                UPDATE jobs SET status = ?, lease_owner = NULL, finished_at = ?, result = ?
+                WHERE id = ? AND status = 'running' AND lease_owner = ?
+            """, (status, time.time(), result, job_id, worker_id))
+            if cursor.rowcount and reports:
+                conn.executemany("INSERT INTO job_reports (task_id, kind, data) VALUES (?, ?, ?)", reports)
+        return cursor.rowcount > 0
+
+    def release(self, job_id: int, worker_id: str) -> bool:
+        """放弃租约（worker 退出时未完成的任务），任务立即重新可见"""
+        with self._get_connection() as conn:
+            cursor = conn.execute("""
+                UPDATE jobs SET visible_at = ?, lease_owner = NULL
+                WHERE id = ? AND status = 'running' AND lease_owner = ?
+            """, (time.time(), job_id, worker_id))
+        return cursor.rowcount > 0
+
+    # ===== 回报 =====
+
+    def report(self, reports: List[Tuple[str, str, str]], worker_id: Optional[str] = None) -> int:
+        """写入一批 (task_id, kind, data) 回报，返回写入条数
+
+        指定 worker_id 时只写入该 worker 仍持有租约的任务的回报（租约已被他人接手的丢弃）
+        """
+        if not reports:
+            return 0
+        with self._get_connection() as conn:
+            if worker_id is None:
+                conn.executemany("INSERT INTO job_reports (task_id, kind, data) VALUES (?, ?, ?)", reports)
+                return len(reports)
+            owned = {row["task_id"] for row in conn.execute("""
+                SELECT task_id FROM jobs WHERE status = 'running' AND lease_owner = ?
+            """, (worker_id,)).fetchall()}
+            kept = [report for report in reports if report[0] in owned]
+            conn.executemany("INSERT INTO job_reports (task_id, kind, data) VALUES (?, ?, ?)", kept)
+        if len(kept) < len(reports):
+            metrics.inc("job_reports_dropped_total", len(reports) - len(kept))
+        return len(kept)
+
+    def take_reports(self, limit: int = 500) -> List[Tuple[str, str, str]]:
+        """按写入顺序取走一批回报（取出即删除，多个 API 进程时每条只被一个进程处理）"""
+        with self._get_connection() as conn:
+            rows = conn.execute("SELECT id, task_id, kind, data FROM job_reports ORDER BY id LIMIT ?",
+                                (limit,)).fetchall()
+            if rows:
+                conn.execute("DELETE FROM job_reports WHERE id <= ?", (rows[-1]["id"],))
+        return [(row["task_id"], row["kind"], row["data"]) for row in rows]
+
+    # ===== 查询 =====
+
+    def is_full(self) -> bool:
+        return self.depth() >= self.max_depth
+
+    def depth(self) -> int:
+        """排队中的任务数"""
+        with self._get_connection(write=False) as conn:
+            return conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+
+    def is_pending(self, task_id: str) -> bool:
+        """任务是否仍在队列中（排队或执行中）"""
+        with self._get_connection(write=False) as conn:
+            row = conn.execute("SELECT status FROM jobs WHERE task_id = ?", (task_id,)).fetchone()
+        return row is not None and row["status"] in PENDING_STATUSES
+
+    def position(self, task_id: str) -> Optional[int]:
+        """排队位置（从1开始），不在队列中时返回 None"""
+        return self.positions([task_id]).get(task_id)
+
+    def positions(self, task_ids: List[str]) -> Dict[str, int]:
+        """一次查询多个任务的排队位置（只含排队中的任务）"""
+        if not task_ids:
+            return {}
+        wanted = set(task_ids)
+        with self._get_connection(write=False) as conn:
+            rows = conn.execute("SELECT task_id FROM jobs WHERE status = 'queued' ORDER BY priority, id").fetchall()
+        return {row["task_id"]: index for index, row in enumerate(rows, 1) if row["task_id"] in wanted}
+
+    def outcome(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """已结束任务的结果（status、error 与 worker 写入的最终任务记录），仍在队列中时返回 None"""
+        with self._get_connection(write=False) as conn:
+            row = conn.execute("SELECT status, error, result FROM jobs WHERE task_id = ?", (task_id,)).fetchone()
+        if row is None:
+            return {"status": None, "error": None, "result": None}
+        if row["status"] in PENDING_STATUSES:
+            return None
+        return {"status": row["status"], "error": row["error"],
+                "result": json.loads(row["result"]) if row["result"] else None}
+
+    def stats(self) -> Dict[str, Any]:
+        """各状态的任务数、回报数与各Agent执行中的任务数（running_by_agent）"""
+        with self._get_connection(write=False) as conn:
+            rows = conn.execute("SELECT status, COUNT(*) AS count FROM jobs GROUP BY status").fetchall()
+            reports = conn.execute("SELECT COUNT(*) FROM job_reports").fetchone()[0]
+            running = conn.execute("""
+                SELECT agent_type, COUNT(*) AS count FROM jobs WHERE status = 'running' GROUP BY agent_type
+            """).fetchall()
+        stats = {"queued": 0, "running": 0, "completed": 0, "failed": 0}
+        stats.update({row["status"]: row["count"] for row in rows})
+        stats["reports"] = reports
+        stats["running_by_agent"] = {row["agent_type"]: row["count"] for row in running}
+        return stats
+
+    def purge(self, older_than: float) -> int:
+        """删除已结束超过 older_than 秒的任务记录"""
+        with self._get_connection() as conn:
+            cursor = conn.execute("""
+                DELETE FROM jobs WHERE status IN ('completed', 'failed') AND finished_at < ?
+            """, (time.time() - older_than,))
+        return cursor.rowcount
+
+
+# 全局实例
+job_queue = JobQueue()
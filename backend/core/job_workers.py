@@ -0,0 +1,475 @@
+"""
+工作流 worker 进程池
+配置 JOB_WORKERS>0 时，API 进程只把工作流写入持久化任务队列（core.job_queue），由独立的 worker 进程领取执行：
+- worker 进程：领取任务、定期续租、执行工作流，任务变化与广播批量写入回报表
+- API 进程（WorkerPool）：启动并看护 worker 进程，取走回报后更新任务记录、推送给订阅者并唤醒长轮询
+工作流执行不再占用 API 进程的事件循环，worker 崩溃也不影响 API；未配置时仍由本进程的调度器执行
+"""
+
+import asyncio
+import multiprocessing
+import os
+import signal
+import threading
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from core.broadcaster import broadcaster
+from core.checkpoint_store import checkpoint_store
+from core.job_queue import JobQueue, job_queue
+from core.metrics import metrics
+from core.serialization import dumps_text, loads
+from core.task_feed import task_feed
+from core.task_runner import run_agent_workflow
+from core.task_scheduler import AGENT_CONCURRENCY, PRIORITY_CLASSES
+from core.task_store import FINISHED_STATUSES, task_store
+
+# worker 进程数（0 表示不启用，工作流在 API 进程内执行）
+WORKERS = int(os.getenv("JOB_WORKERS", "0"))
+
+# 每个 worker 进程同时执行的工作流数
+WORKER_CONCURRENCY = int(os.getenv("JOB_WORKER_CONCURRENCY", "4"))
+
+# 空闲时领取任务 / 读取回报的间隔，以及 worker 批量写回报的间隔（秒）
+POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "0.05"))
+REPORT_INTERVAL = float(os.getenv("JOB_REPORT_INTERVAL", "0.05"))
+
+# 停止时等待执行中工作流结束的秒数，超时后放弃租约，由下次启动的 worker 从检查点恢复
+SHUTDOWN_TIMEOUT = float(os.getenv("JOB_WORKER_SHUTDOWN_TIMEOUT", "20"))
+
+# 等待任务结束时核对队列的间隔（秒）：结束回报可能被其他 API 进程取走
+WAIT_RECHECK = float(os.getenv("JOB_WAIT_RECHECK", "5"))
+
+# 队列统计的刷新间隔（秒），仪表盘与指标读取缓存值
+STATS_INTERVAL = float(os.getenv("JOB_STATS_INTERVAL", "1"))
+
+Report = Tuple[str, str, str]
+
+
+def _topic_task_id(topics) -> str:
+    for topic in topics:
+        if topic.startswith("task:"):
+            return topic[len("task:"):]
+    return ""
+
+
+class JobReporter:
+    """worker 进程内：接管任务变化与广播，批量写入回报表"""
+
+    def __init__(self, queue: JobQueue, worker_id: str, interval: float = REPORT_INTERVAL):
+        self.queue = queue
+        self.worker_id = worker_id
+        self.interval = interval
+        self._tasks: Dict[str, dict] = {}
+        self._events: List[Report] = []
+        self._lock: Optional[asyncio.Lock] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._flusher: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        task_feed.on_touch = self.save_task
+        broadcaster.relay = self.relay
+        self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        task_feed.on_touch = None
+        broadcaster.relay = None
+        if self._flusher:
+            self._flusher.cancel()
+        await self.flush()
+
+    def save_task(self, task: dict):
+        self._tasks.pop(task["id"], None)
+        self._tasks[task["id"]] = task
+        self._wakeup.set()
+
+    def relay(self, topics: Tuple[str, ...], payload: str, coalesce_key: Optional[str] = None):
+        self._events.append((_topic_task_id(topics), "event", dumps_text(
+            {"topics": topics, "payload": payload, "coalesce_key": coalesce_key})))
+        self._wakeup.set()
+
+    def discard(self, task_id: str):
+        """丢弃该任务尚未写出的回报（租约已被其他 worker 接手）"""
+        self._tasks.pop(task_id, None)
+        self._events = [event for event in self._events if event[0] != task_id]
+
+    def collect(self) -> List[Report]:
+        """取出待写入的回报（在事件循环线程中序列化）：先任务记录，再按顺序的广播"""
+        tasks, self._tasks = self._tasks, {}
+        events, self._events = self._events, []
+        return [(task_id, "task", dumps_text(task)) for task_id, task in tasks.items()] + events
+
+    async def flush(self):
+        async with self._lock:
+            # 只写出仍持有租约的任务的回报
+            await asyncio.to_thread(self.queue.report, self.collect(), self.worker_id)
+
+    async def complete(self, job: dict, task: dict) -> bool:
+        """写出该任务的最终状态与结束回报，并在同一事务中结束任务（租约已丢失时全部丢弃）"""
+        async with self._lock:
+            self._tasks.pop(task["id"], None)
+            others = self.collect()
+            reports = [(task["id"], "task", dumps_text(task)),
+                       (task["id"], "done", dumps_text({"status": task["status"]}))]
+            reports = [event for event in others if event[0] == task["id"]] + reports
+            others = [event for event in others if event[0] != task["id"]]
+            await asyncio.to_thread(self.queue.report, others, self.worker_id)
+            return await asyncio.to_thread(self.queue.complete, job["id"], self.worker_id, "completed",
+                                           reports, dumps_text(task))
+
+    async def _flush_loop(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            # 等待一个间隔，合并这段时间内同一任务的多次变化
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                metrics.inc("job_report_errors_total")
+                print(f"Job report flush failed: {e}")
+
+
+class JobWorker:
+    """worker 进程内：领取并执行任务"""
+
+    def __init__(self, queue: JobQueue, worker_id: str, concurrency: int = WORKER_CONCURRENCY,
+                 stop_event=None, poll_interval: float = POLL_INTERVAL,
+                 shutdown_timeout: float = SHUTDOWN_TIMEOUT,
+                 agent_limits: Optional[Dict[str, int]] = None):
+        self.queue = queue
+        self.worker_id = worker_id
+        self.concurrency = concurrency
+        # 各Agent在所有 worker 上的并发上限（与进程内调度器的 SCHEDULER_AGENT_CONCURRENCY 相同）
+        self.agent_limits = agent_limits if agent_limits is not None else AGENT_CONCURRENCY
+        self.stop_event = stop_event if stop_event is not None else threading.Event()
+        self.poll_interval = poll_interval
+        self.shutdown_timeout = shutdown_timeout
+        self.reporter = JobReporter(queue, worker_id)
+        self.active: Dict[int, asyncio.Task] = {}
+        self.jobs: Dict[int, dict] = {}
+        # 续租失败（已被其他 worker 接手）的任务
+        self.lost: Set[int] = set()
+
+    async def run(self):
+        """领取循环：直到 stop_event 被设置"""
+        self.reporter.start()
+        heartbeat = asyncio.create_task(self._heartbeat_loop())
+        try:
+            while not self.stop_event.is_set():
+                if len(self.active) >= self.concurrency:
+                    await asyncio.wait(list(self.active.values()), timeout=self.poll_interval,
+                                       return_when=asyncio.FIRST_COMPLETED)
+                    continue
+                job = await asyncio.to_thread(self.queue.claim, self.worker_id, self.agent_limits)
+                if job is None:
+                    await asyncio.sleep(self.poll_interval)
+                    continue
+                self.jobs[job["id"]] = job
+                self.active[job["id"]] = asyncio.create_task(self._execute(job))
+        finally:
+            await self._drain()
+            heartbeat.cancel()
+            await self.reporter.stop()
+
+    async def _execute(self, job: dict):
+        payload = job["payload"]
+        task = payload["task"]
+        resume = payload.get("resume", False)
+        if job["attempts"] > 1:
+            # 上一个 worker 未能完成（崩溃或退出），已开始执行的从检查点继续
+            resume = resume or await asyncio.to_thread(checkpoint_store.get_run, task["id"]) is not None
+            task["logs"].append({
+                "time": datetime.now().isoformat(),
+                "message": f"任务重新投递（第 {job['attempts']} 次执行）",
+                "status": "warning"
+            })
+
+        try:
+            await run_agent_workflow(task, payload["message"], resume)
+        except asyncio.CancelledError:
+            if job["id"] in self.lost:
+                # 租约已被其他 worker 接手：停止执行，丢弃本次的回报
+                self.reporter.discard(task["id"])
+                return
+            await asyncio.to_thread(self.queue.release, job["id"], self.worker_id)
+            metrics.inc("job_worker_released_total", agent=job["agent_type"])
+            raise
+        except Exception as e:
+            task["status"] = "failed"
+            task["logs"].append({
+                "time": datetime.now().isoformat(),
+                "message": f"Error executing workflow: {str(e)}",
+                "status": "error"
+            })
+        finally:
+            self.active.pop(job["id"], None)
+            self.jobs.pop(job["id"], None)
+            self.lost.discard(job["id"])
+
+        task_feed.touch(task)
+        if not await self.reporter.complete(job, task):
+            metrics.inc("job_worker_lease_lost_total", agent=job["agent_type"])
+            print(f"Lease for task {task['id']} was lost before completion, result discarded")
+            return
+        metrics.inc("job_worker_jobs_total", agent=job["agent_type"], status=task["status"])
+
+    async def _heartbeat_loop(self):
+        """每 1/3 租约时长为执行中的任务及其工作流检查点续租"""
+        interval = min(self.queue.visibility_timeout, checkpoint_store.lease) / 3
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.renew()
+                await asyncio.to_thread(checkpoint_store.renew_runs)
+            except Exception as e:
+                print(f"Job lease renewal failed: {e}")
+
+    async def renew(self):
+        """续租；续租失败的任务已被其他 worker 接手，立即停止执行（至少一次投递，但不会并发执行）"""
+        job_ids = list(self.active)
+        renewed = set(await asyncio.to_thread(self.queue.extend, self.worker_id, job_ids))
+        for job_id in job_ids:
+            if job_id in renewed or job_id not in self.active:
+                continue
+            job = self.jobs.get(job_id)
+            print(f"Lease for job {job_id} was lost, cancelling")
+            metrics.inc("job_worker_lease_lost_total", agent=job["agent_type"] if job else "")
+            self.lost.add(job_id)
+            if job:
+                self.reporter.discard(job["task_id"])
+            self.active[job_id].cancel()
+
+    async def _drain(self):
+        """停止时等待执行中的任务，超时后取消（放弃租约）"""
+        if not self.active:
+            return
+        pending = list(self.active.values())
+        _, unfinished = await asyncio.wait(pending, timeout=self.shutdown_timeout)
+        for job_task in unfinished:
+            job_task.cancel()
+        await asyncio.gather(*unfinished, return_exceptions=True)
+
+
+def worker_main(worker_id: str, stop_event, concurrency: int, db_path: str, visibility_timeout: float):
+    """worker 进程入口（与 API 进程使用同一个队列数据库）"""
+    # Ctrl+C 由 API 进程统一处理，通过 stop_event 通知 worker 停止
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    print(f"Job worker {worker_id} started (pid {os.getpid()})")
+    queue = JobQueue(db_path=Path(db_path), visibility_timeout=visibility_timeout)
+    asyncio.run(JobWorker(queue, worker_id, concurrency, stop_event).run())
+
+
+class WorkerPool:
+    """API 进程内：worker 进程管理与回报处理"""
+
+    def __init__(self, queue: JobQueue = job_queue, size: int = WORKERS, concurrency: int = WORKER_CONCURRENCY,
+                 poll_interval: float = POLL_INTERVAL):
+        self.queue = queue
+        self.size = size
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.processes: Dict[str, multiprocessing.Process] = {}
+        # 任务结束回调（广播 task_complete）
+        self.on_done: Optional[Callable[[str], None]] = None
+        self._context = multiprocessing.get_context("spawn")
+        self._stop_event = None
+        self._poller: Optional[asyncio.Task] = None
+        self._waiters: Dict[str, List[asyncio.Future]] = {}
+        self._background: Set[asyncio.Task] = set()
+        self._stats: dict = {}
+        self._stats_at = 0.0
+        self._running = False
+
+    @property
+    def enabled(self) -> bool:
+        return self.size > 0
+
+    # ===== 生命周期 =====
+
+    def start(self):
+        """启动 worker 进程与回报处理协程"""
+        if not self.enabled or self._running:
+            return
+        self._running = True
+        self.queue.init_db()
+        self._stop_event = self._context.Event()
+        for index in range(self.size):
+            self._spawn(f"worker-{index}")
+        self._poller = asyncio.create_task(self._poll_loop())
+
+    async def stop(self):
+        """通知 worker 停止并等待退出，处理剩余回报"""
+        if not self._running:
+            return
+        self._running = False
+        self._stop_event.set()
+        await asyncio.to_thread(self._join, SHUTDOWN_TIMEOUT + 5)
+        if self._poller:
+            self._poller.cancel()
+        self.apply(await asyncio.to_thread(self.queue.take_reports))
+        # 仍在等待的请求合并不再有结果，结束等待以释放合并键
+        for futures in self._waiters.values():
+            for future in futures:
+                future.cancel()
+        self._waiters.clear()
+
+    def _spawn(self, name: str):
+        worker_id = f"{name}-{uuid.uuid4().hex[:8]}"
+        process = self._context.Process(
+            target=worker_main,
+            args=(worker_id, self._stop_event, self.concurrency, str(self.queue.db_path), self.queue.visibility_timeout),
+            name=f"hive-{name}",
+            daemon=True
+        )
+        process.start()
+        self.processes[name] = process
+        metrics.set("job_workers_alive", sum(p.is_alive() for p in self.processes.values()))
+
+    def _supervise(self):
+        """重启意外退出的 worker 进程（其任务在租约到期后由其他 worker 接手）"""
+        for name, process in list(self.processes.items()):
+            if not process.is_alive():
+                print(f"Job {name} exited with code {process.exitcode}, restarting")
+                metrics.inc("job_worker_restarts_total")
+                self._spawn(name)
+
+    def _join(self, timeout: float):
+        for process in self.processes.values():
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+        self.processes.clear()
+
+    # ===== 提交与等待 =====
+
+    async def submit(self, task: dict, message: str, resume: bool = False, priority: str = "normal") -> Optional[int]:
+        """任务入队（不阻塞事件循环），返回排队位置；任务仍在队列中时抛出 JobPending"""
+        payload = {"task": task, "message": message, "resume": resume}
+
+        def enqueue():
+            self.queue.enqueue(task["id"], task["agent_type"], payload, priority=PRIORITY_CLASSES[priority])
+            return self.queue.position(task["id"])
+
+        return await asyncio.to_thread(enqueue)
+
+    async def wait(self, task_id: str, recheck: float = WAIT_RECHECK) -> Optional[str]:
+        """等待 worker 执行结束，返回任务最终状态
+
+        结束回报由取走它的 API 进程处理；每隔 recheck 秒核对队列，任务已结束时按队列中保存的最终记录更新本进程的记录
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(task_id, []).append(future)
+        try:
+            while True:
+                try:
+                    return await asyncio.wait_for(asyncio.shield(future), recheck)
+                except asyncio.TimeoutError:
+                    outcome = await asyncio.to_thread(self.queue.outcome, task_id)
+                    if outcome is not None:
+                        return self._apply_outcome(task_id, outcome)
+        finally:
+            futures = self._waiters.get(task_id, [])
+            if future in futures:
+                futures.remove(future)
+                if not futures:
+                    del self._waiters[task_id]
+
+    def background(self, coro):
+        """在后台运行协程（保留引用直到结束）"""
+        task = asyncio.create_task(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+        return task
+
+    # ===== 回报 =====
+
+    async def _poll_loop(self):
+        while self._running:
+            reports = []
+            try:
+                reports = await asyncio.to_thread(self.queue.take_reports)
+                self.apply(reports)
+                self._supervise()
+                if time.monotonic() - self._stats_at >= STATS_INTERVAL:
+                    self._stats = await asyncio.to_thread(self.queue.stats)
+                    self._stats_at = time.monotonic()
+            except Exception as e:
+                metrics.inc("job_report_errors_total")
+                print(f"Job report processing failed: {e}")
+            if not reports:
+                await asyncio.sleep(self.poll_interval)
+
+    def apply(self, reports: List[Report]):
+        """按顺序处理回报：任务记录、广播、结束"""
+        for task_id, kind, data in reports:
+            value = loads(data)
+            if kind == "task":
+                self._apply_task(value)
+            elif kind == "event":
+                topics = tuple(value["topics"])
+                # 多副本部署时转发给其他 API 进程
+                if broadcaster.relay is not None:
+                    broadcaster.relay(topics, value["payload"], value["coalesce_key"])
+                broadcaster.deliver(topics, value["payload"], value["coalesce_key"])
+            elif kind == "done":
+                self._finish(task_id, value)
+        metrics.inc("job_reports_applied_total", len(reports))
+
+    def _apply_task(self, snapshot: dict):
+        """worker 上的任务记录覆盖本进程的记录，沿用 worker 分配的版本号"""
+        version = snapshot.pop("version", 0)
+        task = task_store.get(snapshot["id"])
+        if task is None:
+            task_store[snapshot["id"]] = task = snapshot
+        else:
+            task.update(snapshot)
+        task_feed.touch(task, version=version)
+
+    def _abandon(self, task_id: str, error: str):
+        """多次领取仍未完成，被队列放弃"""
+        checkpoint_store.finish_run(task_id, "failed")
+        task = task_store.get(task_id)
+        if task is not None and task["status"] not in FINISHED_STATUSES:
+            task["status"] = "failed"
+            task["logs"].append({"time": datetime.now().isoformat(), "message": error, "status": "error"})
+            task_feed.touch(task)
+
+    def _apply_outcome(self, task_id: str, outcome: dict) -> Optional[str]:
+        """结束回报已被其他 API 进程处理：用队列中保存的最终记录更新本进程的记录"""
+        metrics.inc("job_wait_rechecks_total")
+        if outcome["result"] is not None:
+            self._apply_task(outcome["result"])
+            return outcome["result"]["status"]
+        if outcome["error"]:
+            self._abandon(task_id, outcome["error"])
+            return "failed"
+        return outcome["status"]
+
+    def _finish(self, task_id: str, result: dict):
+        error = result.get("error")
+        if error:
+            self._abandon(task_id, error)
+        if self.on_done is not None:
+            self.on_done(task_id)
+        for future in self._waiters.pop(task_id, []):
+            if not future.done():
+                future.set_result(result.get("status"))
+
+    def stats(self) -> dict:
+        """进程与队列统计（队列部分为回报协程定期刷新的缓存值，不在事件循环中查询数据库）"""
+        return {
+            "workers": self.size,
+            "alive": sum(process.is_alive() for process in self.processes.values()),
+            "concurrency": self.concurrency,
+            **self._stats
+        }
+
+
+# 全局实例（应用启动时启动 worker 进程）
+worker_pool = WorkerPool()
@@ -0,0 +1,127 @@
+"""
+LLM实例创建
+供应商SDK只在真正使用对应供应商时才导入，避免拖慢进程启动与 --reload
+"""
+
+import asyncio
+import os
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+from core.agents import AgentType
+
+# 默认使用OpenAI模型的Agent
+OPENAI_AGENTS = [AgentType.ELON, AgentType.ARCHITECT, AgentType.CODER, AgentType.QA]
+
+
+@dataclass(frozen=True)
+class ModelRoute:
+    """可供Agent使用的供应商模型"""
+    provider: str           # openai / anthropic
+    model: str
+    temperature: float
+    weight: float = 1.0     # 健康状况相同时的流量偏好
+    tier: str = "flagship"  # flagship: 旗舰模型；fast: 更快更便宜的模型
+
+    @property
+    def key(self) -> str:
+        return f"{self.provider}:{self.model}"
+
+
+def _routes(primary: tuple, fallback: tuple, temperature: float, tier: str) -> List[ModelRoute]:
+    return [ModelRoute(*primary, temperature, 1.0, tier), ModelRoute(*fallback, temperature, 0.25, tier)]
+
+
+GPT4 = ("openai", "gpt-4")
+CLAUDE_SONNET = ("anthropic", "claude-sonnet-4-20250514")
+GPT4O_MINI = ("openai", "gpt-4o-mini")
+CLAUDE_HAIKU = ("anthropic", "claude-3-5-haiku-20241022")
+
+ALL_AGENTS = [AgentType.ECHO, AgentType.ELON, AgentType.HENRY, AgentType.ARCHITECT,
+              AgentType.CODER, AgentType.QA, AgentType.REVIEWER, AgentType.RESEARCHER,
+              AgentType.WRITER, AgentType.NETWORKER]
+
+# 各Agent的候选模型（首个为首选，其余为等价的备选）
+ROLE_ROUTES: Dict[str, List[ModelRoute]] = {
+    agent_type: _routes(GPT4, CLAUDE_SONNET, 0.2, "flagship") if agent_type in OPENAI_AGENTS
+    else _routes(CLAUDE_SONNET, GPT4, 0.3, "flagship")
+    for agent_type in ALL_AGENTS
+}
+
+# 简单请求使用的快速模型（见 core.model_policy）
+FAST_ROUTES: Dict[str, List[ModelRoute]] = {
+    agent_type: _routes(GPT4O_MINI, CLAUDE_HAIKU, 0.2, "fast") if agent_type in OPENAI_AGENTS
+    else _routes(CLAUDE_HAIKU, GPT4O_MINI, 0.3, "fast")
+    for agent_type in ALL_AGENTS
+}
+
+# 临时替换LLM创建方式（录制/回放时使用），仅对当前上下文生效
+_llm_factory: ContextVar[Optional[Callable[[str], object]]] = ContextVar("llm_factory", default=None)
+
+
+@contextmanager
+def llm_override(factory: Callable[[str], object]):
+    """在当前上下文内用 factory(agent_type) 替换 get_llm"""
+    token = _llm_factory.set(factory)
+    try:
+        yield
+    finally:
+        _llm_factory.reset(token)
+
+
+def get_llm(agent_type: str):
+    """获取对应Agent的LLM实例"""
+    factory = _llm_factory.get()
+    if factory is not None:
+        return factory(agent_type)
+    return create_llm(agent_type)
+
+
+async def invoke_llm(agent_type: str, prompt, node: Optional[str] = None, task_id: Optional[str] = None):
+    """按节点调用策略（超时、重试、对冲）调用对应Agent的LLM
+
+    先按复杂度选择模型档位并记入审计日志（见 core.model_policy），
+    重试与对冲请求由路由器优先发往本次调用尚未尝试过的健康模型
+    """
+    from core.call_policy import call_with_policy, get_call_policy
+    from core.llm_router import llm_router
+    from core.model_policy import model_policy
+
+    decision = model_policy.decide(agent_type, prompt)
+    model_policy.record(decision)
+    if task_id:
+        await asyncio.to_thread(model_policy.audit, decision, task_id, node)
+
+    policy = get_call_policy(node, agent_type)
+    factory = _llm_factory.get()
+    if factory is not None:
+        llm = factory(agent_type)
+        call = lambda: llm.ainvoke(prompt)
+    else:
+        tried = set()
+        call = lambda: llm_router.ainvoke(agent_type, prompt, tried, tier=decision.tier)
+    return await call_with_policy(call, policy, key=node or agent_type)
+
+
+def create_llm(agent_type: str, route: Optional[ModelRoute] = None):
+    """创建对应Agent的LLM实例，未指定 route 时使用首选模型
+
+    LLM_PROVIDER=mock 时返回离线模拟模型（见 core.mock_llm）
+    """
+    route = route or ROLE_ROUTES.get(agent_type, ROLE_ROUTES[AgentType.ECHO])[0]
+
+    if os.getenv("LLM_PROVIDER", "live").lower() == "mock":
+        from core.mock_llm import MockChatModel
+        return MockChatModel(agent_type, model=route.model)
+
+    if route.provider == "openai":
+        from langchain_openai import ChatOpenAI
+        return ChatOpenAI(model=route.model, temperature=route.temperature)
+    else:
+        from langchain_anthropic import ChatAnthropic
+        return ChatAnthropic(
+            model=route.model,
+            temperature=route.temperature
+        )
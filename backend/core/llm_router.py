@@ -0,0 +1,215 @@
+"""
+多供应商模型路由
+为每个供应商模型维护健康度与延迟评分，按Agent角色在等价模型间选择、故障转移或分摊流量
+"""
+
+import asyncio
+import os
+import random
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from core.adaptive_limiter import ADAPTIVE_CONCURRENCY, adaptive_limiters, is_overload
+from core.call_policy import is_retryable
+from core.llm import FAST_ROUTES, ROLE_ROUTES, ModelRoute, create_llm
+from core.metrics import metrics
+
+# 路由模式：failover 按偏好顺序使用首个健康模型；spread 按 权重/评分 在健康模型间分摊
+ROUTING_MODE = os.getenv("LLM_ROUTING_MODE", "failover").lower()
+
+# 连续失败多少次后熔断，熔断持续多少秒后放行一个探测请求（半开）
+FAILURE_THRESHOLD = int(os.getenv("LLM_ROUTER_FAILURE_THRESHOLD", "3"))
+COOLDOWN_SECONDS = float(os.getenv("LLM_ROUTER_COOLDOWN", "30"))
+
+# 无延迟样本时的默认延迟（秒）与指数平均系数
+DEFAULT_LATENCY = 5.0
+EWMA_ALPHA = 0.2
+
+
+class RouteHealth:
+    """单个供应商模型的健康状况"""
+
+    def __init__(self):
+        self.latency: Optional[float] = None   # 延迟指数平均（秒）
+        self.error_rate = 0.0                  # 错误率指数平均
+        self.consecutive_failures = 0
+        self.open_until = 0.0                  # 熔断截止时间
+        self.probe_until = 0.0                 # 半开状态下在途探测请求的截止时间
+
+    def half_open(self, now: float) -> bool:
+        return self.open_until > 0 and now >= self.open_until
+
+    def available(self, now: float) -> bool:
+        """熔断期内不可用；半开时只放行一个探测请求（探测超过冷却时间未结束视为丢失）"""
+        if now < self.open_until:
+            return False
+        return not self.open_until or now >= self.probe_until
+
+    def begin_probe(self, now: float) -> bool:
+        """半开状态下把本次请求登记为探测请求"""
+        if not self.half_open(now):
+            return False
+        self.probe_until = now + COOLDOWN_SECONDS
+        return True
+
+    def end_probe(self):
+        """探测请求被取消或出现不计入健康度的错误，保持半开以便下一个请求继续探测"""
+        self.probe_until = 0.0
+
+    def observe_latency(self, seconds: float):
+        self.latency = seconds if self.latency is None else (1 - EWMA_ALPHA) * self.latency + EWMA_ALPHA * seconds
+
+    def record_success(self, seconds: float):
+        self.observe_latency(seconds)
+        self.error_rate *= 1 - EWMA_ALPHA
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.probe_until = 0.0
+
+    def record_failure(self, now: float):
+        self.error_rate = (1 - EWMA_ALPHA) * self.error_rate + EWMA_ALPHA
+        self.consecutive_failures += 1
+        self.probe_until = 0.0
+        if self.consecutive_failures >= FAILURE_THRESHOLD:
+            self.open_until = now + COOLDOWN_SECONDS
+
+    def score(self) -> float:
+        """评分越低越好：延迟按错误率加权"""
+        return (self.latency or DEFAULT_LATENCY) * (1 + 4 * self.error_rate)
+
+    def to_dict(self, now: float) -> dict:
+        return {
+            "latency": round(self.latency, 4) if self.latency is not None else None,
+            "error_rate": round(self.error_rate, 4),
+            "consecutive_failures": self.consecutive_failures,
+            "healthy": self.available(now),
+            "score": round(self.score(), 4),
+        }
+
+
+class LLMRouter:
+    """模型路由器"""
+
+    def __init__(self, routes: Dict[str, List[ModelRoute]] = ROLE_ROUTES,
+                 fast_routes: Dict[str, List[ModelRoute]] = FAST_ROUTES, mode: str = ROUTING_MODE):
+        self.routes = routes
+        self.fast_routes = fast_routes
+        self.mode = mode
+        self.health: Dict[str, RouteHealth] = {}
+        self._clients: Dict[Tuple[str, str], object] = {}
+        self._lock = threading.Lock()
+
+    def _health(self, route: ModelRoute) -> RouteHealth:
+        if route.key not in self.health:
+            self.health[route.key] = RouteHealth()
+        return self.health[route.key]
+
+    def _tier_routes(self, agent_type: str, tier: str) -> List[ModelRoute]:
+        routes = self.routes.get(agent_type) or next(iter(self.routes.values()))
+        if tier == "fast":
+            # 快速模型都不可用时升级到旗舰模型
+            return (self.fast_routes.get(agent_type) or []) + routes
+        return routes
+
+    def candidates(self, agent_type: str, exclude: Iterable[str] = (), tier: str = "flagship") -> List[ModelRoute]:
+        """按当前健康状况排序的候选模型（不可用的模型排在最后）"""
+        routes = self._tier_routes(agent_type, tier)
+        now = time.monotonic()
+        exclude = set(exclude)
+        healthy = [r for r in routes if r.key not in exclude and self._health(r).available(now)]
+        others = sorted((r for r in routes if r not in healthy), key=lambda r: self._health(r).open_until)
+
+        same_tier = [r for r in healthy if r.tier == healthy[0].tier]
+        if self.mode == "spread" and len(same_tier) > 1:
+            weights = [r.weight / self._health(r).score() for r in same_tier]
+            first = random.choices(same_tier, weights=weights)[0]
+            healthy = [first] + [r for r in healthy if r is not first]
+        return healthy + others
+
+    def pick(self, agent_type: str, exclude: Iterable[str] = (), tier: str = "flagship") -> ModelRoute:
+        """选择本次请求使用的模型"""
+        route = self.candidates(agent_type, exclude, tier)[0]
+        preferred = self._tier_routes(agent_type, tier)[0]
+        metrics.inc("llm_route_requests_total", agent=agent_type, provider=route.provider,
+                    model=route.model, tier=route.tier)
+        if route.key != preferred.key:
+            metrics.inc("llm_route_failovers_total", agent=agent_type, source=preferred.key, target=route.key)
+        return route
+
+    def client(self, agent_type: str, route: ModelRoute):
+        """复用同一Agent与模型的LLM实例"""
+        key = (agent_type, route.key)
+        with self._lock:
+            if key not in self._clients:
+                self._clients[key] = create_llm(agent_type, route)
+            return self._clients[key]
+
+    def record_success(self, route: ModelRoute, seconds: float):
+        health = self._health(route)
+        health.record_success(seconds)
+        self._export(route, health)
+
+    def record_failure(self, route: ModelRoute):
+        health = self._health(route)
+        health.record_failure(time.monotonic())
+        metrics.inc("llm_route_errors_total", provider=route.provider, model=route.model)
+        self._export(route, health)
+
+    def _export(self, route: ModelRoute, health: RouteHealth):
+        labels = {"provider": route.provider, "model": route.model}
+        metrics.set("llm_route_latency_seconds", health.latency or 0.0, **labels)
+        metrics.set("llm_route_error_rate", health.error_rate, **labels)
+        metrics.set("llm_route_healthy", 1 if health.available(time.monotonic()) else 0, **labels)
+
+    async def ainvoke(self, agent_type: str, prompt, tried: Optional[Set[str]] = None, tier: str = "flagship"):
+        """选择模型并调用；tried 记录本次逻辑调用已尝试过的模型，重试与对冲时优先换用其他模型"""
+        tried = tried if tried is not None else set()
+        route = self.pick(agent_type, exclude=tried, tier=tier)
+        tried.add(route.key)
+        health = self._health(route)
+        probe = health.begin_probe(time.monotonic())
+
+        llm = self.client(agent_type, route)
+        limiter = adaptive_limiters.get(route.provider, route.model) if ADAPTIVE_CONCURRENCY else None
+        if limiter:
+            await limiter.acquire()
+
+        started = time.perf_counter()
+        try:
+            response = await llm.ainvoke(prompt)
+        except asyncio.CancelledError:
+            # 超时或对冲落败被取消：已耗时计入延迟，不计为错误
+            health.observe_latency(time.perf_counter() - started)
+            if probe:
+                health.end_probe()
+            if limiter:
+                limiter.release()
+            raise
+        except Exception as e:
+            if limiter:
+                limiter.release(overloaded=is_overload(e))
+            if is_retryable(e):
+                self.record_failure(route)
+            elif probe:
+                health.end_probe()
+            raise
+        elapsed = time.perf_counter() - started
+        if limiter:
+            limiter.release(latency=elapsed)
+        self.record_success(route, elapsed)
+        return response
+
+    def status(self) -> Dict[str, dict]:
+        """各模型的健康状况与并发上限"""
+        now = time.monotonic()
+        limits = adaptive_limiters.status()
+        return {key: {**health.to_dict(now), "concurrency": limits.get(key)} for key, health in self.health.items()}
+
+    def reset(self):
+        self.health.clear()
+        self._clients.clear()
+
+
+# 全局路由器实例
+llm_router = LLMRouter()
@@ -0,0 +1,124 @@
+"""
+进程内 Redis 替身
+实现共享状态用到的 redis-py 同步接口子集（get / set / delete / publish / pubsub / pipeline），
+用于测试与单进程开发环境（SHARED_STATE_URL=memory://），线程安全
+"""
+
+import queue
+import threading
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+
+def _encode(value) -> bytes:
+    if isinstance(value, bytes):
+        return value
+    return str(value).encode("utf-8")
+
+
+class MemoryRedis:
+    """内存键值与发布订阅"""
+
+    def __init__(self):
+        self._data: Dict[str, Tuple[bytes, Optional[float]]] = {}
+        self._subscribers: Dict[str, Set["MemoryPubSub"]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, name: str) -> Optional[bytes]:
+        with self._lock:
+            item = self._data.get(name)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[name]
+                return None
+            return value
+
+    def set(self, name: str, value, ex: Optional[float] = None) -> bool:
+        with self._lock:
+            self._data[name] = (_encode(value), time.monotonic() + ex if ex else None)
+        return True
+
+    def delete(self, *names: str) -> int:
+        with self._lock:
+            return sum(1 for name in names if self._data.pop(name, None) is not None)
+
+    def publish(self, channel: str, message) -> int:
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for pubsub in subscribers:
+            pubsub._deliver(channel, _encode(message))
+        return len(subscribers)
+
+    def pubsub(self) -> "MemoryPubSub":
+        return MemoryPubSub(self)
+
+    def pipeline(self, transaction: bool = False) -> "MemoryPipeline":
+        return MemoryPipeline(self)
+
+    def close(self):
+        pass
+
+    def _subscribe(self, pubsub: "MemoryPubSub", channel: str):
+        with self._lock:
+            self._subscribers.setdefault(channel, set()).add(pubsub)
+
+    def _unsubscribe(self, pubsub: "MemoryPubSub", channel: str):
+        with self._lock:
+            self._subscribers.get(channel, set()).discard(pubsub)
+
+
+class MemoryPubSub:
+    """订阅者：消息进入线程安全队列，由 get_message 取出"""
+
+    def __init__(self, server: MemoryRedis):
+        self._server = server
+        self._channels: Set[str] = set()
+        self._messages: "queue.Queue[dict]" = queue.Queue()
+
+    def subscribe(self, *channels: str):
+        for channel in channels:
+            self._channels.add(channel)
+            self._server._subscribe(self, channel)
+
+    def unsubscribe(self, *channels: str):
+        for channel in channels or tuple(self._channels):
+            self._channels.discard(channel)
+            self._server._unsubscribe(self, channel)
+
+    def get_message(self, ignore_subscribe_messages: bool = False, timeout: float = 0.0) -> Optional[dict]:
+        try:
+            return self._messages.get(timeout=timeout) if timeout else self._messages.get_nowait()
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.unsubscribe()
+
+    def _deliver(self, channel: str, data: bytes):
+        self._messages.put({"type": "message", "channel": channel.encode("utf-8"), "data": data})
+
+
+class MemoryPipeline:
+    """批量命令（依次执行）"""
+
+    def __init__(self, server: MemoryRedis):
+        self._server = server
+        self._commands: List[Tuple[str, tuple, dict]] = []
+
+    def set(self, *args, **kwargs) -> "MemoryPipeline":
+        self._commands.append(("set", args, kwargs))
+        return self
+
+    def delete(self, *args) -> "MemoryPipeline":
+        self._commands.append(("delete", args, {}))
+        return self
+
+    def publish(self, *args) -> "MemoryPipeline":
+        self._commands.append(("publish", args, {}))
+        return self
+
+    def execute(self) -> list:
+        commands, self._commands = self._commands, []
+        return [getattr(self._server, name)(*args, **kwargs) for name, args, kwargs in commands]
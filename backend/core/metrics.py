@@ -0,0 +1,76 @@
+"""
+运行指标
+进程内的计数器与仪表，按标签区分，供 /api/metrics 导出（JSON 或 Prometheus 文本格式）
+"""
+
+import threading
+from collections import defaultdict
+from typing import Dict, Tuple
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, object]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape(value: str) -> str:
+    """按 Prometheus 文本格式转义标签值中的反斜杠、双引号与换行"""
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class MetricsRegistry:
+    """指标注册表"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[LabelKey, float]] = defaultdict(lambda: defaultdict(float))
+        self._gauges: Dict[str, Dict[LabelKey, float]] = defaultdict(dict)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        """计数器累加"""
+        with self._lock:
+            self._counters[name][_label_key(labels)] += value
+
+    def set(self, name: str, value: float, **labels):
+        """设置仪表值"""
+        with self._lock:
+            self._gauges[name][_label_key(labels)] = value
+
+    def get(self, name: str, **labels) -> float:
+        """读取指标值（不存在时为0）"""
+        key = _label_key(labels)
+        with self._lock:
+            if name in self._gauges and key in self._gauges[name]:
+                return self._gauges[name][key]
+            return self._counters.get(name, {}).get(key, 0)
+
+    def snapshot(self) -> Dict[str, list]:
+        """导出为 {指标名: [{labels, value}]}"""
+        with self._lock:
+            series = list(self._counters.items()) + list(self._gauges.items())
+            return {
+                name: [{"labels": dict(key), "value": value} for key, value in values.items()]
+                for name, values in series
+            }
+
+    def render_prometheus(self) -> str:
+        """导出为 Prometheus 文本格式"""
+        lines = []
+        with self._lock:
+            for kind, group in (("counter", self._counters), ("gauge", self._gauges)):
+                for name, values in sorted(group.items()):
+                    lines.append(f"# TYPE {name} {kind}")
+                    for key, value in values.items():
+                        labels = ",".join(f'{k}="{_escape(v)}"' for k, v in key)
+                        lines.append(f"{name}{{{labels}}} {value}" if labels else f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+
+
+# 全局指标实例
+metrics = MetricsRegistry()
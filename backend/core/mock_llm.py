@@ -0,0 +1,209 @@
+"""
+离线模拟LLM
+无需 OpenAI / Anthropic 密钥即可运行完整工作流，用于压测与性能剖析。
+按Agent生成格式正确的确定性响应，延迟、吞吐、抖动与错误率均可配置
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import time
+from collections import Counter
+from typing import Optional
+
+from core.agents import AgentType
+
+# 各Agent默认输出Token数
+TOKEN_PROFILES = {
+    AgentType.ECHO: 40,
+    AgentType.ELON: 300,
+    AgentType.ARCHITECT: 400,
+    AgentType.CODER: 800,
+    AgentType.QA: 500,
+    AgentType.REVIEWER: 300,
+    AgentType.HENRY: 300,
+    AgentType.RESEARCHER: 600,
+    AgentType.WRITER: 700,
+    AgentType.NETWORKER: 300,
+}
+
+# 记录调用次数的提示词上限（压测时提示词各不相同，超过后清空重新计数）
+MAX_TRACKED_PROMPTS = 10000
+
+
+class MockLLMError(RuntimeError):
+    """模拟的供应商错误，status_code 与真实SDK异常一致"""
+
+    def __init__(self, message: str, status_code: int):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class MockResponse:
+    """模拟响应（与 langchain AIMessage 的常用字段一致）"""
+
+    def __init__(self, content: str, model: str, input_tokens: int, output_tokens: int):
+        self.content = content
+        self.usage_metadata = {
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens,
+        }
+        self.response_metadata = {"model_name": model, "token_usage": self.usage_metadata}
+
+
+class MockChatModel:
+    """模拟聊天模型
+
+    同一 (seed, agent_type, prompt) 总是得到相同的内容；抖动与错误还取决于模型名与该提示词的第几次调用，
+    重试与切换到备用模型时可能成功，整个调用序列仍可复现。
+    延迟 = 首Token延迟 + 输出Token数 / 吞吐 ± 抖动
+    """
+
+    def __init__(self, agent_type: str, model: str = "mock",
+                 latency_ms: Optional[float] = None,
+                 tokens_per_sec: Optional[float] = None,
+                 jitter_ms: Optional[float] = None,
+                 error_rate: Optional[float] = None,
+                 rate_limit_share: Optional[float] = None,
+                 token_scale: Optional[float] = None,
+                 seed: Optional[int] = None):
+        self.agent_type = agent_type
+        self.model = model
+        self.latency_ms = latency_ms if latency_ms is not None else float(os.getenv("MOCK_LLM_LATENCY_MS", "200"))
+        self.tokens_per_sec = tokens_per_sec if tokens_per_sec is not None else float(os.getenv("MOCK_LLM_TOKENS_PER_SEC", "0"))
+        self.jitter_ms = jitter_ms if jitter_ms is not None else float(os.getenv("MOCK_LLM_JITTER_MS", "0"))
+        self.error_rate = error_rate if error_rate is not None else float(os.getenv("MOCK_LLM_ERROR_RATE", "0"))
+        # 模拟供应商故障：列出的模型使用单独的错误率
+        if error_rate is None and model in os.getenv("MOCK_LLM_DEGRADED_MODELS", "").split(","):
+            self.error_rate = float(os.getenv("MOCK_LLM_DEGRADED_ERROR_RATE", "1.0"))
+        self.rate_limit_share = rate_limit_share if rate_limit_share is not None else float(os.getenv("MOCK_LLM_RATE_LIMIT_SHARE", "0.5"))
+        self.token_scale = token_scale if token_scale is not None else float(os.getenv("MOCK_LLM_TOKEN_SCALE", "1.0"))
+        self.seed = seed if seed is not None else int(os.getenv("MOCK_LLM_SEED", "0"))
+        # 每个提示词已调用的次数（决定第几次调用的抖动与错误）
+        self._attempts: Counter = Counter()
+
+    def _rng(self, *parts) -> random.Random:
+        key = ":".join(str(part) for part in (self.seed, self.agent_type) + parts)
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return random.Random(int(digest[:16], 16))
+
+    def _plan(self, prompt: str):
+        """确定本次调用的内容、延迟与是否出错"""
+        rng = self._rng(prompt)
+        output_tokens = max(int(TOKEN_PROFILES.get(self.agent_type, 200) * self.token_scale), 1)
+        content = render_response(self.agent_type, prompt, output_tokens, rng)
+
+        if prompt not in self._attempts and len(self._attempts) >= MAX_TRACKED_PROMPTS:
+            self._attempts.clear()
+        attempt = self._attempts[prompt]
+        self._attempts[prompt] += 1
+        faults = self._rng(self.model, attempt, prompt)
+
+        latency = self.latency_ms / 1000
+        if self.tokens_per_sec > 0:
+            latency += output_tokens / self.tokens_per_sec
+        if self.jitter_ms > 0:
+            latency += faults.uniform(-self.jitter_ms, self.jitter_ms) / 1000
+        latency = max(latency, 0.0)
+
+        error = None
+        if faults.random() < self.error_rate:
+            if faults.random() < self.rate_limit_share:
+                error = MockLLMError(f"{self.model}: rate limit exceeded", 429)
+            else:
+                error = MockLLMError(f"{self.model}: internal server error", 500)
+
+        response = MockResponse(content, self.model, estimate_prompt_tokens(prompt), output_tokens)
+        return response, latency, error
+
+    def invoke(self, prompt, **kwargs) -> MockResponse:
+        response, latency, error = self._plan(_prompt_text(prompt))
+        time.sleep(latency)
+        if error:
+            raise error
+        return response
+
+    async def ainvoke(self, prompt, **kwargs) -> MockResponse:
+        response, latency, error = self._plan(_prompt_text(prompt))
+        await asyncio.sleep(latency)
+        if error:
+            raise error
+        return response
+
+
+def _prompt_text(prompt) -> str:
+    """兼容字符串与消息列表"""
+    if isinstance(prompt, str):
+        return prompt
+    return "\n".join(getattr(message, "content", str(message)) for message in prompt)
+
+
+def estimate_prompt_tokens(prompt: str) -> int:
+    """粗略估算输入Token数"""
+    return max(len(prompt) // 2, 1)
+
+
+def _extract(prompt: str, label: str) -> str:
+    """从提示词中提取 '标签：内容' 行"""
+    match = re.search(rf"{label}[：:]\s*(.+)", prompt)
+    return match.group(1).strip() if match else "未命名任务"
+
+
+def _filler(rng: random.Random, prefix: str, tokens: int) -> str:
+    """生成大致达到目标Token数的填充行"""
+    lines = []
+    while sum(len(line) for line in lines) // 4 < tokens:
+        lines.append(f"{prefix} {rng.randint(1000, 9999)}: " + " ".join(
+            rng.choice(["cache", "queue", "latency", "shard", "index", "retry", "batch", "stream"])
+            for _ in range(8)
+        ))
+    return "\n".join(lines)
+
+
+def render_response(agent_type: str, prompt: str, tokens: int, rng: random.Random) -> str:
+    """按Agent生成格式正确的响应"""
+    if agent_type == AgentType.ECHO:
+        task = _extract(prompt, "用户消息")
+        return f"Tech_Task: 实现「{task}」的技术方案\nMarket_Task: 为「{task}」准备社区推广内容"
+
+    if agent_type == AgentType.ARCHITECT:
+        architecture = {
+            "stack": ["Python", "FastAPI", "SQLite"],
+            "modules": [f"module_{i}" for i in range(rng.randint(3, 6))],
+            "apis": [f"GET /api/resource_{i}" for i in range(rng.randint(2, 5))],
+        }
+        return ("**技术栈：**\n- Python / FastAPI\n- SQLite\n\n"
+                f"```json\n{json.dumps(architecture, ensure_ascii=False, indent=2)}\n```\n\n"
+                f"**架构设计：**\n{_filler(rng, '- 设计要点', tokens // 2)}")
+
+    if agent_type in (AgentType.CODER, AgentType.ELON):
+        functions = "\n\n".join(
+            f"def handler_{i}(request):\n    \"\"\"处理请求 {i}\"\"\"\n    return {{'status': 'ok', 'id': {rng.randint(1, 999)}}}"
+            for i in range(max(tokens // 40, 1))
+        )
+        return f"```python\n{functions}\n```"
+
+    if agent_type == AgentType.QA:
+        tests = "\n\n".join(
+            f"def test_handler_{i}():\n    assert handler_{i}(None)['status'] == 'ok'"
+            for i in range(max(tokens // 25, 1))
+        )
+        return f"**单元测试：**\n```python\n{tests}\n```\n\n**预期结果：** 全部通过"
+
+    if agent_type == AgentType.WRITER:
+        part = max(tokens // 4, 1)
+        return "\n\n".join(
+            f"**{title}：**\n{_filler(rng, '-', part)}"
+            for title in ["PR描述", "Release Notes", "社区推文", "博客文章"]
+        )
+
+    titles = {
+        AgentType.REVIEWER: "审查意见",
+        AgentType.RESEARCHER: "调研结果",
+        AgentType.NETWORKER: "互动策略",
+    }
+    return f"**{titles.get(agent_type, '结果')}：**\n{_filler(rng, '-', tokens)}"
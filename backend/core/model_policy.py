@@ -0,0 +1,148 @@
+"""
+按任务复杂度选择模型档位
+根据提示词长度、Agent角色与近期质量信号为每次请求打分：
+简单请求使用快速模型（fast），Architect、Coder 与复杂请求使用旗舰模型（flagship）
+"""
+
+import os
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from core.agents import AgentType
+from core.audit_store import audit_store
+from core.metrics import metrics
+from core.prompt_budget import estimate_tokens
+
+# 是否按复杂度分档（关闭时全部使用旗舰模型）
+MODEL_TIERING = os.getenv("MODEL_TIERING", "true").lower() == "true"
+
+# 评分达到阈值即使用旗舰模型
+TIER_THRESHOLD = float(os.getenv("MODEL_TIER_THRESHOLD", "0.5"))
+
+# 提示词达到该Token数时长度分取满（0.5）
+LENGTH_SCALE_TOKENS = int(os.getenv("MODEL_TIER_LENGTH_TOKENS", "1500"))
+
+# 因质量信号升到旗舰模型的角色，每隔多少次请求改用快速模型探测一次（0 关闭）
+PROBE_INTERVAL = int(os.getenv("MODEL_TIER_PROBE_INTERVAL", "20"))
+
+# 始终使用旗舰模型的角色
+FLAGSHIP_ROLES = {AgentType.ARCHITECT, AgentType.CODER}
+
+# 各角色的基础复杂度
+ROLE_COMPLEXITY: Dict[str, float] = {
+    AgentType.ECHO: 0.1,
+    AgentType.NETWORKER: 0.2,
+    AgentType.WRITER: 0.3,
+    AgentType.RESEARCHER: 0.3,
+    AgentType.HENRY: 0.3,
+    AgentType.QA: 0.4,
+    AgentType.REVIEWER: 0.4,
+    AgentType.ELON: 0.5,
+    AgentType.ARCHITECT: 1.0,
+    AgentType.CODER: 1.0,
+}
+
+# 质量信号的指数平均系数
+QUALITY_ALPHA = 0.2
+
+
+@dataclass
+class RoutingDecision:
+    """一次请求的档位选择"""
+    agent_type: str
+    tier: str
+    score: float
+    prompt_tokens: int
+    reasons: List[str] = field(default_factory=list)
+    # 仅因快速模型失败率而升到旗舰模型
+    penalized: bool = False
+
+    def describe(self) -> str:
+        return f"tier={self.tier} score={self.score:.2f} tokens={self.prompt_tokens} ({', '.join(self.reasons)})"
+
+
+# 当前上下文最近一次档位选择，供节点反馈质量信号
+last_decision: ContextVar[Optional[RoutingDecision]] = ContextVar("last_decision", default=None)
+
+
+class ModelPolicy:
+    """模型档位策略"""
+
+    def __init__(self):
+        # 各角色使用快速模型时的失败率（指数平均）
+        self.fast_failure_rate: Dict[str, float] = {}
+        # 各角色因失败率升档的请求数，用于定期探测
+        self._penalized_requests: Dict[str, int] = {}
+
+    def decide(self, agent_type: str, prompt) -> RoutingDecision:
+        """为请求打分并选择档位"""
+        text = prompt if isinstance(prompt, str) else str(prompt)
+        tokens = estimate_tokens(text)
+
+        role_score = ROLE_COMPLEXITY.get(agent_type, 0.5)
+        length_score = min(tokens / LENGTH_SCALE_TOKENS, 1.0) * 0.5
+        quality_penalty = self.fast_failure_rate.get(agent_type, 0.0)
+        score = role_score + length_score + quality_penalty
+        reasons = [f"role={role_score:.2f}", f"length={length_score:.2f}"]
+        if quality_penalty:
+            reasons.append(f"quality={quality_penalty:.2f}")
+
+        if not MODEL_TIERING:
+            tier = "flagship"
+            reasons.append("tiering disabled")
+        elif agent_type in FLAGSHIP_ROLES:
+            tier = "flagship"
+            reasons.append("flagship role")
+        else:
+            tier = "fast" if score < TIER_THRESHOLD else "flagship"
+
+        penalized = tier == "flagship" and MODEL_TIERING and agent_type not in FLAGSHIP_ROLES \
+            and score - quality_penalty < TIER_THRESHOLD
+        if penalized:
+            count = self._penalized_requests.get(agent_type, 0) + 1
+            self._penalized_requests[agent_type] = count
+            if PROBE_INTERVAL and count % PROBE_INTERVAL == 0:
+                # 定期用快速模型探测，让失败率有机会随快速模型恢复而下降
+                tier = "fast"
+                penalized = False
+                reasons.append("fast probe")
+
+        return RoutingDecision(agent_type, tier, round(score, 3), tokens, reasons, penalized)
+
+    def record(self, decision: RoutingDecision):
+        """记录档位选择到当前上下文与指标"""
+        last_decision.set(decision)
+        metrics.inc("llm_tier_requests_total", agent=decision.agent_type, tier=decision.tier)
+
+    def audit(self, decision: RoutingDecision, task_id: str, node: Optional[str] = None):
+        """把档位选择写入审计日志（同步写入 SQLite，异步调用方应在线程中执行）"""
+        audit_store.log_action(
+            task_id=task_id,
+            agent_type=decision.agent_type,
+            action='model_routed',
+            details=f'{node or decision.agent_type}: {decision.describe()}',
+            success=True
+        )
+
+    def report_quality(self, ok: bool, decision: Optional[RoutingDecision] = None):
+        """反馈最近一次请求的输出质量
+
+        快速模型输出不合格会推高该角色的评分；因此升到旗舰模型后，旗舰模型的合格输出让失败率逐步衰减
+        """
+        decision = decision or last_decision.get()
+        if decision is None:
+            return
+        rate = self.fast_failure_rate.get(decision.agent_type, 0.0)
+        if decision.tier == "fast":
+            rate = (1 - QUALITY_ALPHA) * rate + QUALITY_ALPHA * (0.0 if ok else 1.0)
+        elif decision.penalized and ok:
+            rate = (1 - QUALITY_ALPHA) * rate
+        else:
+            return
+        self.fast_failure_rate[decision.agent_type] = rate
+        metrics.inc("llm_tier_quality_total", agent=decision.agent_type, tier=decision.tier, ok=ok)
+
+
+# 全局档位策略实例
+model_policy = ModelPolicy()
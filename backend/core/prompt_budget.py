@@ -0,0 +1,246 @@
+"""
+提示词预算与压缩
+按Token度量链式节点中嵌入的上游产出，超出节点预算时截断、精简JSON、提取结构或摘要（摘要结果缓存复用）
+"""
+
+import hashlib
+import json
+import os
+import re
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from core.metrics import metrics
+
+# tiktoken 为可选依赖，首次计数时才导入
+_encoding = None
+_encoding_loaded = False
+
+# 各节点嵌入上游产出的Token预算
+NODE_BUDGETS: Dict[str, Dict[str, int]] = {
+    'coder_execute': {'architecture': 1500},
+    'qa_test': {'code': 3000},
+    'reviewer_check': {'code': 3000, 'tests': 1500},
+    'writer_create': {'research': 2000},
+    'networker_interact': {'content': 1500},
+}
+
+# 预算整体缩放系数，便于按模型上下文窗口统一调整
+BUDGET_SCALE = float(os.getenv("PROMPT_BUDGET_SCALE", "1.0"))
+
+# 摘要缓存上限
+SUMMARY_CACHE_SIZE = 256
+
+# JSON 精简的逐级限制：(字符串最大长度, 列表最多保留项数)
+JSON_LIMITS = [(400, 20), (160, 10), (60, 5), (24, 3)]
+
+_CJK_PATTERN = re.compile(r'[\u3000-\u303f\u4e00-\u9fff\uff00-\uffef]')
+
+# 视为结构的行：Markdown标题/加粗小标题、列表、代码签名
+_STRUCTURE_PATTERN = re.compile(
+    r'^\s*(#{1,6}\s|\*\*.+\*\*|[-*]\s|\d+\.\s|```|'
+    r'(async\s+)?def\s|class\s|import\s|from\s\S+\simport|'
+    r'(export\s+)?(function|interface|type|const)\s|@\w+|[A-Z]+\s+/)'
+)
+
+
+def estimate_tokens(text: str) -> int:
+    """估算文本Token数（有 tiktoken 时精确计算）"""
+    global _encoding, _encoding_loaded
+    if not text:
+        return 0
+    if not _encoding_loaded:
+        _encoding_loaded = True
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _encoding = None
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+
+    # 中文字符约1个Token，其余约4个字符1个Token
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def truncate_to_budget(text: str, budget: int) -> str:
+    """保留开头和结尾，省略中间部分"""
+    tokens = estimate_tokens(text)
+    if tokens <= budget:
+        return text
+
+    # 按比例换算字符数，头部保留2/3、尾部保留1/3
+    keep_chars = max(int(len(text) * budget / tokens), 0)
+    head = text[:keep_chars * 2 // 3]
+    tail = text[len(text) - keep_chars // 3:] if keep_chars // 3 else ""
+    return f"{head}\n...[已省略约 {tokens - budget} tokens]...\n{tail}"
+
+
+def extract_structure(text: str, budget: int) -> str:
+    """只保留标题、列表和代码签名等结构行，仍超出预算时再截断"""
+    if estimate_tokens(text) <= budget:
+        return text
+
+    lines = [line for line in text.splitlines() if _STRUCTURE_PATTERN.match(line)]
+    if not lines:
+        # 没有可识别的结构行时退回首尾截断，避免只剩省略提示
+        return truncate_to_budget(text, budget)
+    skeleton = "\n".join(lines) + "\n...[仅保留结构，细节已省略]"
+    return truncate_to_budget(skeleton, budget)
+
+
+def _shrink_json(value: Any, max_chars: int, max_items: int) -> Any:
+    """保留全部键，缩短长字符串并截短长列表"""
+    if isinstance(value, dict):
+        return {key: _shrink_json(item, max_chars, max_items) for key, item in value.items()}
+    if isinstance(value, list):
+        items = [_shrink_json(item, max_chars, max_items) for item in value[:max_items]]
+        if len(value) > max_items:
+            items.append(f"...[省略 {len(value) - max_items} 项]")
+        return items
+    if isinstance(value, str) and len(value) > max_chars:
+        return value[:max_chars] + "…"
+    return value
+
+
+def compact_json(text: str, budget: int) -> str:
+    """精简JSON：先去掉缩进，再逐级缩短字符串与列表，键结构始终保留；非JSON时退回截断"""
+    if estimate_tokens(text) <= budget:
+        return text
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return truncate_to_budget(text, budget)
+
+    result = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+    for max_chars, max_items in JSON_LIMITS:
+        if estimate_tokens(result) <= budget:
+            return result
+        result = json.dumps(_shrink_json(data, max_chars, max_items), ensure_ascii=False, separators=(',', ':'))
+    return truncate_to_budget(result, budget)
+
+
+class SummaryCache:
+    """摘要缓存（按内容哈希与预算，LRU淘汰）"""
+
+    def __init__(self, max_size: int = SUMMARY_CACHE_SIZE):
+        self.max_size = max_size
+        self._items: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(text: str, budget: int) -> str:
+        return f"{hashlib.sha1(text.encode('utf-8')).hexdigest()}:{budget}"
+
+    def get(self, key: str) -> Optional[str]:
+        if key in self._items:
+            self._items.move_to_end(key)
+            self.hits += 1
+            return self._items[key]
+        self.misses += 1
+        return None
+
+    def set(self, key: str, summary: str):
+        self._items[key] = summary
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+
+summary_cache = SummaryCache()
+
+# 当前上下文使用的摘要缓存（录制/回放时替换为独立实例），默认为进程共享的缓存
+_summary_cache: ContextVar[SummaryCache] = ContextVar("summary_cache", default=summary_cache)
+
+
+@contextmanager
+def isolated_summary_cache():
+    """在当前上下文内使用独立的空摘要缓存，每次执行都会发起摘要调用（录制与回放的LLM调用序列一致）"""
+    token = _summary_cache.set(SummaryCache())
+    try:
+        yield
+    finally:
+        _summary_cache.reset(token)
+
+
+class PromptBuilder:
+    """为单个节点构建提示词的上游产出段落，按预算度量与压缩
+
+    strategy:
+    - truncate: 保留首尾（代码等需要完整细节的产出）
+    - json: 精简JSON，保留全部键
+    - structure: 提取结构行（Markdown 文档）
+    - summarize: 调用异步 summarizer 摘要一次并缓存，失败时退回结构提取
+    """
+
+    def __init__(self, node: str, summarizer: Optional[Callable[[str, int], Awaitable[str]]] = None,
+                 budgets: Optional[Dict[str, int]] = None):
+        self.node = node
+        self.summarizer = summarizer
+        self.budgets = budgets if budgets is not None else NODE_BUDGETS.get(node, {})
+        self.stats: List[dict] = []
+
+    def budget_for(self, name: str) -> Optional[int]:
+        budget = self.budgets.get(name)
+        return int(budget * BUDGET_SCALE) if budget else None
+
+    async def section(self, name: str, text: str, strategy: str = "truncate") -> str:
+        """度量段落并在超出预算时压缩"""
+        text = text or ""
+        tokens = estimate_tokens(text)
+        budget = self.budget_for(name)
+
+        result = text
+        applied = None
+        if budget and tokens > budget:
+            applied = strategy
+            if strategy == "summarize":
+                result = await self._summarize(text, budget)
+            elif strategy == "json":
+                result = compact_json(text, budget)
+            elif strategy == "structure":
+                result = extract_structure(text, budget)
+            else:
+                result = truncate_to_budget(text, budget)
+
+        stat = {
+            "section": name,
+            "tokens": tokens,
+            "budget": budget,
+            "strategy": applied,
+            "compacted_tokens": estimate_tokens(result) if applied else tokens,
+        }
+        self.stats.append(stat)
+        metrics.inc("prompt_section_tokens_total", tokens, node=self.node, section=name)
+        if applied:
+            metrics.inc("prompt_compactions_total", node=self.node, section=name, strategy=applied)
+            metrics.inc("prompt_tokens_saved_total", tokens - stat["compacted_tokens"], node=self.node, section=name)
+        return result
+
+    async def _summarize(self, text: str, budget: int) -> str:
+        """摘要一次并缓存"""
+        if not self.summarizer:
+            return extract_structure(text, budget)
+
+        cache = _summary_cache.get()
+        key = SummaryCache.key(text, budget)
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+        try:
+            summary = truncate_to_budget(await self.summarizer(text, budget), budget)
+        except Exception as e:
+            print(f"Summarize failed for {self.node}: {e}")
+            return extract_structure(text, budget)
+
+        cache.set(key, summary)
+        return summary
+
+    def total_tokens(self) -> int:
+        """压缩后各段落的Token总数"""
+        return sum(stat["compacted_tokens"] for stat in self.stats)
@@ -0,0 +1,226 @@
+"""
+工作流录制与回放
+录制真实 ainvoke 执行中每个节点的提示词、响应、耗时与状态增量，
+回放时用录制的响应替换LLM，测量当前代码的节点开销、状态大小与审计写入次数，
+超过阈值即视为性能回归
+"""
+
+import gzip
+import json
+import statistics
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from core.audit_store import audit_store
+from core.dag_scheduler import ListenerGroup, current_node
+from core.llm import create_llm, llm_override
+from core.mock_llm import MockResponse
+from core.prompt_budget import isolated_summary_cache
+
+RECORDING_VERSION = 1
+
+
+class ReplayError(RuntimeError):
+    """回放与录制不一致（节点发起了录制中不存在的LLM调用，或录制的调用未被全部使用）"""
+
+
+def _state_bytes(state: dict) -> int:
+    """状态序列化后的字节数"""
+    return len(json.dumps(state, ensure_ascii=False, default=str).encode("utf-8"))
+
+
+def _usage(response) -> dict:
+    return dict(getattr(response, "usage_metadata", None) or {})
+
+
+class RecordingLLM:
+    """包装真实模型，记录每次调用"""
+
+    def __init__(self, llm, agent_type: str, recorder: "WorkflowRecorder"):
+        self.llm = llm
+        self.agent_type = agent_type
+        self.recorder = recorder
+
+    def invoke(self, prompt, **kwargs):
+        started = time.perf_counter()
+        response = self.llm.invoke(prompt, **kwargs)
+        self.recorder.record_call(self.agent_type, prompt, response, time.perf_counter() - started)
+        return response
+
+    async def ainvoke(self, prompt, **kwargs):
+        started = time.perf_counter()
+        response = await self.llm.ainvoke(prompt, **kwargs)
+        self.recorder.record_call(self.agent_type, prompt, response, time.perf_counter() - started)
+        return response
+
+
+class WorkflowRecorder:
+    """录制一次工作流执行（作为调度器的 listener）"""
+
+    def __init__(self, agent_type: str):
+        self.agent_type = agent_type
+        self.initial_state: dict = {}
+        self.calls: Dict[Optional[str], List[dict]] = defaultdict(list)
+        self.nodes: List[dict] = []
+
+    def record_call(self, agent_type: str, prompt, response, elapsed: float):
+        self.calls[current_node.get()].append({
+            "agent_type": agent_type,
+            "prompt": prompt if isinstance(prompt, str) else str(prompt),
+            "response": response.content,
+            "usage": _usage(response),
+            "elapsed": round(elapsed, 4),
+        })
+
+    def on_node_end(self, name: str, delta: dict, elapsed: float, state: dict):
+        self.nodes.append({
+            "node": name,
+            "elapsed": round(elapsed, 4),
+            "delta": delta,
+            "state_bytes": _state_bytes(state),
+        })
+
+    async def run(self, workflow, initial_state: dict, listener=None, **kwargs) -> dict:
+        """录制执行工作流（listener 与录制器一起接收节点事件）"""
+        self.initial_state = dict(initial_state)
+        # 摘要缓存按次隔离：录制中总是包含摘要调用，与回放时一致
+        with llm_override(lambda agent_type: RecordingLLM(create_llm(agent_type), agent_type, self)), \
+                isolated_summary_cache():
+            return await workflow.ainvoke(initial_state, listener=ListenerGroup(self, listener), **kwargs)
+
+    def save(self, path: Path):
+        """保存为 gzip 压缩的 JSON Lines：首行为元信息，之后每行一个节点"""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with gzip.open(path, "wt", encoding="utf-8") as f:
+            header = {
+                "version": RECORDING_VERSION,
+                "agent_type": self.agent_type,
+                "recorded_at": datetime.now().isoformat(),
+                "initial_state": self.initial_state,
+            }
+            f.write(json.dumps(header, ensure_ascii=False, default=str) + "\n")
+            for node in self.nodes:
+                record = {**node, "llm_calls": self.calls.get(node["node"], [])}
+                f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+
+
+def load_recording(path: Path) -> dict:
+    """读取录制文件"""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        lines = [json.loads(line) for line in f if line.strip()]
+    if not lines or lines[0].get("version") != RECORDING_VERSION:
+        raise ReplayError(f"不支持的录制文件: {path}")
+    return {"header": lines[0], "nodes": lines[1:]}
+
+
+class ReplayLLM:
+    """按节点与调用顺序返回录制的响应，不产生任何网络请求或延迟"""
+
+    def __init__(self, agent_type: str, queues: Dict[str, List[dict]]):
+        self.agent_type = agent_type
+        self.queues = queues
+
+    def _next(self) -> MockResponse:
+        node = current_node.get()
+        queue = self.queues.get(node)
+        if not queue:
+            raise ReplayError(f"节点 {node} 发起了录制中不存在的LLM调用")
+        call = queue.pop(0)
+        usage = call.get("usage", {})
+        return MockResponse(call["response"], "replay",
+                            usage.get("input_tokens", 0), usage.get("output_tokens", 0))
+
+    def invoke(self, prompt, **kwargs):
+        return self._next()
+
+    async def ainvoke(self, prompt, **kwargs):
+        return self._next()
+
+
+class NodeMetrics:
+    """回放时逐节点收集的指标"""
+
+    def __init__(self):
+        self.elapsed: Dict[str, float] = {}
+        self.state_bytes: Dict[str, int] = {}
+
+    def on_node_end(self, name: str, delta: dict, elapsed: float, state: dict):
+        self.elapsed[name] = elapsed
+        self.state_bytes[name] = _state_bytes(state)
+
+
+async def replay(recording: dict, workflow, iterations: int = 5) -> dict:
+    """用当前代码回放录制，返回各节点开销（中位数）、状态大小与审计写入次数"""
+    header = recording["header"]
+    elapsed_samples: Dict[str, List[float]] = defaultdict(list)
+    metrics = NodeMetrics()
+    audit_writes: Dict[str, int] = {}
+
+    original_db = audit_store.db_path
+    with tempfile.TemporaryDirectory() as tmp:
+        # 审计写入落到临时数据库，不污染真实审计日志
+        audit_store.use_database(Path(tmp) / "replay_audit.db")
+        try:
+            for _ in range(iterations):
+                queues = {node["node"]: list(node["llm_calls"]) for node in recording["nodes"]}
+                metrics = NodeMetrics()
+                audit_store.write_counts.clear()
+
+                initial_state = {**header["initial_state"], "task_id": f"replay_{header['initial_state'].get('task_id')}"}
+                # 每次回放使用空的摘要缓存，否则第二次起摘要调用被跳过，后续调用取到错位的录制响应
+                with llm_override(lambda agent_type: ReplayLLM(agent_type, queues)), isolated_summary_cache():
+                    await workflow.ainvoke(initial_state, listener=metrics)
+                unused = [node for node, calls in queues.items() if calls]
+                if unused:
+                    raise ReplayError(f"节点 {unused} 的录制调用未被全部使用")
+
+                for name, elapsed in metrics.elapsed.items():
+                    elapsed_samples[name].append(elapsed)
+                audit_writes = {name: count for name, count in audit_store.write_counts.items() if name}
+        finally:
+            audit_store.use_database(original_db)
+
+    return {
+        "agent_type": header["agent_type"],
+        "nodes": {
+            name: {
+                "overhead_ms": round(statistics.median(samples) * 1000, 3),
+                "state_bytes": metrics.state_bytes.get(name, 0),
+                "audit_writes": audit_writes.get(name, 0),
+            }
+            for name, samples in elapsed_samples.items()
+        },
+    }
+
+
+def compare(baseline: dict, current: dict, overhead_tolerance: float = 0.5,
+            overhead_slack_ms: float = 2.0, size_tolerance: float = 0.1) -> List[str]:
+    """与基线比较，返回回归描述列表（为空表示通过）
+
+    - 节点开销超过 基线 × (1 + overhead_tolerance) + overhead_slack_ms
+    - 状态大小超过 基线 × (1 + size_tolerance)
+    - 审计写入次数增加
+    """
+    regressions = []
+    for name, base in baseline["nodes"].items():
+        now = current["nodes"].get(name)
+        if now is None:
+            regressions.append(f"{name}: 节点未执行")
+            continue
+
+        limit_ms = base["overhead_ms"] * (1 + overhead_tolerance) + overhead_slack_ms
+        if now["overhead_ms"] > limit_ms:
+            regressions.append(f"{name}: 节点开销 {now['overhead_ms']:.2f}ms > {limit_ms:.2f}ms")
+
+        size_limit = base["state_bytes"] * (1 + size_tolerance)
+        if now["state_bytes"] > size_limit:
+            regressions.append(f"{name}: 状态大小 {now['state_bytes']}B > {int(size_limit)}B")
+
+        if now["audit_writes"] > base["audit_writes"]:
+            regressions.append(f"{name}: 审计写入 {now['audit_writes']} > {base['audit_writes']}")
+    return regressions
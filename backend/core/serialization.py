@@ -0,0 +1,44 @@
+"""
+JSON 序列化
+安装 orjson 时使用 orjson（直接输出 UTF-8 字节，原生支持 datetime），否则退回标准库 json，输出保持一致
+"""
+
+import json
+from datetime import date, datetime
+from typing import Any
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _default(value: Any):
+    """非标准类型：日期按 ISO 格式，其余转为字符串"""
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, (set, frozenset, tuple)):
+        return list(value)
+    return str(value)
+
+
+if orjson is not None:
+    _OPTIONS = orjson.OPT_NON_STR_KEYS
+
+    def dumps(value: Any, sort_keys: bool = False) -> bytes:
+        """序列化为 UTF-8 字节"""
+        return orjson.dumps(value, default=_default, option=_OPTIONS | (orjson.OPT_SORT_KEYS if sort_keys else 0))
+
+    loads = orjson.loads
+else:
+    def dumps(value: Any, sort_keys: bool = False) -> bytes:
+        """序列化为 UTF-8 字节"""
+        return json.dumps(value, ensure_ascii=False, separators=(",", ":"), sort_keys=sort_keys,
+                          default=_default).encode("utf-8")
+
+    loads = json.loads
+
+
+def dumps_text(value: Any) -> str:
+    """序列化为字符串（WebSocket 文本帧、SSE 数据行）"""
+    return dumps(value).decode("utf-8")
@@ -0,0 +1,267 @@
+"""
+跨进程共享状态
+多 worker / 多副本部署时，通过 Redis（或进程内替身 memory://）共享任务记录与 WebSocket 事件：
+- 任务每次变化后写入 Redis（批量、合并同一任务的多次变化），其他进程查不到本地任务时从 Redis 读取
+- 广播消息发布到事件频道，其他进程投递给各自的订阅者并唤醒长轮询
+未配置 SHARED_STATE_URL 时不启用，行为与单进程完全一致
+"""
+
+import asyncio
+import os
+import threading
+import uuid
+from typing import Dict, Optional, Tuple
+
+from core.broadcaster import broadcaster
+from core.metrics import metrics
+from core.serialization import dumps, loads
+from core.task_feed import task_feed
+from core.task_store import task_store
+
+# redis://host:6379/0 使用 Redis；memory:// 使用进程内替身；留空不启用
+SHARED_STATE_URL = os.getenv("SHARED_STATE_URL", "")
+KEY_PREFIX = os.getenv("SHARED_STATE_PREFIX", "hive")
+
+# 任务记录在 Redis 中的保留秒数（每次变化后刷新）
+TASK_TTL = int(os.getenv("SHARED_STATE_TASK_TTL", "86400"))
+
+# 批量写入间隔（秒）：同一任务在间隔内的多次变化只写一次
+FLUSH_INTERVAL = float(os.getenv("SHARED_STATE_FLUSH_INTERVAL", "0.02"))
+
+# 写入失败时最多保留的待发事件数（超出后丢弃最旧的事件，任务记录总会保留最新内容）
+OUTBOX_LIMIT = 10000
+
+# 事件监听断开与写入失败后的重试退避（秒）：从最小值开始逐次翻倍，直到最大值
+RETRY_BACKOFF_MIN = float(os.getenv("SHARED_STATE_RETRY_BACKOFF_MIN", "0.5"))
+RETRY_BACKOFF_MAX = float(os.getenv("SHARED_STATE_RETRY_BACKOFF_MAX", "30"))
+
+
+def create_client(url: str):
+    """按 URL 创建 redis-py 同步客户端或进程内替身"""
+    if not url:
+        return None
+    if url.startswith("memory://"):
+        from core.memory_redis import MemoryRedis
+        return MemoryRedis()
+    import redis
+    return redis.Redis.from_url(url)
+
+
+class SharedState:
+    """任务记录同步与跨进程事件总线"""
+
+    def __init__(self, client=None, prefix: str = KEY_PREFIX, task_ttl: int = TASK_TTL,
+                 flush_interval: float = FLUSH_INTERVAL, backoff_min: float = RETRY_BACKOFF_MIN,
+                 backoff_max: float = RETRY_BACKOFF_MAX):
+        self.client = client
+        self.prefix = prefix
+        self.task_ttl = task_ttl
+        self.flush_interval = flush_interval
+        self.backoff_min = backoff_min
+        self.backoff_max = backoff_max
+        self.origin = uuid.uuid4().hex
+        self.channel = f"{prefix}:events"
+        self._dirty: Dict[str, dict] = {}
+        self._outbox: list = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._flusher: Optional[asyncio.Task] = None
+        self._listener: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        self._running = False
+        # 事件监听是否已连接，以及累计重连次数
+        self.listening = False
+        self.reconnects = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.client is not None
+
+    def task_key(self, task_id: str) -> str:
+        return f"{self.prefix}:task:{task_id}"
+
+    # ===== 生命周期 =====
+
+    def start(self):
+        """接入任务变化与广播，启动批量写入协程与事件监听线程"""
+        if not self.enabled or self._running:
+            return
+        self._running = True
+        self._stopped.clear()
+        self._wakeup = asyncio.Event()
+        task_feed.on_touch = self.save_task
+        broadcaster.relay = self.relay
+        task_store.remote = self
+        self._flusher = asyncio.create_task(self._flush_loop())
+        self._listener = threading.Thread(target=self._listen, args=(asyncio.get_running_loop(),),
+                                          name="shared-state-listener", daemon=True)
+        self._listener.start()
+
+    async def stop(self):
+        """写出尚未同步的变化并停止"""
+        if not self._running:
+            return
+        self._running = False
+        self._stopped.set()
+        task_feed.on_touch = None
+        broadcaster.relay = None
+        task_store.remote = None
+        if self._flusher:
+            self._flusher.cancel()
+        await asyncio.to_thread(self.write, *self.collect())
+        if self._listener:
+            await asyncio.to_thread(self._listener.join, 2.0)
+
+    # ===== 任务记录 =====
+
+    def save_task(self, task: dict):
+        """登记变化的任务（下次批量写入时序列化最新内容）"""
+        self._dirty[task["id"]] = task
+        self._wake()
+
+    def load_task(self, task_id: str) -> Optional[dict]:
+        """读取其他进程写入的任务记录（只读副本）"""
+        if not self.enabled:
+            return None
+        data = self.client.get(self.task_key(task_id))
+        metrics.inc("shared_state_task_reads_total", found=str(data is not None).lower())
+        return loads(data) if data is not None else None
+
+    def delete_task(self, task_id: str) -> bool:
+        if not self.enabled:
+            return False
+        self._dirty.pop(task_id, None)
+        return bool(self.client.delete(self.task_key(task_id)))
+
+    # ===== 事件 =====
+
+    def relay(self, topics: Tuple[str, ...], payload: str, coalesce_key: Optional[str] = None):
+        """广播消息转发给其他进程"""
+        self._outbox.append(dumps({"origin": self.origin, "topics": topics,
+                                   "payload": payload, "coalesce_key": coalesce_key}))
+        self._wake()
+
+    def _on_event(self, data: bytes):
+        event = loads(data)
+        if event["origin"] == self.origin:
+            return
+        metrics.inc("shared_state_events_received_total")
+        broadcaster.deliver(event["topics"], event["payload"], event["coalesce_key"])
+        for topic in event["topics"]:
+            if topic.startswith("task:"):
+                task_feed.notify(topic[len("task:"):])
+
+    def _listen(self, loop: asyncio.AbstractEventLoop):
+        """监听线程：阻塞读取事件频道，交给事件循环处理；连接出错时按退避间隔重连"""
+        backoff = self.backoff_min
+        while self._running:
+            pubsub = None
+            try:
+                pubsub = self.client.pubsub()
+                pubsub.subscribe(self.channel)
+                self._set_listening(True)
+                backoff = self.backoff_min
+                while self._running:
+                    message = pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                    if message and message.get("type") == "message":
+                        loop.call_soon_threadsafe(self._on_event, message["data"])
+            except Exception as e:
+                self._set_listening(False)
+                metrics.inc("shared_state_listener_errors_total")
+                print(f"Shared state listener failed, reconnecting in {backoff:g}s: {e}")
+                if self._stopped.wait(backoff):
+                    break
+                backoff = min(backoff * 2, self.backoff_max)
+                self.reconnects += 1
+                metrics.inc("shared_state_listener_reconnects_total")
+            finally:
+                if pubsub is not None:
+                    try:
+                        pubsub.close()
+                    except Exception:
+                        pass
+        self._set_listening(False)
+
+    def _set_listening(self, up: bool):
+        self.listening = up
+        metrics.set("shared_state_listener_up", 1 if up else 0)
+
+    def status(self) -> dict:
+        """共享状态健康状况"""
+        return {
+            "enabled": self.enabled,
+            "listening": self.listening,
+            "reconnects": self.reconnects,
+            "pending_tasks": len(self._dirty),
+            "pending_events": len(self._outbox),
+        }
+
+    # ===== 批量写入 =====
+
+    def _wake(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _flush_loop(self):
+        backoff = self.backoff_min
+        while self._running:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            # 等待一个间隔，合并这段时间内的多次变化
+            await asyncio.sleep(self.flush_interval)
+            dirty, outbox = self._take()
+            try:
+                await asyncio.to_thread(self.write, self._serialize(dirty), outbox)
+                backoff = self.backoff_min
+            except Exception as e:
+                metrics.inc("shared_state_flush_errors_total")
+                print(f"Shared state flush failed, retrying in {backoff:g}s: {e}")
+                # 放回待写入队列，退避后重试
+                self._requeue(dirty, outbox)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, self.backoff_max)
+                self._wake()
+
+    def _take(self) -> Tuple[Dict[str, dict], list]:
+        dirty, self._dirty = self._dirty, {}
+        outbox, self._outbox = self._outbox, []
+        return dirty, outbox
+
+    @staticmethod
+    def _serialize(dirty: Dict[str, dict]) -> Dict[str, bytes]:
+        return {task_id: dumps(task) for task_id, task in dirty.items()}
+
+    def _requeue(self, dirty: Dict[str, dict], outbox: list):
+        """写入失败的任务与事件放回队列：期间又变化的任务以最新记录为准，事件保持原有顺序"""
+        for task_id, task in dirty.items():
+            self._dirty.setdefault(task_id, task)
+        self._outbox[:0] = outbox
+        overflow = len(self._outbox) - OUTBOX_LIMIT
+        if overflow > 0:
+            del self._outbox[:overflow]
+            metrics.inc("shared_state_events_dropped_total", overflow)
+
+    def collect(self) -> Tuple[Dict[str, bytes], list]:
+        """取出待写入的任务（在事件循环线程中序列化，避免与任务修改并发）与待发事件"""
+        dirty, outbox = self._take()
+        return self._serialize(dirty), outbox
+
+    def write(self, tasks: Dict[str, bytes], events: list):
+        """一次管道写入任务记录并发布事件"""
+        if not self.enabled or not (tasks or events):
+            return
+        pipe = self.client.pipeline(transaction=False)
+        for task_id, data in tasks.items():
+            pipe.set(self.task_key(task_id), data, ex=self.task_ttl)
+        for event in events:
+            pipe.publish(self.channel, event)
+        pipe.execute()
+        metrics.inc("shared_state_tasks_written_total", len(tasks))
+        metrics.inc("shared_state_events_published_total", len(events))
+
+    def flush(self):
+        """立即写出全部待同步内容"""
+        self.write(*self.collect())
+
+
+# 全局实例
+shared_state = SharedState(create_client(SHARED_STATE_URL))
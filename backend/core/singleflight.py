@@ -0,0 +1,76 @@
+"""
+相同请求合并执行（singleflight）
+同一时刻提交的相同工作流只执行一次，后续请求作为别名挂到执行中的任务上，共享同一结果
+"""
+
+import hashlib
+import json
+import os
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from core.metrics import metrics
+
+# 是否合并相同的并发提交
+SINGLEFLIGHT_ENABLED = os.getenv("SINGLEFLIGHT_ENABLED", "true").lower() == "true"
+
+
+@dataclass
+class _Call:
+    leader_id: str
+    label: str
+    aliases: List[str] = field(default_factory=list)
+
+
+class SingleFlight:
+    """执行中的请求登记表"""
+
+    def __init__(self):
+        self._calls: Dict[str, _Call] = {}
+
+    @staticmethod
+    def key(*parts) -> str:
+        """请求键：忽略首尾与连续空白的差异"""
+        normalized = [" ".join(p.split()) if isinstance(p, str) else p for p in parts]
+        payload = json.dumps(normalized, ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+    def attach(self, key: str, task_id: str) -> Optional[str]:
+        """相同请求正在执行时登记为别名并返回执行中的任务ID，否则返回 None"""
+        call = self._calls.get(key)
+        if call is None:
+            return None
+        call.aliases.append(task_id)
+        metrics.inc("singleflight_coalesced_total", label=call.label)
+        return call.leader_id
+
+    def track(self, key: str, task_id: str, coro: Awaitable,
+              on_done: Optional[Callable[[str, List[str]], None]] = None,
+              label: str = "") -> Awaitable:
+        """登记请求并返回包装后的协程（排队期间即可被合并）；执行结束后以 (leader_id, aliases) 调用 on_done"""
+        call = self._calls[key] = _Call(task_id, label)
+        metrics.inc("singleflight_executions_total", label=label)
+        metrics.set("singleflight_inflight", len(self._calls))
+
+        async def run():
+            try:
+                return await coro
+            finally:
+                self._calls.pop(key, None)
+                metrics.set("singleflight_inflight", len(self._calls))
+                if on_done and call.aliases:
+                    on_done(call.leader_id, call.aliases)
+
+        return run()
+
+    def forget(self, key: str):
+        """撤销未能开始执行的请求（提交被拒绝时包装协程不会运行，登记不会自动移除）"""
+        self._calls.pop(key, None)
+        metrics.set("singleflight_inflight", len(self._calls))
+
+    def inflight(self) -> int:
+        return len(self._calls)
+
+
+# 全局实例
+singleflight = SingleFlight()
@@ -0,0 +1,70 @@
+"""
+快照缓存
+按数据版本缓存序列化后的响应体与强 ETag：版本未变且未过期时直接复用，
+客户端带上相同的 If-None-Match 时返回 304，不再重新查询与序列化
+"""
+
+import hashlib
+import time
+from typing import Any, Awaitable, Callable, Hashable, Optional, Tuple
+
+from core.compression import identity_etag
+from core.metrics import metrics
+from core.serialization import dumps
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match 是否命中（支持逗号分隔的多个值与 *，按弱比较忽略 W/ 前缀，压缩版本的 ETag 视为同一内容）"""
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in (identity_etag(tag[2:] if tag.startswith("W/") else tag) for tag in candidates)
+
+
+class SnapshotCache:
+    """单个快照的缓存
+
+    build 生成响应内容（aget 时为协程函数，可把数据库查询放到线程中），
+    version 返回当前数据版本（任意可比较的值），版本变化或超过 ttl 秒后重新生成
+    """
+
+    def __init__(self, name: str, build: Callable[[], Any], version: Callable[[], Hashable], ttl: float = 30.0):
+        self.name = name
+        self.build = build
+        self.version = version
+        self.ttl = ttl
+        self._version: Optional[Hashable] = None
+        self._built_at = 0.0
+        self._body = b""
+        self._etag = ""
+
+    def get(self) -> Tuple[bytes, str]:
+        """返回 (响应体, ETag)"""
+        version = self.version()
+        if self._fresh(version):
+            return self._body, self._etag
+        return self._store(self.build(), version)
+
+    async def aget(self) -> Tuple[bytes, str]:
+        """与 get 相同，build 为协程函数"""
+        version = self.version()
+        if self._fresh(version):
+            return self._body, self._etag
+        return self._store(await self.build(), version)
+
+    def _fresh(self, version: Hashable) -> bool:
+        if self._etag and version == self._version and time.monotonic() - self._built_at < self.ttl:
+            metrics.inc("snapshot_cache_hits_total", snapshot=self.name)
+            return True
+        return False
+
+    def _store(self, content: dict, version: Hashable) -> Tuple[bytes, str]:
+        self._body = dumps(content)
+        self._etag = f'"{hashlib.sha1(self._body).hexdigest()}"'
+        self._version = version
+        self._built_at = time.monotonic()
+        metrics.inc("snapshot_cache_builds_total", snapshot=self.name)
+        return self._body, self._etag
+
+    def invalidate(self):
+        self._etag = ""
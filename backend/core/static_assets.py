@@ -0,0 +1,90 @@
+"""
+前端静态资源
+启动时把构建产物（frontend/dist）读入内存并预先压缩（gzip，安装 brotli 时同时生成 br；
+已有 .gz/.br 文件时直接使用），带哈希的资源返回一年的 immutable 缓存头，index.html 每次协商缓存
+"""
+
+import hashlib
+import mimetypes
+import os
+import re
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from core.compression import COMPRESSIBLE_TYPES, MIN_SIZE, accepted_encodings, brotli, compress
+
+DIST_DIR = Path(os.getenv("FRONTEND_DIST_DIR", Path(__file__).parent.parent.parent / "frontend" / "dist"))
+
+# Vite 构建产物的文件名哈希（如 index-kSR8lncJ.js）
+HASHED_NAME = re.compile(r"[-.][A-Za-z0-9_-]{8,}\.[a-z0-9]+$")
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+
+@dataclass
+class Asset:
+    path: str
+    content_type: str
+    body: bytes
+    etag: str
+    cache_control: str
+    encoded: Dict[str, bytes] = field(default_factory=dict)
+
+    def variant(self, accept_encoding: str) -> Tuple[bytes, Optional[str]]:
+        """按 Accept-Encoding 选择预压缩版本"""
+        accepted = accepted_encodings(accept_encoding or "")
+        for encoding in ("br", "gzip"):
+            if encoding in self.encoded and encoding in accepted:
+                return self.encoded[encoding], encoding
+        return self.body, None
+
+
+class StaticAssets:
+    """内存中的静态资源"""
+
+    def __init__(self, root: Path = DIST_DIR):
+        self.root = Path(root)
+        self.assets: Dict[str, Asset] = {}
+
+    def load(self) -> int:
+        """读取并预压缩全部资源，返回资源数（目录不存在时为 0）"""
+        self.assets.clear()
+        if not self.root.is_dir():
+            return 0
+        for file in sorted(self.root.rglob("*")):
+            if not file.is_file() or file.suffix in (".gz", ".br"):
+                continue
+            path = file.relative_to(self.root).as_posix()
+            self.assets[path] = self._build(path, file)
+        return len(self.assets)
+
+    def _build(self, path: str, file: Path) -> Asset:
+        body = file.read_bytes()
+        content_type = mimetypes.guess_type(file.name)[0] or "application/octet-stream"
+        if content_type.startswith("text/") or content_type == "application/javascript":
+            content_type += "; charset=utf-8"
+        asset = Asset(
+            path=path,
+            content_type=content_type,
+            body=body,
+            etag=f'"{hashlib.sha1(body).hexdigest()}"',
+            cache_control=IMMUTABLE if path.startswith("assets/") and HASHED_NAME.search(file.name) else REVALIDATE,
+        )
+
+        if len(body) >= MIN_SIZE and content_type.startswith(COMPRESSIBLE_TYPES):
+            for encoding, suffix in (("br", ".br"), ("gzip", ".gz")):
+                prebuilt = file.with_name(file.name + suffix)
+                if prebuilt.is_file():
+                    asset.encoded[encoding] = prebuilt.read_bytes()
+                elif encoding == "gzip" or brotli is not None:
+                    asset.encoded[encoding] = compress(body, encoding)
+        return asset
+
+    def get(self, path: str) -> Optional[Asset]:
+        return self.assets.get(path.lstrip("/"))
+
+
+# 全局实例（应用启动时加载）
+static_assets = StaticAssets()
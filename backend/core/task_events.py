@@ -0,0 +1,61 @@
+"""
+任务节点事件
+作为调度器的 listener，把节点开始、结束、失败与进度逐步写入任务记录，并推送给订阅该任务或该Agent的客户端
+"""
+
+import time
+from datetime import datetime
+from typing import Optional
+
+from core.broadcaster import agent_topic, broadcaster, task_topic
+from core.metrics import metrics
+from core.task_feed import task_feed
+
+
+class TaskEventListener:
+    """单个任务的节点事件"""
+
+    def __init__(self, task: dict, total_nodes: int):
+        self.task = task
+        self.task_id = task["id"]
+        self.agent_type = task["agent_type"]
+        self.total_nodes = max(total_nodes, 1)
+        self.finished_nodes = 0
+        self._started = {}
+        task.setdefault("nodes", {})
+
+    def _publish(self, message: dict, coalesce_key: Optional[str] = None):
+        version = task_feed.touch(self.task)
+        message = {"task_id": self.task_id, "agent_type": self.agent_type, "version": version,
+                   "time": datetime.now().isoformat(), **message}
+        broadcaster.publish((task_topic(self.task_id), agent_topic(self.agent_type)), message, coalesce_key)
+
+    def on_node_start(self, name: str):
+        self._started[name] = time.perf_counter()
+        self.task["current_node"] = name
+        self.task["nodes"][name] = {"status": "running", "started_at": datetime.now().isoformat()}
+        self._publish({"type": "node_start", "node": name})
+
+    def on_node_end(self, name: str, delta: dict, elapsed: float, state: dict):
+        self._started.pop(name, None)
+        self.finished_nodes += 1
+        self.task["nodes"][name].update({"status": "completed", "elapsed": round(elapsed, 4)})
+        metrics.inc("workflow_node_seconds_total", elapsed, agent=self.agent_type, node=name)
+        metrics.inc("workflow_nodes_total", agent=self.agent_type, node=name, status="completed")
+        self._publish({"type": "node_end", "node": name, "elapsed": round(elapsed, 4)})
+
+        # 节点自报的进度（如 30/60/80/100）与已完成节点比例取较大值，只增不减
+        progress = max(self.task["progress"], float(state.get("progress") or 0),
+                       round(100.0 * self.finished_nodes / self.total_nodes, 1))
+        if progress > self.task["progress"]:
+            self.task["progress"] = progress
+            self._publish({"type": "progress", "progress": progress, "node": name},
+                          coalesce_key=f"progress:{self.task_id}")
+
+    def on_node_error(self, name: str, error: BaseException):
+        started = self._started.pop(name, None)
+        elapsed = round(time.perf_counter() - started, 4) if started is not None else None
+        self.task["nodes"][name] = {**self.task["nodes"].get(name, {}), "status": "failed",
+                                    "elapsed": elapsed, "error": str(error)}
+        metrics.inc("workflow_nodes_total", agent=self.agent_type, node=name, status="failed")
+        self._publish({"type": "node_error", "node": name, "elapsed": elapsed, "error": str(error)})
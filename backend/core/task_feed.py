@@ -0,0 +1,166 @@
+"""
+任务状态版本与增量
+任务每次变化时递增版本号并记录各字段的指纹，客户端带上已知版本即可只取回变化的字段与新增日志；
+长轮询与 SSE 通过等待版本变化实现，不再反复拉取完整任务
+"""
+
+import asyncio
+import os
+from collections import Counter, OrderedDict, deque
+from typing import Callable, Deque, Dict, Optional, Tuple
+
+from core.metrics import metrics
+from core.serialization import dumps
+
+# 参与增量比较的字段（logs 单独按新增条目返回）
+WATCHED_FIELDS = ("status", "progress", "current_node", "nodes", "outputs", "end_time", "coalesced_with")
+
+# 合并执行的别名任务未结束时，从执行中任务（leader）读取的字段
+LIVE_FIELDS = ("status", "progress", "current_node", "nodes")
+
+# 每个任务保留的版本历史条数，客户端版本早于历史时返回完整状态
+HISTORY_SIZE = int(os.getenv("TASK_FEED_HISTORY", "64"))
+
+# 保留版本历史的任务数上限
+MAX_TASKS = int(os.getenv("TASK_FEED_MAX_TASKS", "10000"))
+
+# 长轮询最长等待秒数与 SSE 心跳间隔
+MAX_WAIT = float(os.getenv("TASK_LONG_POLL_MAX_WAIT", "60"))
+SSE_HEARTBEAT = float(os.getenv("TASK_SSE_HEARTBEAT", "15"))
+
+Marks = Tuple[Dict[str, object], int]
+
+
+def _fingerprint(value):
+    if isinstance(value, (dict, list)):
+        return hash(dumps(value, sort_keys=True))
+    return value
+
+
+def _marks(task: dict) -> Marks:
+    """字段指纹与日志条数"""
+    return {field: _fingerprint(task.get(field)) for field in WATCHED_FIELDS}, len(task.get("logs", []))
+
+
+class TaskFeed:
+    """任务版本历史与等待者"""
+
+    def __init__(self, history_size: int = HISTORY_SIZE, max_tasks: int = MAX_TASKS):
+        self.history_size = history_size
+        self.max_tasks = max_tasks
+        self._history: "OrderedDict[str, Deque[Tuple[int, Marks]]]" = OrderedDict()
+        self._waiters: Dict[str, asyncio.Event] = {}
+        self._waiting: Counter = Counter()
+        # 所有任务的变化次数
+        self.revision = 0
+        # 任务状态变化（以及新增、删除任务）的次数，仪表盘快照据此判断是否需要重新生成
+        self.status_revision = 0
+        # 任务变化回调（共享状态后端据此同步任务记录）
+        self.on_touch: Optional[Callable[[dict], None]] = None
+
+    def touch(self, task: dict, version: int = 0) -> int:
+        """任务发生变化：递增版本号（写入任务记录，随任务一起落盘）并唤醒等待者
+
+        version 为 worker 进程已分配的版本号（合并回报时中间版本不会逐个出现），版本号只增不减
+        """
+        task_id = task["id"]
+        version = max(version, task.get("version", 0) + 1)
+        task["version"] = version
+        self.revision += 1
+
+        marks = _marks(task)
+        history = self._history.get(task_id)
+        if not history or history[-1][1][0]["status"] != marks[0]["status"]:
+            self.status_revision += 1
+        self._record(task_id, version, marks)
+
+        if self.on_touch is not None:
+            self.on_touch(task)
+        self.notify(task_id)
+        return version
+
+    def _record(self, key: str, version: int, marks: Marks):
+        history = self._history.get(key)
+        if history is None:
+            history = self._history[key] = deque(maxlen=self.history_size)
+            while len(self._history) > self.max_tasks:
+                self._history.popitem(last=False)
+        else:
+            self._history.move_to_end(key)
+        if not history or history[-1][0] != version:
+            history.append((version, marks))
+
+    def view(self, task: dict, leader: dict) -> Tuple[dict, str]:
+        """合并到 leader 的别名任务的实时视图，返回 (视图, 历史键)
+
+        进度字段取自 leader，版本号为两者版本之和：任一方变化时递增，且总大于别名自身此前的版本，
+        客户端持有的别名版本不会与视图版本混淆；视图历史单独保存，增量按视图历史比较
+        """
+        version = task.get("version", 0) + leader.get("version", 0)
+        view = {**task, **{field: leader.get(field) for field in LIVE_FIELDS}, "version": version}
+        key = f"{task['id']}>{leader['id']}"
+        self._record(key, version, _marks(view))
+        return view, key
+
+    def notify(self, task_id: str):
+        """唤醒等待该任务变化的请求（其他进程上的任务变化也经由这里）"""
+        waiter = self._waiters.pop(task_id, None)
+        if waiter is not None:
+            waiter.set()
+
+    def forget(self, task_id: str):
+        """任务被删除"""
+        self._history.pop(task_id, None)
+        self.revision += 1
+        self.status_revision += 1
+
+    def delta(self, task: dict, since_version: int = 0, key: Optional[str] = None) -> dict:
+        """自 since_version 以来的变化；版本未知或过旧时返回完整状态（full=True）
+
+        key 为版本历史键，默认是任务ID（别名任务的视图使用 view 返回的键）
+        """
+        version = task.get("version", 0)
+        if since_version and since_version == version:
+            return {"version": version, "full": False, "changes": {}, "logs": []}
+
+        marks = None
+        for recorded, recorded_marks in self._history.get(key or task["id"], ()):
+            if recorded == since_version:
+                marks = recorded_marks
+                break
+
+        logs = task.get("logs", [])
+        if marks is None:
+            metrics.inc("task_feed_responses_total", kind="full")
+            return {"version": version, "full": True,
+                    "changes": {field: task.get(field) for field in WATCHED_FIELDS}, "logs": list(logs)}
+
+        fields, log_count = marks
+        current, _ = _marks(task)
+        metrics.inc("task_feed_responses_total", kind="delta")
+        return {"version": version, "full": False,
+                "changes": {field: task.get(field) for field in WATCHED_FIELDS if current[field] != fields[field]},
+                "logs": logs[log_count:]}
+
+    async def wait(self, task_id: str, since_version: int, current_version: int, timeout: float) -> bool:
+        """等待任务版本超过 since_version，超时返回 False"""
+        if current_version > since_version:
+            return True
+        waiter = self._waiters.setdefault(task_id, asyncio.Event())
+        self._waiting[task_id] += 1
+        metrics.inc("task_feed_waits_total")
+        try:
+            await asyncio.wait_for(waiter.wait(), timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self._waiting[task_id] -= 1
+            if not self._waiting[task_id]:
+                del self._waiting[task_id]
+                if self._waiters.get(task_id) is waiter:
+                    del self._waiters[task_id]
+
+
+# 全局实例
+task_feed = TaskFeed()
@@ -0,0 +1,119 @@
+"""
+工作流执行
+执行 Agent 工作流并把状态、节点事件与结果写入任务记录；
+API 进程内的调度器与独立的 worker 进程（任务队列模式）共用同一套执行逻辑
+"""
+
+import os
+from datetime import datetime
+
+from core.agents import get_agent_workflow
+from core.checkpoint_store import checkpoint_store
+from core.task_events import TaskEventListener
+from core.task_feed import task_feed
+
+
+def _log(task: dict, message: str, status: str):
+    task["logs"].append({
+        "time": datetime.now().isoformat(),
+        "message": message,
+        "status": status
+    })
+
+
+async def run_agent_workflow(task: dict, message: str, resume: bool = False):
+    """执行工作流并把结果写入任务记录
+
+    resume=True 时从检查点恢复：复用原始初始状态，跳过已完成的节点
+    """
+    task_id = task["id"]
+    agent_type = task["agent_type"]
+    workflow = get_agent_workflow(agent_type)
+
+    if not workflow:
+        task["status"] = "failed"
+        _log(task, f"Workflow for {agent_type} not found", "error")
+        return
+
+    try:
+        if resume:
+            run = checkpoint_store.get_run(task_id)
+            initial_state = run["initial_state"]
+            checkpoint_store.finish_run(task_id, "running")
+            _log(task, "从检查点恢复工作流", "info")
+        else:
+            initial_state = None
+
+        # 安全检查1: 目标对齐（恢复执行时已检查过）
+        from core.agents import goal_alignment_check
+        if not resume and not goal_alignment_check({
+            "task": message,
+            "progress": 0.0
+        }):
+            task["status"] = "rejected"
+            _log(task, "目标对齐检查失败，任务被拒绝", "error")
+            return
+
+        # 安全检查2: 频率限制
+        from core.agents import rate_limit_check
+        if not resume and not rate_limit_check(agent_type):
+            task["status"] = "rate_limited"
+            _log(task, "操作频率过高，任务被限制", "warning")
+            return
+
+        # 初始化状态
+        if initial_state is None:
+            initial_state = {
+                "messages": [f"Task: {message}"],
+                "current_agent": agent_type,
+                "task": message,
+                "status": "running",
+                "progress": 0.0,
+                "start_time": datetime.now(),
+                "task_id": task_id,
+                "audit_logs": []
+            }
+            checkpoint_store.start_run(task_id, agent_type, message, initial_state)
+
+        task["status"] = "running"
+        task_feed.touch(task)
+
+        # 节点开始/结束/进度逐步写入任务记录并推送给订阅者
+        events = TaskEventListener(task, len(workflow.dag.order))
+
+        # 执行工作流（每个节点完成后保存检查点）
+        record_dir = os.getenv("RECORD_WORKFLOWS_DIR")
+        if record_dir and not resume:
+            # 录制本次执行，供回放回归测试使用
+            from core.replay import WorkflowRecorder
+            recorder = WorkflowRecorder(agent_type)
+            result = await recorder.run(workflow, initial_state, listener=events, checkpointer=checkpoint_store)
+            recorder.save(os.path.join(record_dir, f"{task_id}.jsonl.gz"))
+        else:
+            result = await workflow.ainvoke(initial_state, checkpointer=checkpoint_store, listener=events)
+        checkpoint_store.finish_run(task_id, "completed")
+
+        # 更新任务状态
+        task["status"] = "completed"
+        task["progress"] = 100.0
+        task["end_time"] = datetime.now().isoformat()
+
+        # 提取输出
+        if agent_type in result:
+            task["outputs"] = result[agent_type]
+
+        schedule = result.get("schedule", {})
+        task["logs"].append({
+            "time": datetime.now().isoformat(),
+            "message": f"{agent_type} workflow completed successfully",
+            "status": "success",
+            "duration": (datetime.now() - datetime.fromisoformat(task["start_time"])).total_seconds(),
+            "critical_path": schedule.get("critical_path", []),
+            "node_durations": schedule.get("durations", {})
+        })
+
+    except Exception as e:
+        task["status"] = "failed"
+        checkpoint_store.finish_run(task_id, "failed")
+        _log(task, f"Error executing workflow: {str(e)}", "error")
+        print(f"Error executing workflow: {e}")
@@ -0,0 +1,145 @@
+"""
+有界优先级任务调度器
+限制全局与每个Agent的并发工作流数量，按优先级排队、同优先级先进先出，
+队列满时拒绝新任务，过载时保持稳定吞吐而不是同时启动所有工作流
+"""
+
+import asyncio
+import bisect
+import itertools
+import os
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Awaitable, Dict, List, Optional
+
+from core.metrics import metrics
+
+# 优先级（数值越小越先执行）
+PRIORITY_CLASSES = {
+    "interactive": 0,
+    "normal": 1,
+    "batch": 2,
+}
+
+MAX_CONCURRENCY = int(os.getenv("SCHEDULER_MAX_CONCURRENCY", "8"))
+MAX_QUEUE = int(os.getenv("SCHEDULER_MAX_QUEUE", "200"))
+
+
+def _parse_limits(value: str) -> Dict[str, int]:
+    """解析 "elon=3,henry=3" 形式的每Agent并发上限"""
+    limits = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        agent_type, _, limit = item.partition("=")
+        limits[agent_type.strip()] = int(limit)
+    return limits
+
+
+AGENT_CONCURRENCY = _parse_limits(os.getenv("SCHEDULER_AGENT_CONCURRENCY", "echo=4,elon=3,henry=3"))
+
+
+class SchedulerFull(RuntimeError):
+    """队列已满"""
+
+
+@dataclass(order=True)
+class _Job:
+    priority: int
+    seq: int
+    task_id: str = field(compare=False)
+    agent_type: str = field(compare=False)
+    coro: Awaitable = field(compare=False)
+    enqueued_at: float = field(compare=False, default_factory=time.monotonic)
+
+
+class TaskScheduler:
+    """任务调度器
+
+    不使用后台循环：提交任务与任务结束时各做一次派发，
+    按 (优先级, 提交顺序) 取出第一个所属Agent仍有空闲并发的任务
+    """
+
+    def __init__(self, max_concurrency: int = MAX_CONCURRENCY, agent_limits: Optional[Dict[str, int]] = None,
+                 max_queue: int = MAX_QUEUE):
+        self.max_concurrency = max_concurrency
+        self.agent_limits = agent_limits if agent_limits is not None else AGENT_CONCURRENCY
+        self.max_queue = max_queue
+        self._queue: List[_Job] = []
+        self._seq = itertools.count()
+        self.running: Counter = Counter()
+        self.tasks: Dict[str, asyncio.Task] = {}
+
+    def is_full(self) -> bool:
+        return len(self._queue) >= self.max_queue
+
+    def submit(self, task_id: str, agent_type: str, coro: Awaitable, priority: str = "normal") -> int:
+        """提交任务，返回排队位置（0 表示已开始执行）"""
+        if self.is_full():
+            coro.close()
+            metrics.inc("scheduler_rejected_total", agent=agent_type)
+            raise SchedulerFull(f"Task queue is full ({self.max_queue})")
+
+        job = _Job(PRIORITY_CLASSES.get(priority, PRIORITY_CLASSES["normal"]), next(self._seq),
+                   task_id, agent_type, coro)
+        bisect.insort(self._queue, job)
+        metrics.inc("scheduler_submitted_total", agent=agent_type, priority=priority)
+        self._dispatch()
+        return self.position(task_id) or 0
+
+    def position(self, task_id: str) -> Optional[int]:
+        """排队位置（从1开始），不在队列中时返回 None"""
+        for index, job in enumerate(self._queue, 1):
+            if job.task_id == task_id:
+                return index
+        return None
+
+    def _has_capacity(self, agent_type: str) -> bool:
+        limit = self.agent_limits.get(agent_type)
+        return limit is None or self.running[agent_type] < limit
+
+    def _dispatch(self):
+        """启动所有可以启动的任务"""
+        index = 0
+        while index < len(self._queue) and sum(self.running.values()) < self.max_concurrency:
+            job = self._queue[index]
+            if not self._has_capacity(job.agent_type):
+                # 该Agent已满，不阻塞其他Agent的任务
+                index += 1
+                continue
+            self._queue.pop(index)
+            self._start(job)
+        self._export()
+
+    def _start(self, job: _Job):
+        self.running[job.agent_type] += 1
+        metrics.inc("scheduler_wait_seconds_total", time.monotonic() - job.enqueued_at, agent=job.agent_type)
+        metrics.inc("scheduler_started_total", agent=job.agent_type)
+
+        async def run():
+            try:
+                return await job.coro
+            finally:
+                self.running[job.agent_type] -= 1
+                self.tasks.pop(job.task_id, None)
+                self._dispatch()
+
+        self.tasks[job.task_id] = asyncio.create_task(run())
+
+    def _export(self):
+        for name, value in PRIORITY_CLASSES.items():
+            metrics.set("scheduler_queue_depth", sum(1 for job in self._queue if job.priority == value), priority=name)
+        for agent_type, count in self.running.items():
+            metrics.set("scheduler_running", count, agent=agent_type)
+
+    def stats(self) -> dict:
+        return {
+            "queued": len(self._queue),
+            "running": dict(self.running),
+            "max_concurrency": self.max_concurrency,
+            "agent_limits": self.agent_limits,
+            "max_queue": self.max_queue,
+        }
+
+
+# 全局调度器实例
+task_scheduler = TaskScheduler()
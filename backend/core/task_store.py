@@ -0,0 +1,558 @@
+"""
+任务状态存储模块
+内存热层按任务数与字节数限制，已结束的任务按 LRU / TTL 淘汰并落盘到 SQLite，
+按任务ID读取时透明地从磁盘加载，服务运行再久常驻内存也不会持续增长
+"""
+
+import asyncio
+import base64
+import bisect
+import heapq
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from itertools import islice
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from core.metrics import metrics
+
+# 数据库文件路径
+DB_PATH = Path(__file__).parent.parent / "tasks.db"
+
+# 热层上限
+MAX_HOT_TASKS = int(os.getenv("TASK_STORE_MAX_TASKS", "1000"))
+MAX_HOT_BYTES = int(os.getenv("TASK_STORE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# 已结束的任务多久未访问后落盘（秒）
+TASK_TTL = float(os.getenv("TASK_STORE_TTL", "3600"))
+
+# 两次淘汰检查的最小间隔（秒），超过任务数上限时立即检查
+SWEEP_INTERVAL = 30.0
+
+# 已落盘任务按状态计数的缓存秒数（本进程落盘或删除时立即失效，超时后重新聚合以计入其他进程的落盘）
+COUNT_TTL = 5.0
+
+# 已结束（可以淘汰）的任务状态
+FINISHED_STATUSES = {"completed", "failed", "rejected", "rate_limited"}
+
+
+def _dumps(task: dict) -> str:
+    return json.dumps(task, ensure_ascii=False, default=str)
+
+
+def _running_loop() -> Optional[asyncio.AbstractEventLoop]:
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+def _sort_key(task: dict) -> Tuple[str, str]:
+    return (task.get("start_time") or "", task["id"])
+
+
+def encode_cursor(task: dict) -> str:
+    """分页游标：最后一条记录的 (start_time, id)"""
+    return base64.urlsafe_b64encode(json.dumps(_sort_key(task)).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    """解析分页游标，格式不正确时统一抛出 ValueError"""
+    key = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    if not (isinstance(key, list) and len(key) == 2 and all(isinstance(part, str) for part in key)):
+        raise ValueError(f"Invalid cursor: {cursor}")
+    start_time, task_id = key
+    return start_time, task_id
+
+
+class SortedIndex:
+    """按 (start_time, id) 有序的任务ID索引"""
+
+    def __init__(self):
+        self.keys: List[Tuple[str, str]] = []
+
+    def add(self, key: Tuple[str, str]):
+        index = bisect.bisect_left(self.keys, key)
+        if index == len(self.keys) or self.keys[index] != key:
+            self.keys.insert(index, key)
+
+    def remove(self, key: Tuple[str, str]):
+        index = bisect.bisect_left(self.keys, key)
+        if index < len(self.keys) and self.keys[index] == key:
+            self.keys.pop(index)
+
+    def scan(self, after: Optional[Tuple[str, str]], descending: bool) -> Iterator[Tuple[str, str]]:
+        """从游标之后按顺序遍历"""
+        if descending:
+            end = bisect.bisect_left(self.keys, after) if after else len(self.keys)
+            return (self.keys[i] for i in range(end - 1, -1, -1))
+        start = bisect.bisect_right(self.keys, after) if after else 0
+        return (self.keys[i] for i in range(start, len(self.keys)))
+
+
+class TaskStore:
+    """任务状态存储类（按字典方式使用）"""
+
+    def __init__(self, db_path: Path = DB_PATH, max_tasks: int = MAX_HOT_TASKS,
+                 max_bytes: int = MAX_HOT_BYTES, ttl: float = TASK_TTL):
+        self.db_path = db_path
+        self.max_tasks = max_tasks
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._hot: "OrderedDict[str, dict]" = OrderedDict()
+        self._touched: Dict[str, float] = {}
+        # 序列化后的字节数，按任务版本号缓存（任务每次变化都会递增版本号，见 core.task_feed）
+        self._sizes: Dict[str, Tuple[Any, int]] = {}
+        # 后台落盘与删除按提交顺序在单个线程中执行（删除不会被之后完成的落盘覆盖）
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="task-store")
+        self._spilling: set = set()
+        self._pending: set = set()
+        self._last_sweep = time.monotonic()
+        # 热层二级索引：按开始时间、按Agent类型+开始时间（状态会变化，查询时过滤）
+        self._by_time = SortedIndex()
+        self._by_agent: Dict[str, SortedIndex] = defaultdict(SortedIndex)
+        # 从磁盘加载回热层的任务在 SQLite 中仍有记录：任务ID -> 落盘时的状态（计数时扣除）
+        self._shadowed: Dict[str, str] = {}
+        self._cold_counts: Optional[Counter] = None
+        self._cold_counted_at = 0.0
+        # 落盘或删除时递增，线程中聚合期间计数已失效时不缓存聚合结果
+        self._counts_generation = 0
+        # 其他进程的任务（共享状态后端，实现 load_task / delete_task），未启用时为 None
+        self.remote = None
+        # 表结构在应用启动时创建（init_db），首次访问数据库时也会自动创建
+        self._initialized = False
+        self._initializing = False
+        self._init_lock = threading.RLock()
+
+    def init_db(self):
+        """初始化数据库（幂等；后台写入线程与事件循环可能同时首次访问，建表完成前其他线程等待）"""
+        if self._initialized:
+            return
+        with self._init_lock:
+            if self._initialized or self._initializing:
+                return
+            self._initializing = True
+            try:
+                self._init_db()
+                self._initialized = True
+            finally:
+                self._initializing = False
+
+    @contextmanager
+    def _get_connection(self):
+        """数据库连接上下文管理器"""
+        if not self._initialized:
+            self.init_db()
+        conn = sqlite3.connect(self.db_path)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def _init_db(self):
+        """初始化数据库表"""
+        with self._get_connection() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS tasks (
+                    id TEXT PRIMARY KEY,
+                    agent_type TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    start_time TEXT,
+                    data TEXT NOT NULL,
+                    spilled_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_start_time ON tasks (start_time, id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks (status, start_time, id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_agent_type ON tasks (agent_type, start_time, id)")
+
+    # ===== 字典接口 =====
+
+    def __contains__(self, task_id: str) -> bool:
+        return self.get(task_id) is not None
+
+    def __getitem__(self, task_id: str) -> dict:
+        task = self.get(task_id)
+        if task is None:
+            raise KeyError(task_id)
+        return task
+
+    def get(self, task_id: str, default: Any = None) -> Optional[dict]:
+        """读取任务；已落盘的任务加载回热层，其他进程的任务返回只读副本（不进入热层）"""
+        if task_id in self._hot:
+            return self._hit(task_id)
+        return self._place(task_id, *self._lookup(task_id), default=default)
+
+    async def aget(self, task_id: str, default: Any = None) -> Optional[dict]:
+        """与 get 相同，但热层未命中时在线程中查询磁盘与共享状态，不阻塞事件循环"""
+        if task_id in self._hot:
+            return self._hit(task_id)
+        found = await asyncio.to_thread(self._lookup, task_id)
+        if task_id in self._hot:
+            # 查询期间任务已写入热层
+            return self._hit(task_id)
+        return self._place(task_id, *found, default=default)
+
+    def _lookup(self, task_id: str) -> Tuple[Optional[dict], bool]:
+        """依次查询已落盘的任务与其他进程的任务，返回 (任务, 是否来自本地磁盘)"""
+        task = self._load(task_id)
+        if task is not None:
+            return task, True
+        return self._load_remote(task_id), False
+
+    def _place(self, task_id: str, task: Optional[dict], local: bool, default: Any = None) -> Optional[dict]:
+        if task is None:
+            return default
+        if not local:
+            return task
+        self._hot[task_id] = task
+        self._shadowed[task_id] = task.get("status", "")
+        self._index(task)
+        metrics.inc("task_store_loaded_total")
+        return self._hit(task_id)
+
+    def _hit(self, task_id: str) -> dict:
+        task = self._hot[task_id]
+        self._touch(task_id)
+        self._maybe_evict()
+        return task
+
+    def __setitem__(self, task_id: str, task: dict):
+        if task_id in self._hot:
+            self._unindex(self._hot[task_id])
+        self._hot[task_id] = task
+        self._sizes.pop(task_id, None)
+        self._index(task)
+        self._touch(task_id)
+        self._maybe_evict(force=len(self._hot) - len(self._spilling) > self.max_tasks)
+
+    def __delitem__(self, task_id: str):
+        # 经由写入线程执行，排在已提交的后台落盘之后
+        found = self._writer.submit(self._delete, task_id, self._forget(task_id)).result()
+        self._invalidate_counts()
+        self._export()
+        if not found:
+            raise KeyError(task_id)
+
+    async def adelete(self, task_id: str):
+        """与 del 相同，但 SQLite 与共享状态中的删除在后台线程中执行，不阻塞事件循环"""
+        found = self._forget(task_id)
+        future = asyncio.wrap_future(self._writer.submit(self._delete, task_id, found))
+        self._pending.add(future)
+        try:
+            found = await future
+        finally:
+            self._pending.discard(future)
+            self._invalidate_counts()
+            self._export()
+        if not found:
+            raise KeyError(task_id)
+
+    def _forget(self, task_id: str) -> bool:
+        """移出热层，返回任务是否在热层中"""
+        task = self._hot.pop(task_id, None)
+        if task is not None:
+            self._unindex(task)
+        self._touched.pop(task_id, None)
+        self._sizes.pop(task_id, None)
+        self._shadowed.pop(task_id, None)
+        return task is not None
+
+    def _delete(self, task_id: str, found: bool) -> bool:
+        """删除已落盘与其他进程的记录，返回任务是否存在"""
+        with self._get_connection() as conn:
+            if conn.execute("DELETE FROM tasks WHERE id = ?", (task_id,)).rowcount > 0:
+                found = True
+        if self.remote is not None:
+            found = self.remote.delete_task(task_id) or found
+        return found
+
+    def __len__(self) -> int:
+        return len(self._hot) + sum(self._cold_status_counts().values())
+
+    def __iter__(self) -> Iterator[str]:
+        return (task["id"] for task in self.values())
+
+    def values(self) -> List[dict]:
+        """所有任务（热层 + 已落盘），不改变热层内容"""
+        with self._get_connection() as conn:
+            rows = conn.execute("SELECT id, data FROM tasks ORDER BY start_time").fetchall()
+        cold = [json.loads(row["data"]) for row in rows if row["id"] not in self._hot]
+        return cold + list(self._hot.values())
+
+    def count_by_status(self) -> Dict[str, int]:
+        """各状态的任务数（热层 + 已落盘）"""
+        return self._count(self._cold_status_counts())
+
+    async def acount_by_status(self) -> Dict[str, int]:
+        """与 count_by_status 相同，已落盘部分的计数缓存过期时在线程中重新聚合"""
+        cold = self._cold_counts if self._counts_fresh() else await asyncio.to_thread(self._count_cold)
+        return self._count(cold - Counter(self._shadowed.values()))
+
+    def _count(self, cold: Counter) -> Dict[str, int]:
+        counts = Counter(task.get("status") for task in self._hot.values())
+        counts.update(cold)
+        return dict(counts)
+
+    def _cold_status_counts(self) -> Counter:
+        """已落盘且不在热层的任务按状态计数：SQLite 按状态索引聚合后缓存，扣除已加载回热层的任务"""
+        cold = self._cold_counts if self._counts_fresh() else self._count_cold()
+        return cold - Counter(self._shadowed.values())
+
+    def _counts_fresh(self) -> bool:
+        return self._cold_counts is not None and time.monotonic() - self._cold_counted_at < COUNT_TTL
+
+    def _count_cold(self) -> Counter:
+        generation = self._counts_generation
+        with self._get_connection() as conn:
+            rows = conn.execute("SELECT status, COUNT(*) AS total FROM tasks GROUP BY status").fetchall()
+        counts = Counter({row["status"]: row["total"] for row in rows})
+        if generation == self._counts_generation:
+            self._cold_counts = counts
+            self._cold_counted_at = time.monotonic()
+        return counts
+
+    def _invalidate_counts(self):
+        self._cold_counts = None
+        self._counts_generation += 1
+
+    # ===== 索引与分页查询 =====
+
+    def _index(self, task: dict):
+        self._by_time.add(_sort_key(task))
+        self._by_agent[task.get("agent_type", "")].add(_sort_key(task))
+
+    def _unindex(self, task: dict):
+        self._by_time.remove(_sort_key(task))
+        self._by_agent[task.get("agent_type", "")].remove(_sort_key(task))
+
+    def query(self, status: Optional[List[str]] = None, agent_type: Optional[str] = None,
+              since: Optional[str] = None, until: Optional[str] = None, cursor: Optional[str] = None,
+              limit: int = 50, descending: bool = True) -> Tuple[List[dict], Optional[str]]:
+        """按条件分页查询任务（按开始时间排序），返回 (本页任务, 下一页游标)
+
+        热层用内存索引、已落盘的任务用 SQLite 索引各取一页再归并，开销与页大小相关而与任务总数无关
+        """
+        after = decode_cursor(cursor) if cursor else None
+        statuses = set(status or [])
+        hot = self._query_hot(statuses, agent_type, since, until, after, limit + 1, descending)
+        cold = self._query_cold(statuses, agent_type, since, until, after, limit + 1, descending)
+        return self._merge(hot, cold, limit, descending)
+
+    async def aquery(self, status: Optional[List[str]] = None, agent_type: Optional[str] = None,
+                     since: Optional[str] = None, until: Optional[str] = None, cursor: Optional[str] = None,
+                     limit: int = 50, descending: bool = True) -> Tuple[List[dict], Optional[str]]:
+        """与 query 相同，但已落盘的部分在线程中查询，不阻塞事件循环"""
+        after = decode_cursor(cursor) if cursor else None
+        statuses = set(status or [])
+        hot = self._query_hot(statuses, agent_type, since, until, after, limit + 1, descending)
+        cold = await asyncio.to_thread(self._query_cold, statuses, agent_type, since, until, after,
+                                       limit + 1, descending)
+        return self._merge(hot, cold, limit, descending)
+
+    def _query_hot(self, statuses: Iterable[str], agent_type: Optional[str], since: Optional[str],
+                   until: Optional[str], after: Optional[Tuple[str, str]], limit: int,
+                   descending: bool) -> List[dict]:
+        """按内存索引取一页热层任务（状态会变化，遍历时过滤）"""
+        def matches(task: dict) -> bool:
+            start_time = task.get("start_time") or ""
+            return (not statuses or task.get("status") in statuses) \
+                and (not since or start_time >= since) and (not until or start_time < until)
+
+        index = self._by_agent.get(agent_type, SortedIndex()) if agent_type else self._by_time
+        hot = (self._hot[key[1]] for key in index.scan(after, descending))
+        return list(islice((task for task in hot if matches(task)), limit))
+
+    @staticmethod
+    def _merge(hot: List[dict], cold: List[dict], limit: int,
+               descending: bool) -> Tuple[List[dict], Optional[str]]:
+        """归并两页结果（线程中查询期间落盘或加载的任务可能同时出现在两边，按ID去重）"""
+        merged, seen = [], set()
+        for task in heapq.merge(hot, cold, key=_sort_key, reverse=descending):
+            if task["id"] in seen:
+                continue
+            seen.add(task["id"])
+            merged.append(task)
+            if len(merged) > limit:
+                break
+        next_cursor = encode_cursor(merged[limit - 1]) if len(merged) > limit else None
+        return merged[:limit], next_cursor
+
+    def _query_cold(self, statuses: Iterable[str], agent_type: Optional[str], since: Optional[str],
+                    until: Optional[str], after: Optional[Tuple[str, str]], limit: int,
+                    descending: bool) -> List[dict]:
+        """从 SQLite 按索引取一页已落盘的任务（跳过已加载回热层的任务）"""
+        conditions, params = [], []
+        if statuses:
+            conditions.append(f"status IN ({','.join('?' * len(statuses))})")
+            params += list(statuses)
+        if agent_type:
+            conditions.append("agent_type = ?")
+            params.append(agent_type)
+        if since:
+            conditions.append("start_time >= ?")
+            params.append(since)
+        if until:
+            conditions.append("start_time < ?")
+            params.append(until)
+
+        op, order = ("<", "DESC") if descending else (">", "ASC")
+        tasks: List[dict] = []
+        with self._get_connection() as conn:
+            while len(tasks) < limit:
+                where = list(conditions)
+                page_params = list(params)
+                if after:
+                    where.append(f"(start_time {op} ? OR (start_time = ? AND id {op} ?))")
+                    page_params += [after[0], after[0], after[1]]
+                sql = "SELECT id, start_time, data FROM tasks"
+                if where:
+                    sql += " WHERE " + " AND ".join(where)
+                sql += f" ORDER BY start_time {order}, id {order} LIMIT ?"
+                rows = conn.execute(sql, page_params + [limit]).fetchall()
+                tasks += [json.loads(row["data"]) for row in rows if row["id"] not in self._hot]
+                if len(rows) < limit:
+                    break
+                after = (rows[-1]["start_time"] or "", rows[-1]["id"])
+        return tasks[:limit]
+
+    # ===== 淘汰与落盘 =====
+
+    def _touch(self, task_id: str):
+        self._hot.move_to_end(task_id)
+        self._touched[task_id] = time.time()
+
+    def _size(self, task_id: str) -> int:
+        """序列化后的字节数，版本号未变时复用上次的结果"""
+        task = self._hot[task_id]
+        cached = self._sizes.get(task_id)
+        if cached is None or cached[0] != task.get("version"):
+            cached = self._sizes[task_id] = (task.get("version"), len(_dumps(task).encode("utf-8")))
+        return cached[1]
+
+    def _maybe_evict(self, force: bool = False):
+        """读写热层时顺带检查淘汰；在事件循环中时落盘交给后台线程"""
+        now = time.monotonic()
+        if force or now - self._last_sweep >= SWEEP_INTERVAL:
+            self._last_sweep = now
+            self.evict(background=_running_loop() is not None)
+
+    def evict(self, background: bool = False) -> int:
+        """落盘超过 TTL 的已结束任务，并按 LRU 顺序落盘直到任务数与字节数回到上限内
+
+        background=True 时在后台线程写入 SQLite，写入完成后才移出热层（期间任务仍可正常读取）
+        """
+        now = time.time()
+        finished = [task_id for task_id, task in self._hot.items()
+                    if task.get("status") in FINISHED_STATUSES and task_id not in self._spilling]
+        spill = [task_id for task_id in finished if now - self._touched.get(task_id, now) > self.ttl]
+
+        remaining = [task_id for task_id in finished if task_id not in spill]
+        excess = len(self._hot) - len(self._spilling) - len(spill) - self.max_tasks
+        if excess > 0:
+            spill += remaining[:excess]
+            remaining = remaining[excess:]
+
+        hot_bytes = sum(self._size(task_id) for task_id in remaining)
+        while remaining and hot_bytes > self.max_bytes:
+            task_id = remaining.pop(0)
+            hot_bytes -= self._size(task_id)
+            spill.append(task_id)
+
+        if spill:
+            self._spill(spill, background)
+        metrics.set("task_store_hot_bytes", hot_bytes)
+        self._export()
+        return len(spill)
+
+    def _spill(self, task_ids: List[str], background: bool = False):
+        """序列化（在调用方线程）并写入 SQLite，写入成功后把写入期间未变化的任务移出热层"""
+        versions, rows = {}, []
+        for task_id in task_ids:
+            task = self._hot[task_id]
+            versions[task_id] = task.get("version")
+            rows.append((task_id, task.get("agent_type", ""), task.get("status", ""),
+                         task.get("start_time"), _dumps(task)))
+        if not background:
+            self._writer.submit(self._write, rows).result()
+            self._release(versions)
+            return
+
+        self._spilling.update(task_ids)
+        future = asyncio.wrap_future(self._writer.submit(self._write, rows))
+        self._pending.add(future)
+
+        def done(future):
+            self._pending.discard(future)
+            self._spilling.difference_update(task_ids)
+            if future.cancelled() or future.exception() is not None:
+                # 写入失败时任务留在热层，下次淘汰时重试
+                metrics.inc("task_store_spill_errors_total")
+                print(f"Task store spill failed: {future.exception() if not future.cancelled() else 'cancelled'}")
+                return
+            self._release(versions)
+
+        future.add_done_callback(done)
+
+    def _write(self, rows: List[tuple]):
+        with self._get_connection() as conn:
+            conn.executemany("""
+                INSERT OR REPLACE INTO tasks (id, agent_type, status, start_time, data)
+                VALUES (?, ?, ?, ?, ?)
+            """, rows)
+
+    def _release(self, versions: Dict[str, Any]):
+        """把已落盘的任务移出热层（写入期间再次变化或已被删除的任务跳过）"""
+        released = 0
+        for task_id, version in versions.items():
+            task = self._hot.get(task_id)
+            if task is None or task.get("version") != version:
+                continue
+            del self._hot[task_id]
+            self._unindex(task)
+            self._touched.pop(task_id, None)
+            self._sizes.pop(task_id, None)
+            self._shadowed.pop(task_id, None)
+            released += 1
+        self._invalidate_counts()
+        metrics.inc("task_store_spilled_total", released)
+        self._export()
+
+    async def drain(self):
+        """等待后台落盘与删除全部完成"""
+        while self._pending:
+            await asyncio.gather(*list(self._pending), return_exceptions=True)
+
+    def _load_remote(self, task_id: str) -> Optional[dict]:
+        return self.remote.load_task(task_id) if self.remote is not None else None
+
+    def _load(self, task_id: str) -> Optional[dict]:
+        with self._get_connection() as conn:
+            row = conn.execute("SELECT data FROM tasks WHERE id = ?", (task_id,)).fetchone()
+        return json.loads(row["data"]) if row else None
+
+    def _export(self):
+        metrics.set("task_store_hot_tasks", len(self._hot))
+
+    def flush(self):
+        """把热层中已结束的任务全部落盘（进程退出前调用，在当前线程中写入）"""
+        finished = [task_id for task_id, task in self._hot.items() if task.get("status") in FINISHED_STATUSES]
+        if finished:
+            self._spill(finished)
+        self._export()
+
+
+# 全局任务存储实例
+task_store = TaskStore()
@@ -3,10 +3,9 @@ Agent工作流实现
 """
 
 from typing import List, Dict, Literal
-from langgraph.graph import StateGraph, END
-from langchain_anthropic import ChatAnthropic
-from langchain_openai import ChatOpenAI
+import asyncio
 import json
+import re
 
 from core.agents import AgentState, AgentType, safety_check, goal_alignment_check, rate_limit_check, add_ai_assist_label, generate_audit_log
 from core.system_prompts import (
@@ -15,50 +14,55 @@ from core.system_prompts import (
     HENRY_SYSTEM_PROMPT
 )
 from core.audit_store import audit_store
-
-# 创建LLM实例
-def get_llm(agent_type: str):
-    """获取对应Agent的LLM实例"""
-    if agent_type in [AgentType.ELON, AgentType.ARCHITECT, AgentType.CODER, AgentType.QA]:
-        return ChatOpenAI(model="gpt-4", temperature=0.2)
-    else:
-        return ChatAnthropic(
-            model="claude-sonnet-4-20250514",
-            temperature=0.3
-        )
+from core.llm import invoke_llm
+from core.model_policy import model_policy
+from core.intent_classifier import INTENT_FAST_PATH, intent_classifier
+from core.dag_scheduler import DAGWorkflow, current_node, NodeSpec, reducers_from
+from core.prompt_budget import PromptBuilder
+
+# 声明了合并函数的字段：多个节点的增量按合并函数并入，不构成先后依赖
+STATE_REDUCERS = reducers_from(AgentState)
+
+def extract_json_block(content: str) -> dict:
+    """提取响应中 ```json 代码块的内容，没有或无法解析时返回空字典"""
+    match = re.search(r"```json\s*(.*?)```", content, re.S)
+    if not match:
+        return {}
+    try:
+        return json.loads(match.group(1))
+    except json.JSONDecodeError:
+        return {}
+
+def node_guidance(state: AgentState, node: str) -> str:
+    """获取派生任务为节点追加的输入要求"""
+    guidance = (state.get('node_inputs') or {}).get(node)
+    return f"\n\n补充要求：{guidance}" if guidance else ""
+
+def report_output_quality(content: str, *markers: str):
+    """反馈最近一次LLM调用的输出质量（见 core.model_policy）：输出为空或缺少要求的格式标记视为不合格"""
+    model_policy.report_quality(bool(content.strip()) and all(marker in content for marker in markers))
+
+async def log_action(**kwargs):
+    """在线程中写入审计日志（SQLite 写入不阻塞事件循环）"""
+    await asyncio.to_thread(audit_store.log_action, **kwargs)
+
+def make_summarizer(agent_type: str):
+    """创建用于压缩上游产出的摘要函数"""
+    async def summarize(text: str, budget: int) -> str:
+        prompt = f"""请将以下内容压缩为不超过 {budget} tokens 的摘要，保留关键结论、数据和结构：
+
+{text}"""
+        response = await invoke_llm(agent_type, prompt, node=f"{current_node.get()}:summarize")
+        report_output_quality(response.content)
+        return response.content
+    return summarize
 
 # Echo工作流
 def create_echo_workflow():
     """创建Echo工作流"""
 
-    def parse_intention(state: AgentState):
-        """解析用户意图"""
-        task_id = state.get('task_id', 'unknown')
-
-        # 安全检查1: 目标对齐
-        if not goal_alignment_check(state):
-            audit_log = generate_audit_log(task_id, AgentType.ECHO, 'rejected', '目标对齐失败')
-            print(audit_log)
-            audit_store.log_safety_event('goal_alignment_failed', '任务不符合核心目标，已被拒绝')
-            raise ValueError("任务不符合核心目标，已被安全系统拒绝")
-
-        # 安全检查2: 频率限制
-        if not rate_limit_check(AgentType.ECHO):
-            audit_log = generate_audit_log(task_id, AgentType.ECHO, 'rate_limited', '频率限制')
-            print(audit_log)
-            audit_store.log_safety_event('rate_limited', f"Agent {AgentType.ECHO} 频率限制")
-            raise ValueError("操作频率过高，请稍后再试")
-
-        # 安全检查3: 基础安全
-        safety_result = safety_check(state)
-        if safety_result == "block":
-            audit_log = generate_audit_log(task_id, AgentType.ECHO, 'blocked', '危险指令检测')
-            print(audit_log)
-            audit_store.log_safety_event('dangerous_command', '检测到危险指令', task_id)
-            raise ValueError("检测到危险指令，操作已被阻止")
-
-        llm = get_llm(AgentType.ECHO)
-
+    async def parse_intention_llm(state: AgentState, task_id: str, guidance: str):
+        """由LLM拆解技术任务与市场任务"""
         prompt = f"""作为Echo，请解析以下用户意图并拆解任务：
 
 用户消息：{state['task']}
@@ -71,7 +75,9 @@ def create_echo_workflow():
 Tech_Task: [描述技术任务]
 Market_Task: [描述市场任务]"""
 
-        response = llm.invoke(prompt)
+        prompt += guidance
+
+        response = await invoke_llm(AgentType.ECHO, prompt, node='parse_intention', task_id=task_id)
         content = response.content
 
         # 添加AI辅助标签
@@ -88,35 +94,79 @@ Market_Task: [描述市场任务]"""
             elif 'Market_Task:' in line:
                 market_task = line.replace('Market_Task:', '').strip()
 
+        # 快速模型未按格式输出时反馈质量信号，后续请求改用旗舰模型
+        model_policy.report_quality(bool(tech_task or market_task))
+        return tech_task, market_task
+
+    def screen_task(state: AgentState, task_id: str):
+        """目标对齐、频率限制与基础安全检查，未通过时记录安全事件并拒绝"""
+        # 安全检查1: 目标对齐
+        if not goal_alignment_check(state):
+            audit_log = generate_audit_log(task_id, AgentType.ECHO, 'rejected', '目标对齐失败')
+            print(audit_log)
+            audit_store.log_safety_event('goal_alignment_failed', '任务不符合核心目标，已被拒绝')
+            raise ValueError("任务不符合核心目标，已被安全系统拒绝")
+
+        # 安全检查2: 频率限制
+        if not rate_limit_check(AgentType.ECHO):
+            audit_log = generate_audit_log(task_id, AgentType.ECHO, 'rate_limited', '频率限制')
+            print(audit_log)
+            audit_store.log_safety_event('rate_limited', f"Agent {AgentType.ECHO} 频率限制")
+            raise ValueError("操作频率过高，请稍后再试")
+
+        # 安全检查3: 基础安全
+        safety_result = safety_check(state)
+        if safety_result == "block":
+            audit_log = generate_audit_log(task_id, AgentType.ECHO, 'blocked', '危险指令检测')
+            print(audit_log)
+            audit_store.log_safety_event('dangerous_command', '检测到危险指令', task_id)
+            raise ValueError("检测到危险指令，操作已被阻止")
+
+    async def parse_intention(state: AgentState):
+        """解析用户意图"""
+        task_id = state.get('task_id', 'unknown')
+
+        # 安全检查读写频率计数与审计库，在线程中执行
+        await asyncio.to_thread(screen_task, state, task_id)
+
+        # 快速路径：意图明确为纯技术或纯市场时直接拆解，不调用LLM
+        guidance = node_guidance(state, 'parse_intention')
+        intent = await intent_classifier.aclassify(state['task']) if INTENT_FAST_PATH and not guidance else None
+
+        if intent and intent.confident:
+            tech_task = state['task'] if intent.label == 'tech' else None
+            market_task = state['task'] if intent.label == 'market' else None
+            via = f' (快速路径 {intent.label} {intent.confidence:.2f})'
+        else:
+            tech_task, market_task = await parse_intention_llm(state, task_id, guidance)
+            via = ''
+
         # 记录审计日志到存储
         if tech_task or market_task:
-            audit_store.log_action(
+            await log_action(
                 task_id=task_id,
                 agent_type=AgentType.ECHO,
                 action='intention_parsed',
-                details=f'成功解析意图: Tech={tech_task}, Market={market_task}',
+                details=f'成功解析意图: Tech={tech_task}, Market={market_task}{via}',
                 success=True
             )
 
         return {
-            **state,
             'tech_tasks': [{'type': 'tech', 'description': tech_task}] if tech_task else [],
             'market_tasks': [{'type': 'market', 'description': market_task}] if market_task else [],
-            'audit_logs': state.get('audit_logs', []) + [generate_audit_log(task_id, AgentType.ECHO, 'parse_success', '意图解析成功')]
+            'audit_logs': [generate_audit_log(task_id, AgentType.ECHO, 'parse_success', '意图解析成功')]
         }
 
     def dispatch_tasks(state: AgentState):
         """分发任务"""
         return {
-            **state,
             'current_agent': 'dispatching',
-            'messages': state['messages'] + ['任务已分发，正在执行...']
+            'messages': ['任务已分发，正在执行...']
         }
 
     def monitor_progress(state: AgentState):
         """监控进度"""
         return {
-            **state,
             'current_agent': 'monitoring',
             'status': 'thinking'
         }
@@ -172,38 +222,33 @@ Market_Task: [描述市场任务]"""
             )
 
         return {
-            **state,
             'progress_report': report,
             'status': 'idle',
             'current_agent': 'echo'
         }
 
-    # 创建图
-    graph = StateGraph(AgentState)
-
-    # 添加节点
-    graph.add_node("parse_intention", parse_intention)
-    graph.add_node("dispatch_tasks", dispatch_tasks)
-    graph.add_node("monitor_progress", monitor_progress)
-    graph.add_node("generate_report", generate_report)
-
-    # 添加边
-    graph.set_entry_point("parse_intention")
-    graph.add_edge("parse_intention", "dispatch_tasks")
-    graph.add_edge("dispatch_tasks", "monitor_progress")
-    graph.add_edge("monitor_progress", "generate_report")
-    graph.add_edge("generate_report", END)
-
-    return graph.compile()
+    # 节点声明读写字段，由调度器推导依赖
+    return DAGWorkflow('echo', [
+        NodeSpec('parse_intention', parse_intention,
+                 reads=('task', 'task_id'),
+                 writes=('tech_tasks', 'market_tasks', 'audit_logs')),
+        NodeSpec('dispatch_tasks', dispatch_tasks,
+                 writes=('current_agent', 'messages')),
+        NodeSpec('monitor_progress', monitor_progress,
+                 writes=('current_agent', 'status')),
+        NodeSpec('generate_report', generate_report,
+                 reads=('task_id', 'duration', 'tech_tasks', 'market_tasks',
+                        'elon_output', 'henry_output', 'audit_logs'),
+                 writes=('progress_report', 'status', 'current_agent')),
+    ], reducers=STATE_REDUCERS)
 
 # Elon工作流
 def create_elon_workflow():
     """创建Elon工作流"""
 
-    def architect_design(state: AgentState):
+    async def architect_design(state: AgentState):
         """架构设计"""
         task_id = state.get('task_id', 'unknown')
-        llm = get_llm(AgentType.ARCHITECT)
 
         prompt = f"""作为Elon的Architect，请为以下任务设计技术方案：
 
@@ -227,11 +272,14 @@ def create_elon_workflow():
 **API定义：**
 [接口列表]"""
 
-        response = llm.invoke(prompt)
-        architecture = json.loads(response.content) if '```json' in response.content else {}
+        prompt += node_guidance(state, 'architect_design')
+
+        response = await invoke_llm(AgentType.ARCHITECT, prompt, node='architect_design', task_id=task_id)
+        report_output_quality(response.content)
+        architecture = extract_json_block(response.content)
 
         # 记录审计日志
-        audit_store.log_action(
+        await log_action(
             task_id=task_id,
             agent_type=AgentType.ARCHITECT,
             action='architect_design',
@@ -240,28 +288,33 @@ def create_elon_workflow():
         )
 
         return {
-            **state,
             'architecture': architecture,
             'elon_output': response.content,
             'progress': 30
         }
 
-    def coder_execute(state: AgentState):
+    async def coder_execute(state: AgentState):
         """代码执行"""
         task_id = state.get('task_id', 'unknown')
-        llm = get_llm(AgentType.CODER)
+        builder = PromptBuilder('coder_execute')
+        architecture = await builder.section(
+            'architecture', json.dumps(state.get('architecture', {}), ensure_ascii=False, indent=2), 'json'
+        )
 
         prompt = f"""作为Elon的Coder，请实现以下架构设计：
 
 任务：{state['task']}
-架构：{json.dumps(state.get('architecture', {}), ensure_ascii=False, indent=2)}
+架构：{architecture}
 
 请提供完整的代码实现"""
 
-        response = llm.invoke(prompt)
+        prompt += node_guidance(state, 'coder_execute')
+
+        response = await invoke_llm(AgentType.CODER, prompt, node='coder_execute', task_id=task_id)
+        report_output_quality(response.content, '```')
 
         # 记录审计日志
-        audit_store.log_action(
+        await log_action(
             task_id=task_id,
             agent_type=AgentType.CODER,
             action='coder_execute',
@@ -270,31 +323,34 @@ def create_elon_workflow():
         )
 
         return {
-            **state,
             'code': response.content,
             'elon_output': response.content,
             'progress': 60
         }
 
-    def qa_test(state: AgentState):
+    async def qa_test(state: AgentState):
         """测试"""
         task_id = state.get('task_id', 'unknown')
-        llm = get_llm(AgentType.QA)
+        builder = PromptBuilder('qa_test')
+        code = await builder.section('code', state.get('code', ''), 'truncate')
 
         prompt = f"""作为Elon的QA，请对以下代码进行测试：
 
 代码：
-{state.get('code', '')}
+{code}
 
 请提供：
 1. 单元测试代码
 2. 测试用例
 3. 预期结果"""
 
-        response = llm.invoke(prompt)
+        prompt += node_guidance(state, 'qa_test')
+
+        response = await invoke_llm(AgentType.QA, prompt, node='qa_test', task_id=task_id)
+        report_output_quality(response.content, '```')
 
         # 记录审计日志
-        audit_store.log_action(
+        await log_action(
             task_id=task_id,
             agent_type=AgentType.QA,
             action='qa_test',
@@ -303,30 +359,34 @@ def create_elon_workflow():
         )
 
         return {
-            **state,
             'tests': response.content,
             'progress': 80
         }
 
-    def reviewer_check(state: AgentState):
+    async def reviewer_check(state: AgentState):
         """代码审查"""
         task_id = state.get('task_id', 'unknown')
-        llm = get_llm(AgentType.REVIEWER)
+        builder = PromptBuilder('reviewer_check')
+        code = await builder.section('code', state.get('code', ''), 'truncate')
+        tests = await builder.section('tests', state.get('tests', ''), 'truncate')
 
         prompt = f"""作为Elon的Reviewer，请审查以下代码：
 
 代码：
-{state.get('code', '')}
+{code}
 
 测试：
-{state.get('tests', '')}
+{tests}
 
 请提供审查意见和改进建议"""
 
-        response = llm.invoke(prompt)
+        prompt += node_guidance(state, 'reviewer_check')
+
+        response = await invoke_llm(AgentType.REVIEWER, prompt, node='reviewer_check', task_id=task_id)
+        report_output_quality(response.content)
 
         # 记录审计日志
-        audit_store.log_action(
+        await log_action(
             task_id=task_id,
             agent_type=AgentType.REVIEWER,
             action='reviewer_check',
@@ -335,37 +395,32 @@ def create_elon_workflow():
         )
 
         return {
-            **state,
             'review': response.content,
             'progress': 100
         }
 
-    # 创建图
-    graph = StateGraph(AgentState)
-
-    # 添加节点
-    graph.add_node("architect_design", architect_design)
-    graph.add_node("coder_execute", coder_execute)
-    graph.add_node("qa_test", qa_test)
-    graph.add_node("reviewer_check", reviewer_check)
-
-    # 添加边
-    graph.set_entry_point("architect_design")
-    graph.add_edge("architect_design", "coder_execute")
-    graph.add_edge("coder_execute", "qa_test")
-    graph.add_edge("qa_test", "reviewer_check")
-    graph.add_edge("reviewer_check", END)
-
-    return graph.compile()
+    return DAGWorkflow('elon', [
+        NodeSpec('architect_design', architect_design,
+                 reads=('task', 'task_id'),
+                 writes=('architecture', 'elon_output', 'progress')),
+        NodeSpec('coder_execute', coder_execute,
+                 reads=('task', 'task_id', 'architecture'),
+                 writes=('code', 'elon_output', 'progress')),
+        NodeSpec('qa_test', qa_test,
+                 reads=('task_id', 'code'),
+                 writes=('tests', 'progress')),
+        NodeSpec('reviewer_check', reviewer_check,
+                 reads=('task_id', 'code', 'tests'),
+                 writes=('review', 'progress')),
+    ], reducers=STATE_REDUCERS)
 
 # Henry工作流
 def create_henry_workflow():
     """创建Henry工作流"""
 
-    def researcher_scan(state: AgentState):
+    async def researcher_scan(state: AgentState):
         """社区调研"""
         task_id = state.get('task_id', 'unknown')
-        llm = get_llm(AgentType.RESEARCHER)
 
         prompt = f"""作为Henry的Researcher，请调研以下信息：
 
@@ -377,10 +432,13 @@ def create_henry_workflow():
 3. 类似功能的实现方案
 4. 市场机会"""
 
-        response = llm.invoke(prompt)
+        prompt += node_guidance(state, 'researcher_scan')
+
+        response = await invoke_llm(AgentType.RESEARCHER, prompt, node='researcher_scan', task_id=task_id)
+        report_output_quality(response.content)
 
         # 记录审计日志
-        audit_store.log_action(
+        await log_action(
             task_id=task_id,
             agent_type=AgentType.RESEARCHER,
             action='researcher_scan',
@@ -389,21 +447,21 @@ def create_henry_workflow():
         )
 
         return {
-            **state,
             'research': response.content,
             'henry_output': response.content,
             'progress': 30
         }
 
-    def writer_create(state: AgentState):
+    async def writer_create(state: AgentState):
         """内容创作"""
         task_id = state.get('task_id', 'unknown')
-        llm = get_llm(AgentType.WRITER)
+        builder = PromptBuilder('writer_create', summarizer=make_summarizer(AgentType.WRITER))
+        research = await builder.section('research', state.get('research', ''), 'summarize')
 
         prompt = f"""作为Henry的Writer，请根据以下调研结果创建内容：
 
 调研结果：
-{state.get('research', '')}
+{research}
 
 任务：{state['task']}
 
@@ -426,10 +484,13 @@ def create_henry_workflow():
 **博客文章：**
 [内容]"""
 
-        response = llm.invoke(prompt)
+        prompt += node_guidance(state, 'writer_create')
+
+        response = await invoke_llm(AgentType.WRITER, prompt, node='writer_create', task_id=task_id)
+        report_output_quality(response.content, 'PR描述', 'Release Notes', '社区推文', '博客文章')
 
         # 记录审计日志
-        audit_store.log_action(
+        await log_action(
             task_id=task_id,
             agent_type=AgentType.WRITER,
             action='writer_create',
@@ -438,21 +499,21 @@ def create_henry_workflow():
         )
 
         return {
-            **state,
             'content': response.content,
             'henry_output': response.content,
             'progress': 60
         }
 
-    def networker_interact(state: AgentState):
+    async def networker_interact(state: AgentState):
         """社交互动"""
         task_id = state.get('task_id', 'unknown')
-        llm = get_llm(AgentType.NETWORKER)
+        builder = PromptBuilder('networker_interact', summarizer=make_summarizer(AgentType.NETWORKER))
+        content = await builder.section('content', state.get('content', ''), 'summarize')
 
         prompt = f"""作为Henry的Networker，请准备社交互动内容：
 
 任务：{state['task']}
-内容：{state.get('content', '')}
+内容：{content}
 
 请提供：
 1. 社区互动策略
@@ -460,10 +521,13 @@ def create_henry_workflow():
 3. @提及建议
 4. 注意事项"""
 
-        response = llm.invoke(prompt)
+        prompt += node_guidance(state, 'networker_interact')
+
+        response = await invoke_llm(AgentType.NETWORKER, prompt, node='networker_interact', task_id=task_id)
+        report_output_quality(response.content)
 
         # 记录审计日志
-        audit_store.log_action(
+        await log_action(
             task_id=task_id,
             agent_type=AgentType.NETWORKER,
             action='networker_interact',
@@ -472,28 +536,31 @@ def create_henry_workflow():
         )
 
         return {
-            **state,
             'networking': response.content,
             'progress': 100
         }
 
-    # 创建图
-    graph = StateGraph(AgentState)
-
-    # 添加节点
-    graph.add_node("researcher_scan", researcher_scan)
-    graph.add_node("writer_create", writer_create)
-    graph.add_node("networker_interact", networker_interact)
-
-    # 添加边
-    graph.set_entry_point("researcher_scan")
-    graph.add_edge("researcher_scan", "writer_create")
-    graph.add_edge("writer_create", "networker_interact")
-    graph.add_edge("networker_interact", END)
-
-    return graph.compile()
-
-# 编译所有工作流
-ECHO_WORKFLOW = create_echo_workflow()
-ELON_WORKFLOW = create_elon_workflow()
-HENRY_WORKFLOW = create_henry_workflow()
+    return DAGWorkflow('henry', [
+        NodeSpec('researcher_scan', researcher_scan,
+                 reads=('task', 'task_id'),
+                 writes=('research', 'henry_output', 'progress')),
+        NodeSpec('writer_create', writer_create,
+                 reads=('task', 'task_id', 'research'),
+                 writes=('content', 'henry_output', 'progress')),
+        NodeSpec('networker_interact', networker_interact,
+                 reads=('task', 'task_id', 'content'),
+                 writes=('networking', 'progress')),
+    ], reducers=STATE_REDUCERS)
+
+# 兼容旧的模块属性（ECHO_WORKFLOW 等），按需编译
+_LEGACY_WORKFLOWS = {
+    "ECHO_WORKFLOW": AgentType.ECHO,
+    "ELON_WORKFLOW": AgentType.ELON,
+    "HENRY_WORKFLOW": AgentType.HENRY,
+}
+
+def __getattr__(name: str):
+    if name in _LEGACY_WORKFLOWS:
+        from core.agents import get_agent_workflow
+        return get_agent_workflow(_LEGACY_WORKFLOWS[name])
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -3,34 +3,70 @@ Hive Mind 后端主服务 - v0.1.1
 FastAPI + LangGraph + 实际工作流实现
 """
 
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 import uvicorn
 import json
 import asyncio
+import functools
 from datetime import datetime
 import time
 import uuid
-from typing import Optional
+import os
+from typing import Optional, Tuple
 
 from core.agents import (
     AgentType,
     get_agent_config,
     get_agent_workflow,
+    has_agent_workflow,
     get_all_agent_types,
+    check_fork_request,
     AgentState
 )
 from core.system_prompts import CORE_SYSTEM_PROMPT
 from core.audit_store import audit_store
+from core.checkpoint_store import checkpoint_store
+from core.task_store import FINISHED_STATUSES, task_store
+from core.metrics import metrics
+from core.llm_router import llm_router
+from core.singleflight import SINGLEFLIGHT_ENABLED, singleflight
+from core.task_scheduler import PRIORITY_CLASSES, SchedulerFull, task_scheduler
+from core.broadcaster import GLOBAL_TOPIC, agent_topic, broadcaster, task_topic
+from core.task_feed import MAX_WAIT, SSE_HEARTBEAT, task_feed
+from core.snapshot_cache import SnapshotCache, etag_matches
+from core.serialization import dumps, dumps_text
+from core.compression import CompressionMiddleware, encoded_etag
+from core.static_assets import static_assets
+from core.shared_state import shared_state
+from core.job_queue import JobPending, QueueFull
+from core.job_workers import worker_pool
+from core.task_runner import run_agent_workflow
+from core.intent_classifier import INTENT_FAST_PATH, intent_classifier
+
+class FastJSONResponse(JSONResponse):
+    """orjson 序列化的 JSON 响应（未安装 orjson 时退回标准库）"""
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+def direct_json(endpoint):
+    """端点返回的 dict 直接序列化，跳过 FastAPI 对返回值的 jsonable_encoder 逐字段转换（任务输出、审计日志等大响应）"""
+    @functools.wraps(endpoint)
+    async def wrapper(*args, **kwargs):
+        result = await endpoint(*args, **kwargs)
+        return result if isinstance(result, Response) else FastJSONResponse(result)
+    return wrapper
 
 # 创建FastAPI应用
 app = FastAPI(
     title="Hive Mind API",
     description="Multi-Agent Collaboration Platform - Powered by AI",
-    version="0.1.1"
+    version="0.1.1",
+    default_response_class=FastJSONResponse
 )
 
 # CORS配置
@@ -42,11 +78,20 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 响应压缩（超过阈值的文本响应；SSE 事件流不压缩）
+app.add_middleware(CompressionMiddleware)
+
 # 数据模型
 class UserMessage(BaseModel):
     message: str
     agent_type: Optional[str] = AgentType.ECHO
     context: Optional[dict] = {}
+    coalesce: Optional[bool] = True  # 是否与执行中的相同请求合并
+    priority: Optional[str] = "normal"  # interactive, normal, batch
+
+class ForkRequest(BaseModel):
+    overrides: Optional[dict] = {}
+    node_inputs: Optional[dict] = {}
 
 class AgentStatus(BaseModel):
     agent_type: str
@@ -55,27 +100,23 @@ class AgentStatus(BaseModel):
     progress: float = 0.0
     capabilities: Optional[list] = []
 
-# WebSocket连接管理
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: dict[str, WebSocket] = {}
-
-    async def connect(self, websocket: WebSocket, client_id: str):
-        await websocket.accept()
-        self.active_connections[client_id] = websocket
-
-    def disconnect(self, client_id: str):
-        if client_id in self.active_connections:
-            del self.active_connections[client_id]
-
-    async def send_message(self, client_id: str, message: dict):
-        if client_id in self.active_connections:
-            await self.active_connections[client_id].send_json(message)
 
-manager = ConnectionManager()
+# 任务存储（内存热层 + SQLite，已结束的任务按 LRU/TTL 落盘）
+tasks_db = task_store
 
-# 任务存储（内存中）
-tasks_db = {}
+# Agent静态信息（配置在进程生命周期内不变，只计算一次）
+AGENT_CATALOG = [
+    {
+        "type": agent_type,
+        "config": get_agent_config(agent_type),
+        "workflow": has_agent_workflow(agent_type)
+    }
+    for agent_type in get_all_agent_types()
+]
+AGENT_READINESS = {
+    agent["type"]: {"status": "ready", "workflow": agent["workflow"]}
+    for agent in AGENT_CATALOG
+}
 
 # 健康检查
 @app.get("/health")
@@ -84,13 +125,7 @@ async def health_check():
         "status": "healthy",
         "version": "0.1.1",
         "timestamp": datetime.now().isoformat(),
-        "agents": {
-            agent_type: {
-                "status": "ready",
-                "workflow": get_agent_workflow(agent_type) is not None
-            }
-            for agent_type in get_all_agent_types()
-        }
+        "agents": AGENT_READINESS
     }
 
 # 获取所有Agent列表
@@ -98,30 +133,22 @@ async def health_check():
 async def list_agents():
     return {
         "success": True,
-        "agents": [
-            {
-                "type": agent_type,
-                "config": get_agent_config(agent_type),
-                "workflow": get_agent_workflow(agent_type) is not None
-            }
-            for agent_type in get_all_agent_types()
-        ]
+        "agents": AGENT_CATALOG
     }
 
 # 获取单个Agent状态
 @app.get("/api/agents/{agent_type}/status")
 async def get_agent_status(agent_type: str):
     config = get_agent_config(agent_type)
-    workflow = get_agent_workflow(agent_type)
 
     return {
-        "success": true,
+        "success": True,
         "agent": {
             "type": agent_type,
-            "name": config.name,
-            "role": config.role,
-            "capabilities": config.capabilities,
-            "workflow": workflow is not None
+            "name": config["name"],
+            "role": config["role"],
+            "capabilities": config["capabilities"],
+            "workflow": has_agent_workflow(agent_type)
         },
         "status": "idle",
         "message": f"{agent_type} is ready to work"
@@ -144,177 +171,575 @@ async def start_workflow(agent_type: str, message: UserMessage):
             "error": f"Unknown agent type: {agent_type}"
         }
 
+    if message.priority not in PRIORITY_CLASSES:
+        return {
+            "success": False,
+            "error": f"Unknown priority: {message.priority}"
+        }
+
     # 创建任务ID
     task_id = f"task_{uuid.uuid4().hex[:12]}"
 
+    # 相同请求正在执行时挂到该任务上，共享结果
+    coalesce = SINGLEFLIGHT_ENABLED and message.coalesce
+    key = singleflight.key(agent_type, message.message, message.context or {})
+    leader_id = singleflight.attach(key, task_id) if coalesce else None
+    if leader_id:
+        task = create_task_record(task_id, agent_type, message.message)
+        task["coalesced_with"] = leader_id
+        return {
+            "success": True,
+            "task_id": task_id,
+            "agent_type": agent_type,
+            "message": message.message,
+            "coalesced_with": leader_id,
+            "status": "started"
+        }
+
+    # 队列已满时拒绝，避免过载时无限堆积
+    if await is_busy():
+        return {
+            "success": False,
+            "error": "Server busy, task queue is full",
+            "status": "rejected"
+        }
+
     # 创建任务状态
-    tasks_db[task_id] = {
-        "id": task_id,
+    task = create_task_record(task_id, agent_type, message.message)
+    task["priority"] = message.priority
+
+    # 交给调度器按并发上限与优先级执行（或写入任务队列由 worker 进程执行）
+    try:
+        position = await dispatch_workflow(task, message.message, priority=message.priority,
+                                           coalesce_key=key if coalesce else None)
+    except (SchedulerFull, QueueFull):
+        # 检查之后队列被其他请求占满（任务队列在线程中查询，期间可能有其他提交）
+        await discard_task_record(task_id)
+        return {
+            "success": False,
+            "error": "Server busy, task queue is full",
+            "status": "rejected"
+        }
+
+    return {
+        "success": True,
+        "task_id": task_id,
         "agent_type": agent_type,
         "message": message.message,
+        "status": "queued" if position else "started",
+        "queue_position": position or None
+    }
+
+def share_task_result(leader_id: str, alias_ids: list):
+    """把合并执行的结果同步到各别名任务"""
+    leader = tasks_db.get(leader_id)
+    for alias_id in alias_ids:
+        alias = tasks_db.get(alias_id)
+        if alias and not leader:
+            # 执行中的任务已被删除，别名任务没有结果可共享
+            alias.update({
+                "status": "failed",
+                "end_time": datetime.now().isoformat(),
+                "logs": alias["logs"] + [{
+                    "time": datetime.now().isoformat(),
+                    "message": f"Coalesced task {leader_id} was deleted",
+                    "status": "error"
+                }]
+            })
+            publish_task_complete(alias_id)
+        elif alias:
+            # 新版本号大于等待期间返回给客户端的视图版本（别名版本 + leader 版本）
+            version = alias.get("version", 0) + leader.get("version", 0) + 1
+            alias.update({
+                "status": leader["status"],
+                "progress": leader["progress"],
+                "end_time": leader.get("end_time"),
+                "logs": leader["logs"],
+                "outputs": leader.get("outputs", {})
+            })
+            publish_task_complete(alias_id, version)
+
+def publish_task_complete(task_id: str, version: int = 0):
+    """向订阅者广播任务结束"""
+    task = tasks_db.get(task_id)
+    if not task:
+        return
+    task_feed.touch(task, version=version)
+    broadcaster.publish(
+        (task_topic(task_id), agent_topic(task["agent_type"]), GLOBAL_TOPIC),
+        {
+            "type": "task_complete",
+            "task_id": task_id,
+            "agent_type": task["agent_type"],
+            "version": task["version"],
+            "status": task["status"],
+            "logs": task["logs"],
+            "outputs": task.get("outputs", {})
+        }
+    )
+
+def create_task_record(task_id: str, agent_type: str, message: str, start_time: Optional[str] = None) -> dict:
+    """创建任务状态记录"""
+    task = {
+        "id": task_id,
+        "agent_type": agent_type,
+        "message": message,
         "status": "pending",
         "progress": 0.0,
-        "start_time": datetime.now().isoformat(),
+        "start_time": start_time or datetime.now().isoformat(),
         "logs": [],
         "outputs": {}
     }
+    tasks_db[task_id] = task
+    task_feed.touch(task)
+    return task
+
+async def discard_task_record(task_id: str):
+    """撤销未能提交执行的任务记录"""
+    try:
+        await tasks_db.adelete(task_id)
+    except KeyError:
+        pass
+    task_feed.forget(task_id)
+
+async def execute_agent_workflow(task_id: str, message: str, resume: bool = False):
+    """在本进程内执行Agent工作流
+
+    resume=True 时从检查点恢复：复用原始初始状态，跳过已完成的节点
+    """
+    try:
+        await run_agent_workflow(tasks_db[task_id], message, resume)
+    finally:
+        # 无论完成、失败还是被拒绝，都通知订阅了该任务、该Agent或全局的客户端（只入队，不等待发送）
+        publish_task_complete(task_id)
+
+async def dispatch_workflow(task: dict, message: str, resume: bool = False, priority: str = "normal",
+                            coalesce_key: Optional[str] = None) -> int:
+    """交给 worker 进程池（配置 JOB_WORKERS 时）或本进程的调度器执行，返回排队位置（0 表示已开始执行）"""
+    task_id, agent_type = task["id"], task["agent_type"]
+    if worker_pool.enabled:
+        position = await worker_pool.submit(task, message, resume=resume, priority=priority)
+        if coalesce_key is not None:
+            # worker 执行结束后把结果同步给合并到该任务的请求
+            worker_pool.background(singleflight.track(coalesce_key, task_id, worker_pool.wait(task_id),
+                                                      on_done=share_task_result, label=agent_type))
+        return position
+
+    coro = execute_agent_workflow(task_id, message, resume)
+    if coalesce_key is not None:
+        coro = singleflight.track(coalesce_key, task_id, coro, on_done=share_task_result, label=agent_type)
+    try:
+        return task_scheduler.submit(task_id, agent_type, coro, priority=priority)
+    except SchedulerFull:
+        if coalesce_key is not None:
+            singleflight.forget(coalesce_key)
+        raise
+
+async def is_busy() -> bool:
+    """排队任务已达上限（任务队列在线程中查询，不阻塞事件循环）"""
+    if worker_pool.enabled:
+        return await asyncio.to_thread(worker_pool.queue.is_full)
+    return task_scheduler.is_full()
+
+async def queue_positions(task_ids: list) -> dict:
+    """一次取回多个任务的排队位置（不在队列中的任务不出现在结果中）"""
+    if worker_pool.enabled:
+        return await asyncio.to_thread(worker_pool.queue.positions, task_ids)
+    return {task_id: task_scheduler.position(task_id) for task_id in task_ids}
+
+async def queue_position(task_id: str) -> Optional[int]:
+    return (await queue_positions([task_id])).get(task_id)
+
+# 从检查点恢复任务
+@app.post("/api/tasks/{task_id}/resume")
+async def resume_task(task_id: str):
+    """从最后完成的节点继续执行中断或失败的任务"""
+    run = await asyncio.to_thread(checkpoint_store.get_run, task_id)
+    if not run:
+        return {"success": False, "error": "No checkpoint found for task"}
+
+    if run["status"] == "completed":
+        return {"success": False, "error": "Task already completed"}
+
+    task = await tasks_db.aget(task_id)
+    if task and task["status"] in ("pending", "running"):
+        return {"success": False, "error": "Task is still running"}
+
+    if await is_busy():
+        return {"success": False, "error": "Server busy, task queue is full"}
+
+    # 与启动时的恢复相同：认领成功才执行（其他进程执行中或正在恢复时租约未过期）
+    if not await asyncio.to_thread(checkpoint_store.claim_run, task_id):
+        return {"success": False, "error": "Task is still running"}
 
-    # 异步执行工作流
-    asyncio.create_task(execute_agent_workflow(task_id, agent_type, message))
+    try:
+        await schedule_resume(run)
+    except JobPending:
+        await asyncio.to_thread(checkpoint_store.release_run, task_id)
+        return {"success": False, "error": "Task is still running"}
+    except (SchedulerFull, QueueFull):
+        await asyncio.to_thread(checkpoint_store.release_run, task_id)
+        return {"success": False, "error": "Server busy, task queue is full"}
 
     return {
-        "success": true,
+        "success": True,
         "task_id": task_id,
-        "agent_type": agent_type,
-        "message": message.message,
-        "status": "started"
+        "completed_nodes": list(await asyncio.to_thread(checkpoint_store.load_nodes, task_id)),
+        "status": "resumed"
     }
 
-async def execute_agent_workflow(task_id: str, agent_type: str, message: UserMessage):
-    """执行Agent工作流"""
-    task = tasks_db[task_id]
-    workflow = get_agent_workflow(agent_type)
-
-    if not workflow:
-        task["status"] = "failed"
-        task["logs"].append({
-            "time": datetime.now().isoformat(),
-            "message": f"Workflow for {agent_type} not found",
-            "status": "error"
-        })
+def iso_time(value: Optional[str]) -> Optional[str]:
+    """统一为 isoformat（检查点中的初始状态按 str(datetime) 序列化，以空格分隔，与新任务的排序与分页游标不一致）"""
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value).isoformat()
+    except ValueError:
+        return None
+
+async def schedule_resume(run: dict, priority: str = "normal"):
+    """为检查点中的任务重建状态记录并交给调度器恢复执行"""
+    task_id = run["task_id"]
+    task = await tasks_db.aget(task_id)
+    if task is None:
+        task = create_task_record(task_id, run["agent_type"], run["message"],
+                                  start_time=iso_time(run["initial_state"].get("start_time")))
+
+    await dispatch_workflow(task, run["message"], resume=True, priority=priority)
+
+@app.on_event("startup")
+async def init_databases():
+    """启动时初始化数据库表（不在模块导入时执行）"""
+    audit_store.init_db()
+    checkpoint_store.init_db()
+    task_store.init_db()
+    # 预加载意图分类模型，避免首个请求在加载时阻塞
+    if INTENT_FAST_PATH:
+        await asyncio.to_thread(intent_classifier.load_model)
+    if not static_assets.load():
+        print(f"No frontend assets found in {static_assets.root}, set FRONTEND_DIST_DIR to serve the built frontend")
+    # 多 worker / 多副本时共享任务记录与广播事件（配置 SHARED_STATE_URL 后启用）
+    shared_state.start()
+    # 工作流交给独立的 worker 进程执行（配置 JOB_WORKERS 后启用）
+    worker_pool.on_done = publish_task_complete
+    worker_pool.start()
+
+@app.on_event("shutdown")
+async def flush_task_store():
+    """退出前停止 worker 进程，把已结束的任务落盘，并写出尚未同步到共享状态的变化"""
+    if run_lease_task:
+        run_lease_task.cancel()
+    await worker_pool.stop()
+    await shared_state.stop()
+    task_store.flush()
+    # 本进程未执行完的工作流交给重启后的进程（或其他 worker）立即恢复
+    checkpoint_store.release_runs()
+
+RESUME_INTERRUPTED_TASKS = os.getenv("RESUME_INTERRUPTED_TASKS", "true").lower() == "true"
+
+run_lease_task: Optional[asyncio.Task] = None
+
+@app.on_event("startup")
+async def resume_interrupted_tasks():
+    """启动时恢复中断的任务，之后定期为本进程执行中的工作流续租并接手租约过期的工作流"""
+    global run_lease_task
+    await recover_runs()
+    run_lease_task = asyncio.create_task(maintain_run_leases())
+
+async def recover_runs():
+    """恢复租约已过期的工作流；多个 worker 同时恢复时，每个工作流只由认领成功的进程恢复"""
+    if not RESUME_INTERRUPTED_TASKS:
         return
 
+    for run in await asyncio.to_thread(checkpoint_store.list_interrupted_runs):
+        task_id = run["task_id"]
+        # 仍在任务队列中的任务由 worker 领取后从检查点继续
+        if worker_pool.enabled and await asyncio.to_thread(worker_pool.queue.is_pending, task_id):
+            continue
+        if not await asyncio.to_thread(checkpoint_store.claim_run, task_id):
+            continue
+        print(f"Resuming interrupted task {task_id} ({run['agent_type']})")
+        try:
+            await schedule_resume(run, priority="batch")
+        except JobPending:
+            await asyncio.to_thread(checkpoint_store.release_run, task_id)
+        except (SchedulerFull, QueueFull):
+            await asyncio.to_thread(checkpoint_store.release_run, task_id)
+            print(f"Task queue is full, task {task_id} can be resumed later")
+            break
+
+# 清理过期检查点的间隔（秒）
+CHECKPOINT_PRUNE_INTERVAL = 3600
+
+async def maintain_run_leases():
+    """每 1/3 租约时长续租，并恢复其他进程中断后遗留的工作流；每小时清理结束超过保留时长的检查点"""
+    pruned_at = float("-inf")
+    while True:
+        await asyncio.sleep(checkpoint_store.lease / 3)
+        try:
+            await asyncio.to_thread(checkpoint_store.renew_runs)
+            await recover_runs()
+            if time.monotonic() - pruned_at >= CHECKPOINT_PRUNE_INTERVAL:
+                pruned_at = time.monotonic()
+                await asyncio.to_thread(checkpoint_store.prune_runs)
+        except Exception as e:
+            print(f"Workflow lease maintenance failed: {e}")
+
+# 派生任务并只重算受影响的节点
+@app.post("/api/tasks/{task_id}/fork")
+async def fork_task(task_id: str, request: ForkRequest):
+    """
+    基于已有任务派生新任务
+
+    - overrides: 覆盖的状态字段，例如 {"task": "..."}
+    - node_inputs: 按节点名追加的输入要求，例如 {"writer_create": "语气更轻松"}
+
+    未受影响的上游节点直接复用原任务的检查点，只重算读取了被覆盖字段的节点及其下游
+    """
+    run = await asyncio.to_thread(checkpoint_store.get_run, task_id)
+    if not run:
+        return {"success": False, "error": "No checkpoint found for task"}
+
+    # 原任务仍在执行时检查点还不完整
+    parent = await tasks_db.aget(task_id)
+    if run["status"] == "running" or (parent and parent["status"] in ("pending", "running")):
+        return {"success": False, "error": "Task is still running"}
+
+    if await is_busy():
+        return {"success": False, "error": "Server busy, task queue is full"}
+
+    overrides = request.overrides or {}
+    node_inputs = request.node_inputs or {}
+    invalid = [key for key in overrides if key not in AgentState.__annotations__ or key == "task_id"]
+    if invalid:
+        return {"success": False, "error": f"Unknown state fields: {invalid}"}
+
+    workflow = get_agent_workflow(run["agent_type"])
+    unknown_nodes = [node for node in node_inputs if node not in workflow.dag.nodes]
+    if unknown_nodes:
+        return {"success": False, "error": f"Unknown workflow nodes: {unknown_nodes}"}
+
+    # 派生任务按恢复方式执行（不再经过执行前的安全检查），覆盖的任务与节点输入在这里检查
+    fork_id = f"task_{uuid.uuid4().hex[:12]}"
+    error = check_fork_request(fork_id, run["agent_type"], overrides.get("task", run["message"]), overrides, node_inputs)
+    if error:
+        return {"success": False, "error": error, "status": "rejected"}
+
+    affected = workflow.dag.affected_nodes(overrides, node_inputs)
+    reused = [node for node in workflow.dag.order if node not in affected]
+
+    # 创建派生任务
+    initial_state = {
+        **run["initial_state"],
+        **overrides,
+        "task_id": fork_id,
+        "start_time": datetime.now(),
+        "node_inputs": {**run["initial_state"].get("node_inputs", {}), **node_inputs}
+    }
+    message = initial_state.get("task", run["message"])
+    await asyncio.to_thread(checkpoint_store.start_run, fork_id, run["agent_type"], message, initial_state)
+    await asyncio.to_thread(checkpoint_store.copy_nodes, task_id, fork_id, reused, strip_keys=list(overrides))
+
+    task = create_task_record(fork_id, run["agent_type"], message)
+    task["parent_task_id"] = task_id
+    task["reused_nodes"] = reused
+
     try:
-        # 安全检查1: 目标对齐
-        from core.agents import goal_alignment_check
-        if not goal_alignment_check({
-            "task": message.message,
-            "progress": 0.0
-        }):
-            task["status"] = "rejected"
-            task["logs"].append({
-                "time": datetime.now().isoformat(),
-                "message": "目标对齐检查失败，任务被拒绝",
-                "status": "error"
-            })
-            return
-
-        # 安全检查2: 频率限制
-        from core.agents import rate_limit_check
-        if not rate_limit_check(agent_type):
-            task["status"] = "rate_limited"
-            task["logs"].append({
-                "time": datetime.now().isoformat(),
-                "message": "操作频率过高，任务被限制",
-                "status": "warning"
-            })
-            return
-
-        # 初始化状态
-        initial_state = {
-            "messages": [f"Task: {message.message}"],
-            "current_agent": agent_type,
-            "task": message.message,
-            "status": "running",
-            "progress": 0.0,
-            "start_time": datetime.now(),
-            "task_id": task_id,
-            "audit_logs": []
-        }
+        await dispatch_workflow(task, message, resume=True)
+    except (SchedulerFull, QueueFull):
+        await discard_task_record(fork_id)
+        await asyncio.to_thread(checkpoint_store.delete_run, fork_id)
+        return {"success": False, "error": "Server busy, task queue is full"}
 
-        # 执行工作流
-        result = await workflow.ainvoke(initial_state)
-
-        # 更新任务状态
-        task["status"] = "completed"
-        task["progress"] = 100.0
-        task["end_time"] = datetime.now().isoformat()
-
-        # 提取输出
-        if agent_type in result:
-            task["outputs"] = result[agent_type]
-
-        task["logs"].append({
-            "time": datetime.now().isoformat(),
-            "message": f"{agent_type} workflow completed successfully",
-            "status": "success",
-            "duration": (datetime.now() - task["start_time"]).total_seconds()
-        })
-
-    except Exception as e:
-        task["status"] = "failed"
-        task["logs"].append({
-            "time": datetime.now().isoformat(),
-            "message": f"Error executing workflow: {str(e)}",
-            "status": "error"
-        })
-        print(f"Error executing workflow: {e}")
-
-    # 通知客户端（如果有）
-    await manager.send_message("main", {
-        "type": "task_complete",
-        "task_id": task_id,
-        "agent_type": agent_type,
-        "status": task["status"],
-        "logs": task["logs"],
-        "outputs": task.get("outputs", {})
-    })
+    return {
+        "success": True,
+        "task_id": fork_id,
+        "parent_task_id": task_id,
+        "reused_nodes": reused,
+        "recomputed_nodes": [node for node in workflow.dag.order if node in affected],
+        "status": "started"
+    }
 
 # 获取任务状态
 @app.get("/api/tasks/{task_id}")
-async def get_task_status(task_id: str):
-    if task_id not in tasks_db:
+@direct_json
+async def get_task_status(
+    task_id: str,
+    since_version: Optional[int] = Query(None, ge=0, description="只返回该版本之后变化的字段与新增日志"),
+    wait: float = Query(0, ge=0, le=MAX_WAIT, description="长轮询：无变化时最多等待的秒数")
+):
+    task = await tasks_db.aget(task_id)
+    if task is None:
         return {
             "success": False,
             "error": "Task not found"
         }
 
-    task = tasks_db[task_id]
+    if since_version is not None:
+        # 长轮询：任务未结束且没有新版本时等待变化（合并执行中的别名任务等待执行中任务的变化）
+        view, key, watch_id = await coalesced_view(task)
+        if view["status"] not in FINISHED_STATUSES:
+            await task_feed.wait(watch_id, since_version, view.get("version", 0), wait)
+            # 其他进程执行的任务是只读副本，等待后重新读取
+            task = await tasks_db.aget(task_id, task)
+            view, key, _ = await coalesced_view(task)
+        return {
+            "success": True,
+            "task_id": task_id,
+            **task_feed.delta(view, since_version, key),
+            "queue_position": await queue_position(task.get("coalesced_with") or task_id)
+        }
+
+    # 合并执行中的别名任务显示执行中任务的进度
+    live = task
+    if task.get("coalesced_with") and task["status"] == "pending":
+        live = await tasks_db.aget(task["coalesced_with"], task)
 
     return {
-        "success": true,
+        "success": True,
         "task": {
             "id": task_id,
+            "version": task.get("version", 0),
             "agent_type": task["agent_type"],
             "message": task["message"],
-            "status": task["status"],
-            "progress": task["progress"],
+            "status": live["status"],
+            "progress": live["progress"],
+            "current_node": live.get("current_node"),
+            "nodes": live.get("nodes", {}),
             "start_time": task["start_time"],
             "end_time": task.get("end_time"),
             "logs": task["logs"],
-            "outputs": task.get("outputs", {})
+            "outputs": task.get("outputs", {}),
+            "coalesced_with": task.get("coalesced_with"),
+            "queue_position": await queue_position(task.get("coalesced_with") or task_id)
         }
     }
 
+async def coalesced_view(task: dict) -> Tuple[dict, Optional[str], str]:
+    """合并执行中的别名任务以执行中任务的进度组成视图，返回 (视图, 版本历史键, 需要等待变化的任务ID)"""
+    leader_id = task.get("coalesced_with")
+    if leader_id and task["status"] not in FINISHED_STATUSES:
+        leader = await tasks_db.aget(leader_id)
+        if leader is not None:
+            view, key = task_feed.view(task, leader)
+            return view, key, leader_id
+    return task, None, task["id"]
+
+# 任务状态事件流（SSE）
+@app.get("/api/tasks/{task_id}/events")
+async def stream_task_events(task_id: str, request: Request, since_version: int = Query(0, ge=0)):
+    """每次任务变化推送一条增量（id 为版本号，断线重连时按 Last-Event-ID 续传），任务结束后关闭"""
+    if await tasks_db.aget(task_id) is None:
+        return {"success": False, "error": "Task not found"}
+
+    last_event_id = request.headers.get("last-event-id")
+    if last_event_id and last_event_id.isdigit():
+        since_version = int(last_event_id)
+
+    async def events():
+        version = since_version
+        while True:
+            task = await tasks_db.aget(task_id)
+            if task is None:
+                break
+            # 与长轮询一致：合并执行中的别名任务推送执行中任务的变化
+            view, key, watch_id = await coalesced_view(task)
+            if view.get("version", 0) != version:
+                delta = task_feed.delta(view, version, key)
+                version = delta["version"]
+                yield f"id: {version}\nevent: delta\ndata: {dumps_text(delta)}\n\n"
+            if view["status"] in FINISHED_STATUSES:
+                yield "event: end\ndata: {}\n\n"
+                break
+            if await request.is_disconnected():
+                break
+            if not await task_feed.wait(watch_id, version, view.get("version", 0), SSE_HEARTBEAT):
+                yield ": keepalive\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 # 删除任务
 @app.delete("/api/tasks/{task_id}")
 async def delete_task(task_id: str):
-    if task_id in tasks_db:
-        del tasks_db[task_id]
-        return {"success": True, "message": "Task deleted"}
+    try:
+        await tasks_db.adelete(task_id)
+    except KeyError:
+        return {"success": False, "error": "Task not found"}
 
-    return {"success": False, "error": "Task not found"}
+    task_feed.forget(task_id)
+    return {"success": True, "message": "Task deleted"}
 
-# 获取所有任务列表
+# 任务列表默认返回的字段（不含 logs、outputs 等大字段）
+TASK_LIST_FIELDS = ["id", "agent_type", "message", "status", "progress", "current_node", "start_time", "end_time",
+                    "queue_position"]
+TASK_FIELDS = set(TASK_LIST_FIELDS) | {"logs", "outputs", "nodes", "priority", "coalesced_with", "parent_task_id", "reused_nodes"}
+
+# 获取任务列表
 @app.get("/api/tasks")
-async def list_tasks():
+@direct_json
+async def list_tasks(
+    status: Optional[str] = None,
+    agent_type: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
+    order: str = Query("desc"),
+    fields: Optional[str] = None
+):
+    """
+    分页获取任务列表（按开始时间排序）
+
+    - status: 状态过滤，多个用逗号分隔
+    - agent_type: Agent类型过滤
+    - since / until: 开始时间范围（ISO格式）
+    - cursor: 上一页返回的 next_cursor
+    - order: desc（最新在前）或 asc
+    - fields: 返回的字段，逗号分隔，默认不含 logs / outputs
+    """
+    selected = fields.split(",") if fields else TASK_LIST_FIELDS
+    unknown = [field for field in selected if field not in TASK_FIELDS]
+    if unknown:
+        return {"success": False, "error": f"Unknown fields: {unknown}"}
+    if order not in ("asc", "desc"):
+        return {"success": False, "error": "order must be asc or desc"}
+
+    try:
+        tasks, next_cursor = await tasks_db.aquery(
+            status=status.split(",") if status else None,
+            agent_type=agent_type,
+            since=since,
+            until=until,
+            cursor=cursor,
+            limit=limit,
+            descending=order == "desc"
+        )
+    except ValueError:
+        return {"success": False, "error": "Invalid cursor"}
+
+    # 只有等待中的任务在排队，整页一次查询
+    positions = {}
+    if "queue_position" in selected:
+        positions = await queue_positions([task["id"] for task in tasks if task.get("status") == "pending"])
+
+    def project(task: dict) -> dict:
+        row = {field: task.get(field) for field in selected if field != "queue_position"}
+        if "queue_position" in selected:
+            row["queue_position"] = positions.get(task["id"])
+        return row
+
     return {
         "success": True,
-        "tasks": [
-            {
-                "id": t["id"],
-                "agent_type": t["agent_type"],
-                "message": t["message"],
-                "status": t["status"],
-                "progress": t["progress"]
-            }
-            for t in tasks_db.values()
-        ]
+        "tasks": [project(task) for task in tasks],
+        "next_cursor": next_cursor,
+        "count": len(tasks)
     }
 
 # ===== 审计日志 API =====
 
 @app.get("/api/audit/logs")
+@direct_json
 async def get_audit_logs(
     task_id: Optional[str] = None,
     agent_type: Optional[str] = None,
@@ -351,6 +776,7 @@ async def get_audit_logs(
         }
 
 @app.get("/api/safety/events")
+@direct_json
 async def get_safety_events(
     limit: int = Query(50, ge=1, le=500),
     resolved: Optional[bool] = None
@@ -367,21 +793,24 @@ async def get_safety_events(
         "total": len(events)
     }
 
-@app.get("/api/safety/stats")
-async def get_safety_stats():
-    """获取安全统计信息"""
-    # 获取频率限制统计
-    stats = {
+def safety_stats() -> dict:
+    """频率限制统计"""
+    return {
         "henry_networker": audit_store.get_rate_limit_stats(AgentType.NETWORKER, "hourly_mentions"),
         "elon_test_failures": audit_store.get_rate_limit_stats(AgentType.CODER, "test_failures")
     }
 
+@app.get("/api/safety/stats")
+@direct_json
+async def get_safety_stats():
+    """获取安全统计信息"""
     return {
         "success": True,
-        "stats": stats
+        "stats": safety_stats()
     }
 
 @app.get("/api/audit/logs/{task_id}")
+@direct_json
 async def get_task_audit_logs(task_id: str, limit: int = Query(100, ge=1, le=1000)):
     """获取特定任务的审计日志（旧端点，保留兼容性）"""
     logs = audit_store.get_task_logs(task_id, limit)
@@ -393,42 +822,157 @@ async def get_task_audit_logs(task_id: str, limit: int = Query(100, ge=1, le=100
         "total": len(logs)
     }
 
+# ===== 仪表盘快照 =====
+
+def running_by_agent() -> dict:
+    """各Agent执行中的工作流数（worker 模式下取队列统计的缓存值，本进程调度器不执行工作流）"""
+    if worker_pool.enabled:
+        return worker_pool.stats().get("running_by_agent", {})
+    return {agent_type: count for agent_type, count in task_scheduler.running.items() if count}
+
+def queued_count() -> int:
+    if worker_pool.enabled:
+        return worker_pool.stats().get("queued", 0)
+    return task_scheduler.stats()["queued"]
+
+async def build_dashboard_snapshot() -> dict:
+    """仪表盘首屏所需的全部数据：Agent、任务概况与安全统计（数据库查询在线程中进行）"""
+    recent, _ = await tasks_db.aquery(limit=20)
+    counts = await tasks_db.acount_by_status()
+    stats, events = await asyncio.to_thread(lambda: (safety_stats(), audit_store.get_all_safety_events(10)))
+    running = running_by_agent()
+    return {
+        "success": True,
+        "agents": [
+            {
+                **agent,
+                "status": "running" if running.get(agent["type"]) else "idle",
+                "running": running.get(agent["type"], 0)
+            }
+            for agent in AGENT_CATALOG
+        ],
+        "tasks": {
+            "counts": counts,
+            "recent": [{field: task.get(field) for field in TASK_LIST_FIELDS if field != "queue_position"}
+                       for task in recent]
+        },
+        "safety": {
+            "stats": stats,
+            "recent_events": events
+        },
+        "scheduler": task_scheduler.stats(),
+        "workers": worker_pool.stats() if worker_pool.enabled else None
+    }
+
+# 任务状态、安全事件或调度状态变化时重新生成，否则最多缓存 DASHBOARD_CACHE_TTL 秒
+# （节点进度等不改变状态的变化不触发重新生成；频率限制按小时窗口统计）
+dashboard_snapshot = SnapshotCache(
+    "dashboard",
+    build_dashboard_snapshot,
+    version=lambda: (task_feed.status_revision, audit_store.revision, tuple(sorted(running_by_agent().items())),
+                     queued_count()),
+    ttl=float(os.getenv("DASHBOARD_CACHE_TTL", "30"))
+)
+
+@app.get("/api/dashboard")
+async def get_dashboard(request: Request):
+    """仪表盘快照（一次请求取回首屏数据），支持 ETag / If-None-Match"""
+    body, etag = await dashboard_snapshot.aget()
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+@app.get("/api/metrics")
+async def get_metrics(format: str = Query("json")):
+    """运行指标（模型路由、LLM调用等），format=prometheus 时输出 Prometheus 文本格式"""
+    if format == "prometheus":
+        return PlainTextResponse(metrics.render_prometheus())
+
+    return {
+        "success": True,
+        "metrics": metrics.snapshot(),
+        "routes": llm_router.status(),
+        "scheduler": task_scheduler.stats(),
+        "workers": worker_pool.stats() if worker_pool.enabled else None,
+        "shared_state": shared_state.status()
+    }
+
 # WebSocket端点
+def resolve_topic(data: dict) -> Optional[str]:
+    """订阅消息对应的主题：task_id / agent_type / global"""
+    if data.get("task_id"):
+        return task_topic(data["task_id"])
+    if data.get("agent_type"):
+        return agent_topic(data["agent_type"])
+    if data.get("topic") == GLOBAL_TOPIC:
+        return GLOBAL_TOPIC
+    return None
+
 @app.websocket("/ws/{client_id}")
 async def websocket_endpoint(websocket: WebSocket, client_id: str):
-    await manager.connect(websocket, client_id)
+    await websocket.accept()
+    # 默认订阅全局主题（任务结束通知）；发送由客户端自己的写协程完成
+    client = broadcaster.connect(client_id, websocket.send_text, websocket.close)
     try:
         while True:
             data = await websocket.receive_json()
             # 处理客户端消息
-            if data.get("type") == "subscribe" and data.get("task_id"):
-                task_id = data["task_id"]
-                if task_id in tasks_db:
-                    task = tasks_db[task_id]
-                    await manager.send_message(
-                        client_id,
-                        {
-                            "type": "task_update",
-                            "task_id": task_id,
-                            "status": task["status"],
-                            "progress": task["progress"],
-                            "logs": task["logs"]
-                        }
-                    )
+            topic = resolve_topic(data)
+            if topic is None:
+                continue
+            if data.get("type") == "subscribe":
+                broadcaster.subscribe(client, topic)
+                task_id = data.get("task_id")
+                task = await tasks_db.aget(task_id) if task_id else None
+                if task is not None:
+                    client.enqueue({
+                        "type": "task_update",
+                        "task_id": task_id,
+                        "status": task["status"],
+                        "progress": task["progress"],
+                        "logs": task["logs"]
+                    })
+            elif data.get("type") == "unsubscribe":
+                broadcaster.unsubscribe(client, topic)
     except WebSocketDisconnect:
-        manager.disconnect(client_id)
+        pass
+    finally:
+        broadcaster.disconnect(client)
 
 # 前端Dashboard
+def asset_response(asset, request: Request) -> Response:
+    """从内存返回静态资源（预压缩版本 + 各版本各自的 ETag）"""
+    body, encoding = asset.variant(request.headers.get("accept-encoding"))
+    etag = encoded_etag(asset.etag, encoding) if encoding else asset.etag
+    headers = {"ETag": etag, "Cache-Control": asset.cache_control, "Vary": "Accept-Encoding"}
+    if etag_matches(request.headers.get("if-none-match"), asset.etag):
+        return Response(status_code=304, headers=headers)
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type=asset.content_type, headers=headers)
+
 @app.get("/", response_class=HTMLResponse)
-async def dashboard():
+async def dashboard(request: Request):
+    index = static_assets.get("index.html")
+    if index:
+        return asset_response(index, request)
     with open("frontend/index.html", "r") as f:
         return f.read()
 
+@app.get("/assets/{path:path}")
+async def frontend_asset(path: str, request: Request):
+    asset = static_assets.get(f"assets/{path}")
+    if not asset:
+        return Response(status_code=404)
+    return asset_response(asset, request)
+
 # 启动服务
 if __name__ == "__main__":
     uvicorn.run(
         "main:app",
         host="0.0.0.0",
         port=8000,
-        reload=True
+        reload=True,
+        ws_per_message_deflate=os.getenv("WS_PER_MESSAGE_DEFLATE", "true").lower() == "true"
     )
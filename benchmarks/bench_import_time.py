@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+导入耗时基准测试
+在全新子进程中导入后端模块，统计冷启动耗时（对应 worker 启动与 --reload 周期），
+并列出 -X importtime 中累计耗时最高的模块
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend')
+
+DEFAULT_MODULES = ["core.agents", "core.workflows", "main"]
+
+
+def time_import(module: str) -> float:
+    """在子进程中导入模块，返回导入耗时（秒）"""
+    code = (
+        "import time; started = time.perf_counter(); "
+        f"import {module}; "
+        "print(time.perf_counter() - started)"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=BACKEND_DIR, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr else "import failed")
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def top_imports(module: str, top: int) -> list:
+    """解析 -X importtime 输出，返回累计耗时最高的模块"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=BACKEND_DIR, capture_output=True, text=True
+    )
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name = line.split("|")
+        entries.append((int(cumulative_us), name.strip()))
+    return sorted(entries, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="导入耗时基准测试")
+    parser.add_argument("modules", nargs="*", default=DEFAULT_MODULES, help="要测量的模块")
+    parser.add_argument("--repeat", type=int, default=5, help="每个模块重复次数")
+    parser.add_argument("--top", type=int, default=10, help="列出耗时最高的导入数")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print(f"导入耗时基准（{args.repeat} 次取中位数）")
+    print("=" * 60)
+
+    for module in args.modules:
+        try:
+            samples = [time_import(module) for _ in range(args.repeat)]
+        except RuntimeError as e:
+            print(f"  ❌ {module}: {e}")
+            continue
+
+        print(f"\n✓ {module}: 中位数 {statistics.median(samples) * 1000:.1f} ms "
+              f"(最小 {min(samples) * 1000:.1f} ms, 最大 {max(samples) * 1000:.1f} ms)")
+        for cumulative_us, name in top_imports(module, args.top):
+            print(f"    {cumulative_us / 1000:8.1f} ms  {name}")
+
+
+if __name__ == "__main__":
+    main()
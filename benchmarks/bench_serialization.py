@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+JSON 序列化基准测试
+对比大响应（含多KB代码/测试/调研产出的任务详情、1000 条审计日志）在
+FastAPI 默认路径（jsonable_encoder + json.dumps）与 core.serialization.dumps（orjson）下
+每个请求的 CPU 时间
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+# 添加backend到路径
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+from core.serialization import dumps, orjson
+
+try:
+    from fastapi.encoders import jsonable_encoder
+except ImportError:
+    jsonable_encoder = None
+
+
+def build_task_response(payload_kb: int, logs: int) -> dict:
+    """GET /api/tasks/{task_id} 的典型响应"""
+    code = "def handler(request):\n    return {'ok': True}  # 实现细节\n" * (payload_kb * 1024 // 60)
+    now = datetime.now()
+    return {
+        "success": True,
+        "task": {
+            "id": "task_bench",
+            "version": 42,
+            "agent_type": "elon",
+            "message": "创建新的API接口",
+            "status": "completed",
+            "progress": 100.0,
+            "start_time": now.isoformat(),
+            "logs": [{"time": (now + timedelta(seconds=i)).isoformat(), "message": f"节点 {i} 完成",
+                      "status": "info"} for i in range(logs)],
+            "outputs": {"architecture": {"modules": ["api", "service", "store"], "design": code},
+                        "code": code, "tests": code, "review": code},
+            "nodes": {f"node_{i}": {"status": "completed", "elapsed": 1.25 * i} for i in range(8)},
+        },
+    }
+
+
+def build_audit_response(rows: int) -> dict:
+    """GET /api/audit/logs 的典型响应（limit=1000）"""
+    now = datetime.now()
+    logs = [{
+        "id": i,
+        "task_id": f"task_{i // 10}",
+        "agent_type": "elon",
+        "action": "model_routed",
+        "details": f"coder -> gpt-4o (complexity 0.{i % 10}) 路由决策详情",
+        "severity": "info",
+        "success": 1,
+        "timestamp": now - timedelta(seconds=i),
+    } for i in range(rows)]
+    return {"success": True, "task_id": "", "logs": logs, "total": rows}
+
+
+def fastapi_default(content: dict) -> bytes:
+    """FastAPI 默认路径：jsonable_encoder 逐字段转换后由 JSONResponse 序列化"""
+    encoded = jsonable_encoder(content) if jsonable_encoder else content
+    return json.dumps(encoded, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":"),
+                      default=str).encode("utf-8")
+
+
+def measure(serialize, content: dict, iterations: int) -> dict:
+    """每个请求的 CPU 时间（毫秒）与响应大小"""
+    serialize(content)
+    started = time.process_time()
+    for _ in range(iterations):
+        body = serialize(content)
+    elapsed = time.process_time() - started
+    return {"cpu_ms": elapsed / iterations * 1000, "bytes": len(body)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="JSON 序列化基准测试")
+    parser.add_argument("--iterations", type=int, default=200, help="每种响应的序列化次数")
+    parser.add_argument("--payload-kb", type=int, default=16, help="每项任务产出大小（KB）")
+    parser.add_argument("--logs", type=int, default=200, help="任务日志条数")
+    parser.add_argument("--audit-rows", type=int, default=1000, help="审计日志条数")
+    args = parser.parse_args()
+
+    responses = {
+        "任务详情": build_task_response(args.payload_kb, args.logs),
+        "审计日志": build_audit_response(args.audit_rows),
+    }
+    baseline = "jsonable_encoder + json" if jsonable_encoder else "json（未安装 fastapi，不含 jsonable_encoder）"
+    fast = "orjson" if orjson is not None else "json（未安装 orjson）"
+
+    print("=" * 60)
+    print(f"序列化基准: {args.iterations} 次/响应, 默认路径 {baseline}, 快速路径 {fast}")
+    print("=" * 60)
+
+    for name, content in responses.items():
+        before = measure(fastapi_default, content, args.iterations)
+        after = measure(dumps, content, args.iterations)
+        print(f"  {name} ({after['bytes'] / 1024:.0f} KB)")
+        print(f"    默认路径: {before['cpu_ms']:8.3f} ms/请求")
+        print(f"    快速路径: {after['cpu_ms']:8.3f} ms/请求  "
+              f"CPU 降低 {(1 - after['cpu_ms'] / before['cpu_ms']) * 100:.1f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+状态增量基准测试
+对比节点返回整份状态拷贝（{**state, ...}）与只返回增量 + 合并函数两种方式，
+在长工作流下的耗时与内存峰值
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+import tracemalloc
+
+# 添加backend到路径
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+from core.dag_scheduler import DAGWorkflow, NodeSpec, append, keep_max
+
+
+def build_full_copy_workflow(nodes: int, payload: str) -> DAGWorkflow:
+    """旧方式：每个节点复制整份状态，审计日志整表重建"""
+    def make_node(i):
+        def node(state):
+            return {
+                **state,
+                f'output_{i}': payload,
+                'audit_logs': state.get('audit_logs', []) + [f'node_{i} done'],
+                'progress': i,
+            }
+        return node
+
+    return DAGWorkflow('full_copy', [
+        NodeSpec(f'node_{i}', make_node(i),
+                 reads=(f'output_{i - 1}', 'audit_logs') if i else ('audit_logs',),
+                 writes=(f'output_{i}', 'audit_logs', 'progress'))
+        for i in range(nodes)
+    ])
+
+
+def build_delta_workflow(nodes: int, payload: str) -> DAGWorkflow:
+    """新方式：节点只返回增量，追加型字段由合并函数处理"""
+    def make_node(i):
+        def node(state):
+            return {
+                f'output_{i}': payload,
+                'audit_logs': [f'node_{i} done'],
+                'progress': i,
+            }
+        return node
+
+    return DAGWorkflow('delta', [
+        NodeSpec(f'node_{i}', make_node(i),
+                 reads=(f'output_{i - 1}',) if i else (),
+                 writes=(f'output_{i}', 'audit_logs', 'progress'))
+        for i in range(nodes)
+    ], reducers={'audit_logs': append, 'progress': keep_max})
+
+
+def measure(workflow: DAGWorkflow, initial_state: dict) -> dict:
+    """执行一次工作流，返回耗时与内存峰值"""
+    tracemalloc.start()
+    started = time.perf_counter()
+    state = asyncio.run(workflow.ainvoke(initial_state))
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"seconds": elapsed, "peak_mb": peak / 1024 / 1024, "audit_logs": len(state['audit_logs'])}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="状态增量基准测试")
+    parser.add_argument("--nodes", type=int, default=200, help="工作流节点数")
+    parser.add_argument("--payload-kb", type=int, default=32, help="每个节点产出大小（KB）")
+    parser.add_argument("--history", type=int, default=5000, help="初始审计日志条数")
+    args = parser.parse_args()
+
+    payload = "x" * (args.payload_kb * 1024)
+    initial_state = {
+        "task": "优化系统性能",
+        "task_id": "bench",
+        "audit_logs": [f"history {i}" for i in range(args.history)],
+        "progress": 0,
+    }
+
+    print("=" * 60)
+    print(f"状态增量基准: {args.nodes} 节点, 每节点 {args.payload_kb}KB, 初始日志 {args.history} 条")
+    print("=" * 60)
+
+    results = {
+        "整份拷贝": measure(build_full_copy_workflow(args.nodes, payload), initial_state),
+        "增量返回": measure(build_delta_workflow(args.nodes, payload), initial_state),
+    }
+
+    for name, result in results.items():
+        print(f"  {name}: {result['seconds'] * 1000:8.1f} ms  峰值内存 {result['peak_mb']:7.2f} MB  "
+              f"审计日志 {result['audit_logs']} 条")
+
+    full, delta = results["整份拷贝"], results["增量返回"]
+    print(f"\n  耗时降低 {(1 - delta['seconds'] / full['seconds']) * 100:.1f}%, "
+          f"峰值内存降低 {(1 - delta['peak_mb'] / full['peak_mb']) * 100:.1f}%")
+
+
+if __name__ == "__main__":
+    main()
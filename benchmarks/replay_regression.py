@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+工作流回放回归测试
+  record: 执行一次工作流并录制（LLM_PROVIDER=mock 时可离线录制）
+  check:  用当前代码回放录制，与基线比较节点开销、状态大小与审计写入次数，回归时返回非零退出码
+
+服务端录制：设置 RECORD_WORKFLOWS_DIR 后，每个任务的执行都会保存为 <task_id>.jsonl.gz
+"""
+
+import argparse
+import asyncio
+import glob
+import json
+import os
+import sys
+from pathlib import Path
+
+# 添加backend到路径
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+from core.agents import get_agent_workflow
+from core.replay import WorkflowRecorder, compare, load_recording, replay
+
+RECORDINGS_DIR = Path(__file__).parent / "recordings"
+
+
+def baseline_path(recording: Path) -> Path:
+    return recording.with_name(recording.name.replace(".jsonl.gz", "") + ".baseline.json")
+
+
+async def record(args):
+    workflow = get_agent_workflow(args.agent)
+    recorder = WorkflowRecorder(args.agent)
+    initial_state = {
+        "messages": [f"Task: {args.task}"],
+        "current_agent": args.agent,
+        "task": args.task,
+        "status": "running",
+        "progress": 0.0,
+        "task_id": f"record_{args.agent}",
+        "audit_logs": []
+    }
+    await recorder.run(workflow, initial_state)
+
+    out = Path(args.out or RECORDINGS_DIR / f"{args.agent}.jsonl.gz")
+    recorder.save(out)
+    print(f"✓ 已录制 {args.agent}: {len(recorder.nodes)} 个节点 -> {out}")
+    return 0
+
+
+async def check(args):
+    paths = [Path(p) for pattern in (args.recordings or [str(RECORDINGS_DIR / "*.jsonl.gz")])
+             for p in glob.glob(pattern)]
+    if not paths:
+        print("没有找到录制文件")
+        return 1
+
+    failed = 0
+    for path in sorted(paths):
+        recording = load_recording(path)
+        workflow = get_agent_workflow(recording["header"]["agent_type"])
+        current = await replay(recording, workflow, iterations=args.iterations)
+
+        base_file = baseline_path(path)
+        if args.update_baseline or not base_file.exists():
+            base_file.write_text(json.dumps(current, ensure_ascii=False, indent=2))
+            print(f"✓ {path.name}: 已写入基线 {base_file.name}")
+            continue
+
+        regressions = compare(json.loads(base_file.read_text()), current,
+                              overhead_tolerance=args.overhead_tolerance,
+                              overhead_slack_ms=args.overhead_slack_ms,
+                              size_tolerance=args.size_tolerance)
+        if regressions:
+            failed += 1
+            print(f"❌ {path.name}")
+            for regression in regressions:
+                print(f"    {regression}")
+        else:
+            print(f"✅ {path.name}")
+        for name, metrics in current["nodes"].items():
+            print(f"    {name:22s} 开销 {metrics['overhead_ms']:8.3f}ms  "
+                  f"状态 {metrics['state_bytes']:8d}B  审计写入 {metrics['audit_writes']}")
+
+    return 1 if failed else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="工作流回放回归测试")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    record_parser = sub.add_parser("record", help="录制一次工作流执行")
+    record_parser.add_argument("--agent", default="elon")
+    record_parser.add_argument("--task", default="创建新的API接口")
+    record_parser.add_argument("--out")
+
+    check_parser = sub.add_parser("check", help="回放录制并与基线比较")
+    check_parser.add_argument("recordings", nargs="*")
+    check_parser.add_argument("--iterations", type=int, default=5)
+    check_parser.add_argument("--update-baseline", action="store_true")
+    check_parser.add_argument("--overhead-tolerance", type=float, default=0.5)
+    check_parser.add_argument("--overhead-slack-ms", type=float, default=2.0)
+    check_parser.add_argument("--size-tolerance", type=float, default=0.1)
+
+    args = parser.parse_args()
+    handler = record if args.command == "record" else check
+    sys.exit(asyncio.run(handler(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -29,72 +29,54 @@ function App() {
 
   // 初始化Agent状态
   useEffect(() => {
-    initializeAgents();
-    loadTasks();
-    startLogRotation();
+    loadDashboard();
   }, []);
 
-  const initializeAgents = async () => {
-    const agentPromises = Object.keys(agents).map(async (agentType) => {
-      try {
-        const status = await api.getAgentStatus(agentType);
-        setAgents(prev => ({
-          ...prev,
-          [agentType]: {
-            ...status,
-            status: 'idle',
-            currentTask: null,
-            progress: 0
-          }
-        }));
-      } catch (error) {
-        console.error(`Error checking ${agentType} status:`, error);
+  // 订阅当前任务的节点事件（替代定时轮询），任务结束或切换时关闭连接
+  useEffect(() => {
+    if (!currentTaskId) return undefined;
+
+    const applyProgress = (progress, extra = {}) => {
+      setWorkflowState(prev => ({
+        ...prev,
+        goal: progress > 20 ? 'completed' : 'pending',
+        echo: progress > 40 ? 'completed' : 'running',
+        elon: progress > 60 ? 'completed' : 'running',
+        henry: progress > 80 ? 'completed' : 'running',
+        complete: progress >= 100 ? 'completed' : 'pending',
+        ...extra
+      }));
+    };
+
+    return api.subscribeTask(currentTaskId, (event) => {
+      if (event.type === 'task_update') {
+        applyProgress(event.progress, { logs: event.logs });
+      } else if (event.type === 'progress') {
+        applyProgress(event.progress);
+      } else if (event.type === 'task_complete') {
+        applyProgress(100, { logs: event.logs });
+        setCurrentTaskId(null);
       }
     });
+  }, [currentTaskId]);
 
-    await Promise.all(agentPromises);
-  };
-
-  const loadTasks = async () => {
+  // 一次请求取回Agent、任务与安全统计（服务端按 ETag 缓存）
+  const loadDashboard = async () => {
     try {
-      const response = await api.listTasks();
-      if (response.success) {
-        setTasks(response.tasks);
+      const snapshot = await api.getDashboard();
+      if (snapshot.success) {
+        setAgents(Object.fromEntries(snapshot.agents.map(agent => [agent.type, {
+          ...agent,
+          currentTask: null,
+          progress: 0
+        }])));
+        setTasks(snapshot.tasks.recent);
       }
     } catch (error) {
-      console.error('Error loading tasks:', error);
+      console.error('Error loading dashboard:', error);
     }
   };
 
-  const startLogRotation = () => {
-    // 定期更新任务状态
-    setInterval(async () => {
-      if (currentTaskId) {
-        try {
-          const response = await api.getTaskStatus(currentTaskId);
-          if (response.success) {
-            const task = response.task;
-            setWorkflowState(prev => ({
-              ...prev,
-              goal: task.progress > 20 ? 'completed' : 'pending',
-              echo: task.progress > 40 ? 'completed' : 'running',
-              elon: task.progress > 60 ? 'completed' : 'running',
-              henry: task.progress > 80 ? 'completed' : 'running',
-              complete: task.progress >= 100 ? 'completed' : 'pending',
-              logs: task.logs
-            }));
-
-            if (task.status === 'completed') {
-              setCurrentTaskId(null);
-            }
-          }
-        } catch (error) {
-          console.error('Error updating task status:', error);
-        }
-      }
-    }, 2000);
-  };
-
   const handleSendMessage = async () => {
     if (!currentMessage.trim()) return;
 
@@ -9,6 +9,12 @@ const api = {
     return response.data;
   },
 
+  // Dashboard snapshot: agents, recent tasks and safety stats in one request
+  getDashboard: async () => {
+    const response = await axios.get(`${API_URL}/api/dashboard`);
+    return response.data;
+  },
+
   // Start workflow
   startWorkflow: async (agentType, message) => {
     const response = await axios.post(`${API_URL}/api/workflow/${agentType}`, {
@@ -18,6 +24,18 @@ const api = {
     return response.data;
   },
 
+  // Subscribe to task events over WebSocket; returns an unsubscribe function
+  subscribeTask: (taskId, onEvent) => {
+    const clientId = `dashboard_${Math.random().toString(36).slice(2)}`;
+    const socket = new WebSocket(`${API_URL.replace(/^http/, 'ws')}/ws/${clientId}`);
+    socket.onopen = () => socket.send(JSON.stringify({ type: 'subscribe', task_id: taskId }));
+    socket.onmessage = (message) => {
+      const event = JSON.parse(message.data);
+      if (event.task_id === taskId) onEvent(event);
+    };
+    return () => socket.close();
+  },
+
   // Health check
   healthCheck: async () => {
     const response = await axios.get(`${API_URL}/health`);
@@ -5,12 +5,18 @@ Hive Mind 系统测试脚本
 """
 
 import asyncio
+import json
+import time
 import sys
 import os
 
 # 添加backend到路径
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'backend'))
 
+# 默认使用离线模拟LLM，无需API密钥
+os.environ.setdefault("LLM_PROVIDER", "mock")
+os.environ.setdefault("MOCK_LLM_LATENCY_MS", "10")
+
 from core.agents import (
     AgentType,
     get_agent_config,
@@ -132,6 +138,108 @@ def test_rate_limit():
     print("\n✅ 频率限制测试通过\n")
     return True
 
+async def test_dag_scheduler():
+    """测试DAG调度器"""
+    print("=" * 60)
+    print("测试6: DAG调度器")
+    print("=" * 60)
+
+    from core.dag_scheduler import DAGWorkflow, NodeSpec, keep_max
+
+    def slow(key, value):
+        async def node(state):
+            await asyncio.sleep(0.05)
+            return {key: value, 'progress': len(state)}
+        return node
+
+    workflow = DAGWorkflow('test', [
+        NodeSpec('a', slow('x', 1), reads=('task',), writes=('x', 'progress')),
+        NodeSpec('b', slow('y', 2), reads=('task',), writes=('y', 'progress')),
+        NodeSpec('c', slow('z', 3), reads=('x', 'y'), writes=('z', 'progress')),
+    ], reducers={'progress': keep_max})
+
+    levels = workflow.dag.levels()
+    print(f"\n✓ 并行层级: {levels}")
+    assert levels == [['a', 'b'], ['c']]
+
+    state, report = await workflow.run({'task': '测试'})
+    print(f"  关键路径: {report.critical_path} ({report.critical_path_seconds:.3f}s)")
+    print(f"  实际耗时: {report.wall_seconds:.3f}s")
+    assert state['z'] == 3
+    assert len(report.critical_path) == 2
+    assert report.wall_seconds < 0.14
+
+    # 追加型字段合并为新列表：并行节点拿到的快照不会看到兄弟节点的写入
+    from core.dag_scheduler import append
+
+    seen = {}
+
+    def logger(name, delay):
+        async def node(state):
+            logs = state['logs']
+            await asyncio.sleep(delay)
+            seen[name] = list(logs)
+            return {'logs': [name]}
+        return node
+
+    initial = {'task': '测试', 'logs': ['init']}
+    logging_workflow = DAGWorkflow('logs', [
+        NodeSpec('fast', logger('fast', 0), reads=('task',), writes=('logs',)),
+        NodeSpec('slow', logger('slow', 0.02), reads=('task',), writes=('logs',)),
+    ], reducers={'logs': append})
+    state, _ = await logging_workflow.run(initial)
+    print(f"  并行快照: {seen}")
+    assert seen == {'fast': ['init'], 'slow': ['init']}
+    assert state['logs'] == ['init', 'fast', 'slow'] and initial['logs'] == ['init']
+
+    print("\n✅ DAG调度器测试通过\n")
+    return True
+
+async def test_task_event_listener():
+    """测试节点事件更新任务记录并推送"""
+    print("=" * 60)
+    print("测试26: 节点事件推送")
+    print("=" * 60)
+
+    from core.broadcaster import broadcaster, task_topic
+    from core.dag_scheduler import DAGWorkflow, NodeSpec, keep_max
+    from core.task_events import TaskEventListener
+
+    def node(key, value):
+        async def run(state):
+            await asyncio.sleep(0.01)
+            return {key: value, 'progress': len(state)}
+        return run
+
+    workflow = DAGWorkflow('test', [
+        NodeSpec('a', node('x', 1), reads=('task',), writes=('x', 'progress')),
+        NodeSpec('b', node('y', 2), reads=('task',), writes=('y', 'progress')),
+        NodeSpec('c', node('z', 3), reads=('x', 'y'), writes=('z', 'progress')),
+    ], reducers={'progress': keep_max})
+
+    # 节点事件逐步更新任务记录并推送给订阅者
+    events = []
+
+    async def collect(message):
+        events.append(json.loads(message))
+
+    client = broadcaster.connect("test_events", collect, topics=[task_topic("t_events")])
+    task = {"id": "t_events", "agent_type": "elon", "progress": 0.0}
+    await workflow.run({'task': '测试'}, listener=TaskEventListener(task, len(workflow.dag.order)))
+    await asyncio.sleep(0.01)
+    broadcaster.disconnect(client)
+
+    kinds = [event["type"] for event in events]
+    print(f"\n✓ 节点事件: {kinds}")
+    assert kinds.count("node_start") == 3 and kinds.count("node_end") == 3
+    assert task["progress"] == 100 and task["nodes"]["c"]["status"] == "completed"
+    progress = [event["progress"] for event in events if event["type"] == "progress"]
+    assert progress == sorted(progress) and progress[-1] == 100
+    print(f"✓ 进度单调递增: {progress}")
+
+    print("\n✅ 节点事件推送测试通过\n")
+    return True
+
 async def test_workflow_async():
     """异步测试工作流"""
     print("=" * 60)
@@ -139,7 +247,6 @@ async def test_workflow_async():
     print("=" * 60)
 
     try:
-        from langgraph.graph.message import add_messages
         from core.agents import AgentState
         from core.workflows import ECHO_WORKFLOW
 
@@ -178,6 +285,1490 @@ async def test_workflow_async():
         traceback.print_exc()
         return False
 
+async def test_mock_llm_workflow():
+    """测试离线模拟LLM执行完整工作流"""
+    print("=" * 60)
+    print("测试7: 模拟LLM工作流")
+    print("=" * 60)
+
+    from core.agents import get_agent_workflow
+    from core.mock_llm import MockChatModel
+
+    # 相同输入得到相同输出
+    llm = MockChatModel(AgentType.ARCHITECT, latency_ms=0)
+    assert llm.invoke("设计API").content == llm.invoke("设计API").content
+    assert "```json" in llm.invoke("设计API").content
+
+    # 注入的错误按调用次数抽取：首次失败的提示词重试后可以成功，相同调用序列可复现
+    from core.call_policy import CallPolicy, call_with_policy
+    from core.mock_llm import MockLLMError
+
+    def outcomes(model, prompt, count=6):
+        results = []
+        for _ in range(count):
+            try:
+                results.append(model.invoke(prompt).content)
+            except MockLLMError:
+                results.append("error")
+        return results
+
+    flaky = lambda: MockChatModel(AgentType.CODER, latency_ms=0, error_rate=0.5)
+    prompt = next(p for p in (f"实现接口{i}" for i in range(50)) if outcomes(flaky(), p, 1) == ["error"])
+    sequence = outcomes(flaky(), prompt)
+    assert sequence == outcomes(flaky(), prompt)
+    assert sequence[0] == "error" and any(result != "error" for result in sequence)
+
+    model = flaky()
+    response = await call_with_policy(lambda: model.ainvoke(prompt),
+                                      CallPolicy(timeout=1.0, deadline=5.0, max_retries=5, backoff_base=0.001),
+                                      "test_mock_retry")
+    assert response.content == MockChatModel(AgentType.CODER, latency_ms=0).invoke(prompt).content
+    print(f"✓ 注入错误后重试成功（调用序列: {['error' if r == 'error' else 'ok' for r in sequence]}）")
+
+    # 审计日志在线程中写入，不阻塞事件循环
+    import threading
+    from core.audit_store import audit_store
+    loop_thread = threading.get_ident()
+    writer_threads = []
+    original_log_action = audit_store.log_action
+
+    def tracking_log_action(**kwargs):
+        writer_threads.append(threading.get_ident())
+        return original_log_action(**kwargs)
+
+    audit_store.log_action = tracking_log_action
+    try:
+        result = await get_agent_workflow(AgentType.ELON).ainvoke({
+            "messages": [],
+            "task": "创建新的API接口",
+            "task_id": "test_mock",
+            "audit_logs": [],
+            "progress": 0.0
+        })
+    finally:
+        audit_store.log_action = original_log_action
+
+    print(f"\n✓ 架构模块: {result['architecture'].get('modules')}")
+    print(f"  关键路径: {result['schedule']['critical_path']}")
+    assert result['architecture']
+    assert result['progress'] == 100
+    assert result['review']
+    assert writer_threads and loop_thread not in writer_threads
+    print(f"✓ {len(writer_threads)} 条审计日志均在线程中写入")
+
+    # 安全检查在线程中执行，拒绝时异常照常传回
+    try:
+        await get_agent_workflow(AgentType.ECHO).ainvoke({
+            "messages": [], "task": "攻击服务器并删除数据库", "task_id": "test_block", "audit_logs": [], "progress": 0.0
+        })
+        assert False, "危险任务应被拒绝"
+    except ValueError as e:
+        print(f"✓ 危险任务被拒绝: {e}")
+
+    print("\n✅ 模拟LLM工作流测试通过\n")
+    return True
+
+async def test_call_policy():
+    """测试LLM调用策略：超时、重试与对冲"""
+    print("=" * 60)
+    print("测试8: LLM调用策略")
+    print("=" * 60)
+
+    from core.call_policy import CallPolicy, call_with_policy, latency_tracker
+    from core.metrics import metrics
+    from core.mock_llm import MockLLMError
+
+    # 可重试错误（429）退避后重试成功
+    attempts = []
+    async def flaky():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise MockLLMError("rate limited", 429)
+        return "ok"
+    policy = CallPolicy(timeout=1.0, deadline=5.0, backoff_base=0.01)
+    assert await call_with_policy(flaky, policy, "test_retry") == "ok"
+    assert len(attempts) == 2
+    print("\n✓ 429错误重试成功")
+
+    # 不可重试错误直接抛出
+    async def broken():
+        raise ValueError("bad request")
+    try:
+        await call_with_policy(broken, policy, "test_fatal")
+        assert False, "不可重试错误应直接抛出"
+    except ValueError:
+        pass
+    print("✓ 不可重试错误不重试")
+
+    # 单次超时后重试
+    slow_calls = []
+    async def slow_once():
+        slow_calls.append(1)
+        await asyncio.sleep(1.0 if len(slow_calls) == 1 else 0)
+        return "ok"
+    assert await call_with_policy(slow_once, CallPolicy(timeout=0.05, deadline=2.0, backoff_base=0.01),
+                                  "test_timeout") == "ok"
+    print("✓ 超时后重试成功")
+
+    # 超时的尝试按超时值计入延迟样本，p95不会只反映成功的快速调用
+    assert latency_tracker.quantile("test_timeout", 0.95) >= 0.05
+    assert len(latency_tracker._samples["test_timeout"]) == 2
+    print("✓ 超时尝试计入延迟分位数")
+
+    # 超过p95延迟后发出对冲请求，取先返回的结果
+    for _ in range(20):
+        latency_tracker.record("test_hedge", 0.01)
+    hedge_calls = []
+    async def tail_latency():
+        hedge_calls.append(1)
+        await asyncio.sleep(1.0 if len(hedge_calls) == 1 else 0.01)
+        return len(hedge_calls)
+    hedges_before = metrics.get("llm_hedge_wins_total", node="test_hedge")
+    result = await call_with_policy(tail_latency, CallPolicy(timeout=2.0, hedge=True, hedge_min_delay=0.02),
+                                    "test_hedge")
+    assert result == 2
+    assert metrics.get("llm_hedge_wins_total", node="test_hedge") == hedges_before + 1
+    print("✓ 对冲请求胜出")
+
+    print("\n✅ LLM调用策略测试通过\n")
+    return True
+
+async def test_llm_router():
+    """测试多供应商故障转移"""
+    print("=" * 60)
+    print("测试9: 模型路由")
+    print("=" * 60)
+
+    from core.call_policy import CallPolicy, call_with_policy
+    from core.llm_router import LLMRouter, FAILURE_THRESHOLD
+
+    os.environ["MOCK_LLM_DEGRADED_MODELS"] = "gpt-4"
+    try:
+        router = LLMRouter(mode="failover")
+        policy = CallPolicy(timeout=1.0, deadline=5.0, backoff_base=0.01)
+        for i in range(FAILURE_THRESHOLD + 1):
+            tried = set()
+            response = await call_with_policy(
+                lambda: router.ainvoke(AgentType.ARCHITECT, f"设计API {i}", tried), policy, "test_router")
+            assert response.response_metadata["model_name"] == "claude-sonnet-4-20250514"
+    finally:
+        del os.environ["MOCK_LLM_DEGRADED_MODELS"]
+
+    status = router.status()
+    print(f"\n✓ 路由状态: {status}")
+    assert not status["openai:gpt-4"]["healthy"]
+    assert status["anthropic:claude-sonnet-4-20250514"]["healthy"]
+
+    # 冷却结束后半开：只放行一个探测请求，探测成功后恢复
+    health = router.health["openai:gpt-4"]
+    health.open_until = time.monotonic() - 1
+    assert router.candidates(AgentType.ARCHITECT)[0].model == "gpt-4"
+    assert health.begin_probe(time.monotonic())
+    assert router.candidates(AgentType.ARCHITECT)[0].model == "claude-sonnet-4-20250514"
+    assert not health.available(time.monotonic())
+    health.record_success(0.1)
+    assert router.candidates(AgentType.ARCHITECT)[0].model == "gpt-4"
+    print("✓ 半开状态只放行一个探测请求")
+
+    # 导出的标签值按 Prometheus 文本格式转义
+    from core.metrics import MetricsRegistry
+    registry = MetricsRegistry()
+    registry.inc("test_escape_total", node='a\\b"c\nd')
+    assert 'test_escape_total{node="a\\\\b\\"c\\nd"} 1' in registry.render_prometheus()
+    print("✓ 标签值转义")
+
+    print("\n✅ 模型路由测试通过\n")
+    return True
+
+async def test_singleflight():
+    """测试相同请求合并执行"""
+    print("=" * 60)
+    print("测试10: 请求合并")
+    print("=" * 60)
+
+    from core.singleflight import SingleFlight
+
+    group = SingleFlight()
+    executions = []
+    shared = {}
+
+    async def execute():
+        executions.append(1)
+        await asyncio.sleep(0.05)
+
+    key = group.key("elon", "创建新的API接口", {})
+    assert key == group.key("elon", "  创建新的API接口 ", {})
+
+    leader = group.track(key, "task_a", execute(), on_done=lambda leader_id, aliases: shared.update({leader_id: aliases}))
+    assert group.attach(key, "task_b") == "task_a"
+    assert group.attach(key, "task_c") == "task_a"
+    await leader
+
+    assert len(executions) == 1
+    assert shared == {"task_a": ["task_b", "task_c"]}
+    assert group.attach(key, "task_d") is None
+    print(f"\n✓ 3个相同请求只执行1次，别名: {shared['task_a']}")
+
+    # 队列已满被拒绝时撤销登记，后续相同请求不会挂到永远不会执行的任务上
+    from core.task_scheduler import TaskScheduler, SchedulerFull
+
+    scheduler = TaskScheduler(max_concurrency=1, max_queue=0)
+    try:
+        scheduler.submit("task_e", "elon", group.track(key, "task_e", execute()))
+        assert False, "队列已满时应拒绝"
+    except SchedulerFull:
+        group.forget(key)
+    assert group.inflight() == 0
+    assert group.attach(key, "task_f") is None
+    assert len(executions) == 1
+    print("✓ 提交被拒绝后释放请求键")
+
+    print("\n✅ 请求合并测试通过\n")
+    return True
+
+async def test_task_scheduler():
+    """测试有界优先级调度器"""
+    print("=" * 60)
+    print("测试11: 任务调度器")
+    print("=" * 60)
+
+    from core.task_scheduler import TaskScheduler, SchedulerFull
+
+    scheduler = TaskScheduler(max_concurrency=2, agent_limits={"elon": 1}, max_queue=3)
+    started = []
+    peak = {"total": 0, "elon": 0}
+
+    async def job(name, agent_type):
+        started.append(name)
+        peak["total"] = max(peak["total"], sum(scheduler.running.values()))
+        peak["elon"] = max(peak["elon"], scheduler.running["elon"])
+        await asyncio.sleep(0.02)
+
+    assert scheduler.submit("e1", "elon", job("e1", "elon")) == 0
+    assert scheduler.submit("e2", "elon", job("e2", "elon"), priority="batch") == 1
+    assert scheduler.submit("h1", "henry", job("h1", "henry")) == 0
+    assert scheduler.submit("e3", "elon", job("e3", "elon"), priority="interactive") == 1
+    assert scheduler.position("e2") == 2
+    scheduler.submit("h2", "henry", job("h2", "henry"))
+    try:
+        scheduler.submit("h3", "henry", job("h3", "henry"))
+        assert False, "队列已满时应拒绝"
+    except SchedulerFull:
+        pass
+
+    while scheduler.tasks or scheduler.position("e2"):
+        await asyncio.sleep(0.01)
+
+    print(f"\n✓ 启动顺序: {started}")
+    assert started.index("e3") < started.index("e2")
+    assert peak["total"] <= 2 and peak["elon"] <= 1
+
+    print("\n✅ 任务调度器测试通过\n")
+    return True
+
+async def test_adaptive_limiter():
+    """测试AIMD自适应并发控制"""
+    print("=" * 60)
+    print("测试12: 自适应并发控制")
+    print("=" * 60)
+
+    from core.adaptive_limiter import AIMDLimiter
+    from core.mock_llm import MockLLMError
+
+    # 模拟承载能力为6个并发的供应商，超过即返回429
+    capacity = 6
+    limiter = AIMDLimiter("test", initial=2, max_limit=32)
+    state = {"active": 0, "rate_limited": 0, "ok": 0}
+
+    async def call():
+        await limiter.acquire()
+        state["active"] += 1
+        try:
+            await asyncio.sleep(0.005)
+            if state["active"] > capacity:
+                raise MockLLMError("rate limit exceeded", 429)
+        except MockLLMError:
+            state["rate_limited"] += 1
+            limiter.release(overloaded=True)
+            return
+        finally:
+            state["active"] -= 1
+        state["ok"] += 1
+        limiter.release(latency=0.005)
+
+    async def worker():
+        for _ in range(30):
+            await call()
+
+    await asyncio.gather(*(worker() for _ in range(20)))
+
+    print(f"\n✓ 最终并发上限: {limiter.current_limit}，成功 {state['ok']}，限流 {state['rate_limited']}")
+    assert 2 <= limiter.current_limit <= capacity * 2
+    assert state["rate_limited"] < state["ok"] / 5
+    assert limiter.inflight == 0
+
+    print("\n✅ 自适应并发控制测试通过\n")
+    return True
+
+async def test_task_store():
+    """测试有界任务存储"""
+    print("=" * 60)
+    print("测试13: 任务存储")
+    print("=" * 60)
+
+    import tempfile
+    from pathlib import Path
+    from core.task_store import TaskStore
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = TaskStore(db_path=Path(tmp) / "tasks.db", max_tasks=3, max_bytes=10 * 1024 * 1024)
+        store["running"] = {"id": "running", "agent_type": "elon", "status": "running", "logs": []}
+        for i in range(5):
+            store[f"done_{i}"] = {"id": f"done_{i}", "agent_type": "echo", "status": "completed",
+                                  "outputs": {"text": "x" * 1000}}
+        # 事件循环中落盘交给后台线程，写入完成前任务仍在热层中可以读取
+        assert "done_0" in store._spilling and store["done_0"]["status"] == "completed"
+        await store.drain()
+
+        print(f"\n✓ 热层任务数: {len(store._hot)}，总任务数: {len(store)}")
+        assert len(store._hot) == 3
+        assert len(store) == 6
+        assert "running" in store._hot
+
+        # 已落盘的任务读取时透明加载
+        assert "done_0" not in store._hot
+        assert store["done_0"]["outputs"]["text"] == "x" * 1000
+        assert "done_0" in store._hot
+
+        # 按状态计数：加载回热层的任务不重复计数
+        assert store.count_by_status() == {"running": 1, "completed": 5}
+        store["done_0"]["status"] = "failed"
+        assert store.count_by_status() == {"running": 1, "completed": 4, "failed": 1}
+        store._invalidate_counts()
+        assert await store.acount_by_status() == {"running": 1, "completed": 4, "failed": 1}
+
+        # 按字节数淘汰
+        store.max_bytes = 1500
+        store.evict()
+        assert list(store._hot) == ["running", "done_0"]
+
+        # 序列化大小按版本号缓存：版本不变时不重新序列化，任务变化（版本递增）后重新计算
+        size = store._size("running")
+        store["running"]["logs"].append("y" * 100)
+        assert store._size("running") == size
+        store["running"]["version"] = 1
+        assert store._size("running") > size
+
+        del store["done_1"]
+        assert "done_1" not in store
+        assert store.count_by_status() == {"running": 1, "completed": 3, "failed": 1} and len(store) == 5
+
+        # 异步删除在后台线程中进行，不存在的任务同样报 KeyError
+        await store.adelete("done_2")
+        assert "done_2" not in store and len(store) == 4
+        try:
+            await store.adelete("done_2")
+            assert False, "重复删除应报 KeyError"
+        except KeyError:
+            pass
+        await store.drain()
+    print("✓ LRU 淘汰、落盘与透明读取")
+
+    # 分页查询同时覆盖热层与已落盘的任务
+    with tempfile.TemporaryDirectory() as tmp:
+        store = TaskStore(db_path=Path(tmp) / "tasks.db", max_tasks=5)
+        for i in range(12):
+            store[f"t{i:02d}"] = {"id": f"t{i:02d}", "agent_type": "elon" if i % 2 else "henry",
+                                  "status": "completed" if i < 10 else "running",
+                                  "start_time": f"2025-01-01T00:00:{i:02d}"}
+        await store.drain()
+        seen, cursor = [], None
+        while True:
+            page, cursor = store.query(limit=4, cursor=cursor)
+            seen += [task["id"] for task in page]
+            if not cursor:
+                break
+        assert seen == [f"t{i:02d}" for i in range(11, -1, -1)]
+
+        # 异步查询（已落盘部分在线程中查询）与同步查询结果一致
+        assert await store.aquery(limit=4, status=["completed"]) == store.query(limit=4, status=["completed"])
+
+        page, _ = store.query(agent_type="elon", status=["completed"], limit=3, descending=False)
+        assert [task["id"] for task in page] == ["t01", "t03", "t05"]
+        page, _ = store.query(since="2025-01-01T00:00:10")
+        assert [task["id"] for task in page] == ["t11", "t10"]
+
+        # 格式不正确的游标统一报 ValueError（接口返回 Invalid cursor 而不是 500）
+        import base64
+        for raw in ('123', 'null', '{"a": 1, "b": 2}', '["x"]', '["x", 1]', 'not json'):
+            bad = base64.urlsafe_b64encode(raw.encode()).decode()
+            try:
+                store.query(cursor=bad)
+                assert False, raw
+            except ValueError:
+                pass
+        for bad in ("%%%", "游标"):
+            try:
+                store.query(cursor=bad)
+                assert False, bad
+            except ValueError:
+                pass
+    print("✓ 游标分页与过滤")
+
+    print("\n✅ 任务存储测试通过\n")
+    return True
+
+async def test_broadcaster():
+    """测试WebSocket主题广播与慢客户端处理"""
+    print("=" * 60)
+    print("测试14: WebSocket广播")
+    print("=" * 60)
+
+    from core.broadcaster import Broadcaster, Client, task_topic, agent_topic
+
+    received = {"fast": [], "slow": []}
+    gate = asyncio.Event()
+
+    async def fast_send(message):
+        received["fast"].append(json.loads(message))
+
+    async def slow_send(message):
+        await gate.wait()
+        received["slow"].append(json.loads(message))
+
+    hub = Broadcaster()
+    fast = hub.connect("fast", fast_send, topics=[task_topic("t1")])
+    slow = hub.connect("slow", slow_send, topics=[agent_topic("elon")])
+    slow.queue_size = 5
+
+    # 慢客户端不阻塞发布方，超出队列上限时丢弃最旧的消息
+    for i in range(20):
+        hub.publish([task_topic("t1"), agent_topic("elon")], {"type": "log", "n": i})
+    # 连续的进度更新只保留最新一条
+    for progress in range(10, 100, 10):
+        hub.publish([task_topic("t1"), agent_topic("elon")], {"type": "progress", "progress": progress},
+                    coalesce_key="progress:t1")
+    await asyncio.sleep(0.01)
+    gate.set()
+    await asyncio.sleep(0.01)
+
+    fast_logs = [m["n"] for m in received["fast"] if m["type"] == "log"]
+    slow_logs = [m["n"] for m in received["slow"] if m["type"] == "log"]
+    print(f"\n✓ 快客户端收到 {len(received['fast'])} 条，慢客户端收到 {len(received['slow'])} 条，丢弃 {slow.dropped} 条")
+    assert fast_logs == list(range(20))
+    assert slow_logs == sorted(slow_logs) and slow_logs[-1] == 19 and slow.dropped > 0
+    assert [m["progress"] for m in received["slow"] if m["type"] == "progress"] == [90]
+
+    # disconnect 策略：队列满时断开慢客户端
+    closed = []
+
+    async def never_send(message):
+        await asyncio.Event().wait()
+
+    async def on_close():
+        closed.append(True)
+
+    stuck = hub.connect("stuck", never_send, on_close, topics=["global"])
+    stuck.policy, stuck.queue_size = "disconnect", 2
+    for i in range(5):
+        hub.publish(["global"], {"type": "log", "n": i})
+    await asyncio.sleep(0.01)
+    hub.publish(["global"], {"type": "log", "n": 5})
+    assert closed and "stuck" not in hub.clients
+    print("✓ 慢客户端按策略断开")
+
+    for client in list(hub.clients.values()):
+        hub.disconnect(client)
+    assert not hub.subscribers
+
+    print("\n✅ WebSocket广播测试通过\n")
+    return True
+
+async def test_task_feed():
+    """测试任务版本增量与长轮询"""
+    print("=" * 60)
+    print("测试15: 任务状态增量")
+    print("=" * 60)
+
+    from core.task_feed import TaskFeed
+
+    feed = TaskFeed(history_size=4)
+    task = {"id": "t_feed", "status": "pending", "progress": 0.0, "logs": [], "outputs": {}}
+    v1 = feed.touch(task)
+
+    # 版本未知时返回完整状态
+    full = feed.delta(task, 0)
+    assert full["full"] and full["version"] == v1 == 1
+
+    task["status"] = "running"
+    task["logs"].append({"message": "started"})
+    v2 = feed.touch(task)
+    delta = feed.delta(task, v1)
+    print(f"\n✓ 版本 {v1} -> {v2} 的增量: {delta['changes']}，新增日志 {len(delta['logs'])} 条")
+    assert not delta["full"] and delta["changes"] == {"status": "running"} and len(delta["logs"]) == 1
+    assert feed.delta(task, v2)["changes"] == {} and feed.delta(task, v2)["logs"] == []
+
+    # 长轮询：无变化时等待，任务变化后立即返回
+    async def update_later():
+        await asyncio.sleep(0.02)
+        task["progress"] = 50.0
+        feed.touch(task)
+
+    asyncio.create_task(update_later())
+    assert await feed.wait("t_feed", v2, task["version"], timeout=1)
+    assert feed.delta(task, v2)["changes"] == {"progress": 50.0}
+    assert not await feed.wait("t_feed", task["version"], task["version"], timeout=0.01)
+    assert not feed._waiters and not feed._waiting
+    print("✓ 长轮询等待版本变化")
+
+    # 版本早于保留的历史时退回完整状态
+    for _ in range(5):
+        feed.touch(task)
+    assert feed.delta(task, v2)["full"]
+
+    # 只有状态变化（以及新增、删除任务）才递增状态版本，仪表盘据此重新生成
+    status_revision = feed.status_revision
+    task["progress"] = 80.0
+    feed.touch(task)
+    assert feed.status_revision == status_revision
+    task["status"] = "completed"
+    feed.touch(task)
+    feed.forget("t_feed")
+    assert feed.status_revision == status_revision + 2
+
+    # 合并执行中的别名任务：按执行中任务的变化返回增量
+    feed = TaskFeed()
+    leader = {"id": "t_leader", "status": "running", "progress": 10.0, "logs": [], "outputs": {}}
+    alias = {"id": "t_alias", "status": "pending", "progress": 0.0, "logs": [], "outputs": {}}
+    feed.touch(leader)
+    alias_version = feed.touch(alias)
+    alias["coalesced_with"] = "t_leader"
+
+    view, key = feed.view(alias, leader)
+    assert view["status"] == "running" and view["progress"] == 10.0 and view["version"] > alias_version
+    first = feed.delta(view, alias_version, key)
+    assert first["full"] and first["changes"]["progress"] == 10.0
+
+    async def leader_progress():
+        await asyncio.sleep(0.02)
+        leader["progress"] = 60.0
+        leader["current_node"] = "draft"
+        feed.touch(leader)
+
+    asyncio.create_task(leader_progress())
+    assert await feed.wait("t_leader", first["version"], view["version"], timeout=1)
+    view, key = feed.view(alias, leader)
+    delta = feed.delta(view, first["version"], key)
+    assert not delta["full"] and delta["changes"] == {"progress": 60.0, "current_node": "draft"}
+    assert delta["version"] == first["version"] + 1
+    assert feed.delta(view, delta["version"], key)["changes"] == {}
+
+    # 结果同步到别名后，别名版本大于所有视图版本，客户端取回完整的最终状态
+    leader.update(status="completed", progress=100.0)
+    feed.touch(leader)
+    view, key = feed.view(alias, leader)
+    alias.update(status="completed", progress=100.0, outputs={"text": "done"})
+    final = feed.touch(alias, version=alias["version"] + leader["version"] + 1)
+    assert final > view["version"]
+    result = feed.delta(alias, view["version"])
+    assert result["full"] and result["changes"]["outputs"] == {"text": "done"}
+    print("✓ 别名任务跟随执行中任务的增量")
+
+    print("\n✅ 任务状态增量测试通过\n")
+    return True
+
+async def test_snapshot_cache():
+    """测试快照缓存与ETag"""
+    print("=" * 60)
+    print("测试16: 快照缓存")
+    print("=" * 60)
+
+    from core.snapshot_cache import SnapshotCache, etag_matches
+
+    state = {"version": 1, "builds": 0}
+
+    def build():
+        state["builds"] += 1
+        return {"tasks": state["version"]}
+
+    cache = SnapshotCache("test", build, version=lambda: state["version"], ttl=60)
+    body, etag = cache.get()
+    assert cache.get() == (body, etag) and state["builds"] == 1
+    assert etag.startswith('"') and etag_matches(etag, etag) and etag_matches(f'"x", W/{etag}', etag)
+    assert not etag_matches(None, etag) and not etag_matches('"other"', etag)
+
+    state["version"] = 2
+    new_body, new_etag = cache.get()
+    print(f"\n✓ 版本变化后重新生成: {etag} -> {new_etag}")
+    assert state["builds"] == 2 and new_etag != etag
+
+    # 内容不变时 ETag 不变（客户端仍可得到 304）
+    state["version"] = 3
+    state["builds"] = 0
+    cache.build = lambda: {"tasks": 2}
+    assert cache.get()[1] == new_etag
+
+    # 异步生成：build 为协程函数，版本未变时不重新生成
+    async def abuild():
+        state["builds"] += 1
+        await asyncio.sleep(0)
+        return {"tasks": state["version"]}
+
+    state["builds"] = 0
+    async_cache = SnapshotCache("test_async", abuild, version=lambda: state["version"], ttl=60)
+    assert await async_cache.aget() == await async_cache.aget() and state["builds"] == 1
+    state["version"] = 4
+    assert (await async_cache.aget())[1] != new_etag and state["builds"] == 2
+    print("✓ 异步生成快照")
+
+    print("\n✅ 快照缓存测试通过\n")
+    return True
+
+async def test_compression():
+    """测试响应压缩与预压缩静态资源"""
+    print("=" * 60)
+    print("测试17: 响应压缩")
+    print("=" * 60)
+
+    import gzip
+    import tempfile
+    from pathlib import Path
+    from core.compression import CompressionMiddleware
+    from core.static_assets import IMMUTABLE, StaticAssets
+
+    def make_app(content_type, chunks):
+        async def app(scope, receive, send):
+            await send({"type": "http.response.start", "status": 200,
+                        "headers": [(b"content-type", content_type.encode())]})
+            for i, chunk in enumerate(chunks):
+                await send({"type": "http.response.body", "body": chunk, "more_body": i < len(chunks) - 1})
+        return app
+
+    async def call(app, accept="gzip"):
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {"type": "http", "headers": [(b"accept-encoding", accept.encode())]}
+        await CompressionMiddleware(app, minimum_size=100)(scope, None, send)
+        headers = dict(sent[0]["headers"])
+        return headers, b"".join(m.get("body", b"") for m in sent[1:])
+
+    body = json.dumps({"outputs": "代码" * 2000}, ensure_ascii=False).encode()
+    headers, data = await call(make_app("application/json", [body]))
+    print(f"\n✓ JSON 响应 {len(body)} -> {len(data)} 字节")
+    assert headers[b"content-encoding"] == b"gzip" and gzip.decompress(data) == body
+    assert int(headers[b"content-length"]) == len(data)
+
+    # 小响应、事件流与不接受压缩的客户端原样返回
+    assert b"content-encoding" not in (await call(make_app("application/json", [b"{}"])))[0]
+    headers, data = await call(make_app("text/event-stream", [b"data: 1\n\n", b"data: 2\n\n"]))
+    assert b"content-encoding" not in headers and data == b"data: 1\n\ndata: 2\n\n"
+    assert b"content-encoding" not in (await call(make_app("application/json", [body]), accept="identity"))[0]
+
+    # 流式响应逐块压缩
+    headers, data = await call(make_app("text/plain", [b"a" * 500, b"b" * 500]))
+    assert gzip.decompress(data) == b"a" * 500 + b"b" * 500 and b"content-length" not in headers
+    print("✓ 事件流与小响应不压缩，流式响应逐块压缩")
+
+    # 压缩版本使用带编码后缀的 ETag，小响应同样声明 Vary；客户端缓存压缩版本时 304 返回相同的 ETag
+    from core.compression import encoded_etag
+    from core.snapshot_cache import etag_matches
+
+    def etag_app(status, chunks):
+        async def app(scope, receive, send):
+            await send({"type": "http.response.start", "status": status,
+                        "headers": [(b"content-type", b"application/json"), (b"etag", b'"abc"')]})
+            for i, chunk in enumerate(chunks):
+                await send({"type": "http.response.body", "body": chunk, "more_body": i < len(chunks) - 1})
+        return app
+
+    headers, _ = await call(etag_app(200, [body]))
+    assert headers[b"etag"] == b'"abc-gzip"' and headers[b"vary"] == b"Accept-Encoding"
+    headers, _ = await call(etag_app(200, [b"{}"]))
+    assert headers[b"etag"] == b'"abc"' and headers[b"vary"] == b"Accept-Encoding"
+
+    sent = []
+
+    async def capture(message):
+        sent.append(message)
+
+    scope = {"type": "http", "headers": [(b"accept-encoding", b"gzip"), (b"if-none-match", b'"abc-gzip"')]}
+    await CompressionMiddleware(etag_app(304, [b""]), minimum_size=100)(scope, None, capture)
+    assert dict(sent[0]["headers"])[b"etag"] == b'"abc-gzip"'
+    assert encoded_etag('W/"abc"', "br") == 'W/"abc"'
+    assert etag_matches('"abc-gzip"', '"abc"') and etag_matches('W/"abc-br"', '"abc"')
+    assert not etag_matches('"abd-gzip"', '"abc"')
+    print("✓ 压缩版本使用独立的 ETag")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        (Path(tmp) / "assets").mkdir()
+        (Path(tmp) / "index.html").write_text("<html>" + "x" * 2000 + "</html>")
+        (Path(tmp) / "assets" / "index-kSR8lncJ.js").write_text("console.log(1);" * 200)
+        assets = StaticAssets(Path(tmp))
+        assert assets.load() == 2
+        script = assets.get("/assets/index-kSR8lncJ.js")
+        assert script.cache_control == IMMUTABLE and assets.get("index.html").cache_control == "no-cache"
+        data, encoding = script.variant("gzip, deflate")
+        assert encoding == "gzip" and gzip.decompress(data) == script.body
+        assert script.variant("identity") == (script.body, None)
+    print("✓ 静态资源预压缩与 immutable 缓存")
+
+    print("\n✅ 响应压缩测试通过\n")
+    return True
+
+async def test_shared_state():
+    """测试跨进程共享任务记录与事件"""
+    print("=" * 60)
+    print("测试18: 跨进程共享状态")
+    print("=" * 60)
+
+    from core.broadcaster import broadcaster, task_topic
+    from core.memory_redis import MemoryRedis
+    import tempfile
+    from pathlib import Path
+    from core.metrics import metrics
+    from core.shared_state import SharedState
+    from core.task_feed import task_feed
+    from core.task_store import TaskStore, task_store
+
+    # 同一个 Redis（替身）上的两个进程：local 接入本进程的全局对象，remote 模拟另一个 worker
+    server = MemoryRedis()
+    local = SharedState(server, prefix="test", flush_interval=0.001)
+    remote = SharedState(server, prefix="test")
+    local.start()
+    await asyncio.sleep(0.05)
+
+    received = []
+
+    async def collect(message):
+        received.append(json.loads(message))
+
+    client = broadcaster.connect("test_shared", collect, topics=[task_topic("t_remote")])
+    try:
+        # 另一个 worker 上的任务变化
+        task = {"id": "t_remote", "agent_type": "elon", "status": "running", "progress": 40.0, "version": 3, "logs": []}
+        remote.save_task(task)
+        remote.relay((task_topic("t_remote"),), json.dumps({"type": "progress", "task_id": "t_remote", "progress": 40.0}))
+        waiting = asyncio.create_task(task_feed.wait("t_remote", 3, 3, timeout=2))
+        remote.flush()
+
+        assert await waiting
+        await asyncio.sleep(0.05)
+        print(f"\n✓ 收到其他 worker 的事件: {received}")
+        assert received == [{"type": "progress", "task_id": "t_remote", "progress": 40.0}]
+
+        # 本进程查不到的任务从共享状态读取（只读副本，不进入热层）
+        assert "t_remote" in task_store and task_store["t_remote"]["progress"] == 40.0
+        assert "t_remote" not in task_store._hot
+
+        # 异步读取在线程中查询，每次只读一次共享状态
+        reads = metrics.get("shared_state_task_reads_total", found="true")
+        copy = await task_store.aget("t_remote")
+        assert copy["progress"] == 40.0 and "t_remote" not in task_store._hot
+        assert metrics.get("shared_state_task_reads_total", found="true") == reads + 1
+        assert await task_store.aget("t_missing", "default") == "default"
+
+        # 已落盘的任务异步读取后加载回热层
+        with tempfile.TemporaryDirectory() as tmp:
+            store = TaskStore(db_path=Path(tmp) / "tasks.db", max_tasks=1)
+            store["old"] = {"id": "old", "agent_type": "echo", "status": "completed"}
+            store["new"] = {"id": "new", "agent_type": "echo", "status": "running"}
+            await store.drain()
+            assert "old" not in store._hot
+            assert (await store.aget("old"))["status"] == "completed" and "old" in store._hot
+        print("✓ 异步读取不阻塞事件循环")
+
+        # 本进程的任务变化批量写入共享状态
+        local_task = {"id": "t_local", "agent_type": "echo", "status": "running", "progress": 0.0, "logs": []}
+        for progress in (10.0, 20.0, 30.0):
+            local_task["progress"] = progress
+            task_feed.touch(local_task)
+        await asyncio.sleep(0.05)
+        assert remote.load_task("t_local")["progress"] == 30.0
+        print("✓ 任务记录跨进程可见")
+
+        del task_store["t_remote"]
+        assert remote.load_task("t_remote") is None
+    finally:
+        broadcaster.disconnect(client)
+        await local.stop()
+    assert task_store.remote is None and broadcaster.relay is None
+
+    # 事件监听连接出错后按退避间隔重连
+    class FlakyRedis(MemoryRedis):
+        failures = 2
+
+        def pubsub(self):
+            if self.failures:
+                self.failures -= 1
+                raise ConnectionError("redis unavailable")
+            return super().pubsub()
+
+    flaky = FlakyRedis()
+    listener = SharedState(flaky, prefix="test", flush_interval=0.001, backoff_min=0.01, backoff_max=0.02)
+    listener.start()
+    try:
+        for _ in range(200):
+            if listener.listening:
+                break
+            await asyncio.sleep(0.01)
+        assert listener.status()["listening"] and listener.reconnects == 2
+        assert metrics.get("shared_state_listener_up") == 1
+
+        publisher = SharedState(flaky, prefix="test")
+        publisher.relay((task_topic("t_flaky"),), json.dumps({"type": "progress", "task_id": "t_flaky"}))
+        waiting = asyncio.create_task(task_feed.wait("t_flaky", 0, 0, timeout=2))
+        await asyncio.sleep(0.01)
+        publisher.flush()
+        assert await waiting
+    finally:
+        await listener.stop()
+    assert not listener.listening and metrics.get("shared_state_listener_up") == 0
+    print(f"✓ 监听断开后重连: {listener.status()}")
+
+    # 写入失败的任务与事件放回队列，退避后重试
+    from core.memory_redis import MemoryPipeline
+
+    class FailingPipeline(MemoryPipeline):
+        def execute(self):
+            if self._server.write_failures:
+                self._server.write_failures -= 1
+                self._commands = []
+                raise ConnectionError("redis unavailable")
+            return super().execute()
+
+    class FailingWrites(MemoryRedis):
+        write_failures = 2
+
+        def pipeline(self, transaction=False):
+            return FailingPipeline(self)
+
+    failing = FailingWrites()
+    subscriber = failing.pubsub()
+    subscriber.subscribe("test:events")
+    writer = SharedState(failing, prefix="test", flush_interval=0.001, backoff_min=0.01, backoff_max=0.02)
+    writer.start()
+    try:
+        record = {"id": "t_retry", "agent_type": "echo", "status": "running", "progress": 10.0, "logs": []}
+        writer.save_task(record)
+        writer.relay(("global",), json.dumps({"type": "first"}))
+        await asyncio.sleep(0.005)
+        record["progress"] = 20.0
+        writer.save_task(record)
+        writer.relay(("global",), json.dumps({"type": "second"}))
+        for _ in range(200):
+            if failing.get("test:task:t_retry"):
+                break
+            await asyncio.sleep(0.01)
+        assert failing.write_failures == 0
+        assert json.loads(failing.get("test:task:t_retry"))["progress"] == 20.0
+        events = []
+        while (message := subscriber.get_message(timeout=0.1)) is not None:
+            events.append(json.loads(json.loads(message["data"])["payload"])["type"])
+        assert events == ["first", "second"]
+    finally:
+        subscriber.close()
+        await writer.stop()
+    print("✓ 写入失败后重试，任务与事件不丢失")
+
+    print("\n✅ 跨进程共享状态测试通过\n")
+    return True
+
+async def test_job_queue():
+    """测试持久化任务队列与 worker 执行"""
+    print("=" * 60)
+    print("测试19: 持久化任务队列")
+    print("=" * 60)
+
+    import tempfile
+    import threading
+    import time
+    from datetime import datetime
+    from pathlib import Path
+    from core.job_queue import JobPending, JobQueue, QueueFull
+    from core.job_workers import JobWorker, WorkerPool
+    from core.task_feed import task_feed
+    from core.task_store import task_store
+
+    with tempfile.TemporaryDirectory() as tmp:
+        queue = JobQueue(db_path=Path(tmp) / "jobs.db", visibility_timeout=0.05, max_attempts=2, max_depth=3)
+
+        # 按优先级、同优先级先进先出领取
+        for task_id, priority in (("j1", 1), ("j2", 2), ("j3", 0)):
+            queue.enqueue(task_id, "echo", {"task": {"id": task_id}}, priority=priority)
+        assert [queue.position(task_id) for task_id in ("j3", "j1", "j2")] == [1, 2, 3]
+        try:
+            queue.enqueue("j4", "echo", {})
+            assert False, "队列已满时应拒绝"
+        except QueueFull:
+            pass
+        try:
+            queue.enqueue("j1", "echo", {})
+            assert False, "仍在队列中的任务不能重复入队"
+        except JobPending:
+            pass
+        first = queue.claim("w1")
+        assert first["task_id"] == "j3" and first["attempts"] == 1
+        print("\n✓ 按优先级领取")
+
+        # 租约到期未续期时重新可见，原 worker 不能再结束该任务
+        await asyncio.sleep(0.1)
+        redelivered = queue.claim("w2")
+        assert redelivered["task_id"] == "j3" and redelivered["attempts"] == 2
+        assert queue.extend("w1", [first["id"]]) == [] and queue.extend("w2", [first["id"]]) == [first["id"]]
+        assert queue.report([("j3", "task", "{}")], worker_id="w1") == 0
+        assert not queue.complete(first["id"], "w1", reports=[("j3", "done", "{}")])
+        assert queue.complete(redelivered["id"], "w2", reports=[("j3", "done", json.dumps({"status": "completed"}))])
+        assert not queue.is_pending("j3")
+        print("✓ 租约到期后重新投递，原 worker 的回报被丢弃")
+
+        # 续租失败的 worker 立即停止执行该任务并丢弃未写出的回报
+        queue.enqueue("j5", "echo", {"task": {"id": "j5"}}, priority=0)
+        stalled = JobWorker(queue, "w3")
+        stalled.reporter.start()
+        job = queue.claim("w3")
+        stalled.jobs[job["id"]] = job
+        stalled.active[job["id"]] = asyncio.create_task(asyncio.sleep(10))
+        await asyncio.sleep(0.1)
+        queue.claim("w4")
+        stalled.reporter.save_task({"id": "j5", "status": "running"})
+        await stalled.renew()
+        await asyncio.sleep(0)
+        assert stalled.active[job["id"]].cancelled() and job["id"] in stalled.lost
+        await stalled.reporter.stop()
+        assert [kind for _, kind, _ in queue.take_reports()] == ["done"]  # 只有 j3 的结束回报
+        queue.complete(job["id"], "w4")
+        print("✓ 租约丢失后停止执行")
+
+        # 超过最多领取次数的任务被放弃并回报失败
+        queue.claim("w1")
+        await asyncio.sleep(0.1)
+        queue.claim("w1")
+        await asyncio.sleep(0.1)
+        assert queue.claim("w1")["task_id"] == "j2"
+        assert queue.stats()["running_by_agent"] == {"echo": 1}
+        reports = queue.take_reports()
+        assert [(task_id, kind) for task_id, kind, _ in reports] == [("j1", "done")]
+        assert "abandoned" in json.loads(reports[0][2])["error"] and queue.take_reports() == []
+        print(f"✓ 放弃多次失败的任务: {queue.stats()}")
+
+        # 各Agent的并发上限在所有 worker 之间共享：已达上限的Agent的任务留在队列中
+        limited = JobQueue(db_path=Path(tmp) / "limits.db")
+        for task_id, agent_type in (("l1", "elon"), ("l2", "elon"), ("l3", "henry")):
+            limited.enqueue(task_id, agent_type, {"task": {"id": task_id}})
+        limits = {"elon": 1}
+        assert limited.claim("w1", limits)["task_id"] == "l1"
+        assert limited.claim("w2", limits)["task_id"] == "l3"
+        assert limited.claim("w1", limits) is None
+        assert limited.claim("w1")["task_id"] == "l2"
+        print("✓ 队列模式按Agent限制并发")
+
+        # worker 执行工作流，API 进程处理回报后更新任务记录并广播结束
+        queue = JobQueue(db_path=Path(tmp) / "worker.db")
+        pool = WorkerPool(queue, size=0)
+        finished = []
+        pool.on_done = finished.append
+        task_id = f"t_job_{os.getpid()}_{int(time.time() * 1000)}"
+        task = {"id": task_id, "agent_type": "echo", "message": "优化系统性能", "status": "pending",
+                "progress": 0.0, "start_time": datetime.now().isoformat(), "logs": [], "outputs": {}}
+        task_store[task_id] = task
+        task_feed.touch(task)
+        assert await pool.submit(task, task["message"]) == 1
+        waiting = asyncio.create_task(pool.wait(task_id))
+
+        stop = threading.Event()
+        worker = JobWorker(queue, "test-worker", concurrency=2, stop_event=stop, poll_interval=0.01)
+        running = asyncio.create_task(worker.run())
+        for _ in range(500):
+            if queue.stats()["completed"]:
+                break
+            await asyncio.sleep(0.01)
+        stop.set()
+        await running
+
+        worker_version = None
+        reports = queue.take_reports()
+        for _, kind, data in reports:
+            if kind == "task":
+                worker_version = json.loads(data)["version"]
+        pool.apply(reports)
+        assert await asyncio.wait_for(waiting, 1) == "completed"
+        assert finished == [task_id]
+        assert task_store[task_id] is task and task["status"] == "completed" and task["version"] == worker_version
+        assert task["nodes"] and task["progress"] == 100.0
+        print(f"✓ worker 执行完成: {len(reports)} 条回报, 版本 {task['version']}")
+
+        # 结束回报被其他 API 进程取走时，等待方从队列中保存的最终记录得到结果
+        task["status"] = "pending"
+        other = WorkerPool(queue, size=0)
+        assert await asyncio.wait_for(other.wait(task_id, recheck=0.01), 1) == "completed"
+        assert task["status"] == "completed" and not other._waiters
+        del task_store[task_id]
+
+    print("\n✅ 持久化任务队列测试通过\n")
+    return True
+
+async def test_workflow_fork():
+    """测试派生任务：受影响节点计算与检查点复用"""
+    print("=" * 60)
+    print("测试20: 派生任务")
+    print("=" * 60)
+
+    import tempfile
+    from pathlib import Path
+    from core.checkpoint_store import CheckpointStore
+    from core.dag_scheduler import DAGWorkflow, NodeSpec
+
+    executed = []
+
+    def node(name, key, source):
+        async def run(state):
+            executed.append(name)
+            return {key: f"{name}({state.get(source)})"}
+        return run
+
+    workflow = DAGWorkflow('fork', [
+        NodeSpec('outline', node('outline', 'outline', 'task'), reads=('task',), writes=('outline',)),
+        NodeSpec('style', node('style', 'style', 'tone'), reads=('tone',), writes=('style',)),
+        NodeSpec('draft', node('draft', 'draft', 'outline'), reads=('outline', 'style'), writes=('draft',)),
+        NodeSpec('review', node('review', 'review', 'draft'), reads=('draft',), writes=('review',)),
+    ])
+    dag = workflow.dag
+
+    # 覆盖字段只影响读取它的节点及其下游；指定节点输入时重算该节点及其下游
+    assert dag.affected_nodes(['tone']) == {'style', 'draft', 'review'}
+    assert dag.affected_nodes(['task']) == {'outline', 'draft', 'review'}
+    assert dag.affected_nodes([], ['draft']) == {'draft', 'review'}
+    assert dag.affected_nodes(['unknown'], ['missing']) == set()
+    print("\n✓ 受影响节点计算正确")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = CheckpointStore(db_path=Path(tmp) / "checkpoints.db")
+        parent = {'task': '生成文档', 'tone': '正式', 'task_id': 'parent'}
+        state, _ = await workflow.run(parent, checkpointer=store)
+        assert sorted(executed) == ['draft', 'outline', 'review', 'style']
+
+        # 派生：只改语气，复用 outline 的检查点
+        overrides = {'tone': '轻松'}
+        affected = dag.affected_nodes(overrides)
+        reused = [name for name in dag.order if name not in affected]
+        store.copy_nodes('parent', 'fork', reused, strip_keys=list(overrides))
+        executed.clear()
+        forked, report = await workflow.run({**parent, **overrides, 'task_id': 'fork'}, checkpointer=store)
+        print(f"  复用: {report.restored}, 重算: {executed}")
+        assert report.restored == ['outline'] and sorted(executed) == ['draft', 'review', 'style']
+        assert forked['outline'] == state['outline'] and forked['style'] == 'style(轻松)'
+        assert forked['draft'] == 'draft(outline(生成文档))'
+    print("✓ 未受影响的节点复用原任务检查点")
+
+    # 派生请求与新任务一样经过安全与目标对齐检查
+    from core.agents import check_fork_request
+    assert check_fork_request("t_fork", "echo", "优化系统性能", {}, {"draft": "语气更轻松"}) is None
+    assert check_fork_request("t_fork", "echo", "优化系统性能", {}, {"draft": "攻击服务器"})
+    assert check_fork_request("t_fork", "echo", "随便聊聊天气怎么样", {"task": "随便聊聊天气怎么样"}, {})
+    print("✓ 派生请求的覆盖内容经过安全检查")
+
+    print("\n✅ 派生任务测试通过\n")
+    return True
+
+async def test_prompt_budget():
+    """测试提示词预算：各压缩策略"""
+    print("=" * 60)
+    print("测试21: 提示词预算")
+    print("=" * 60)
+
+    import json
+    from core.metrics import metrics
+    from core.prompt_budget import PromptBuilder, estimate_tokens, summary_cache
+
+    # json: 架构设计精简后仍是合法JSON，且保留全部键
+    architecture = {
+        "modules": [{"name": f"module_{i}", "description": "负责处理请求与缓存。" * 20} for i in range(30)],
+        "database": {"engine": "sqlite", "tables": ["tasks", "runs", "checkpoints"]},
+        "api": "REST " * 200,
+    }
+    builder = PromptBuilder('coder_execute', budgets={'architecture': 400})
+    text = await builder.section('architecture', json.dumps(architecture, ensure_ascii=False, indent=2), 'json')
+    compacted = json.loads(text)
+    assert set(compacted) == set(architecture) and compacted["database"]["engine"] == "sqlite"
+    assert compacted["modules"][0]["name"] == "module_0"
+    assert estimate_tokens(text) <= 400
+    print(f"\n✓ json: {builder.stats[0]['tokens']} -> {builder.stats[0]['compacted_tokens']} tokens，键结构保留")
+
+    # truncate: 代码保留首尾，函数体不会被整段剥离
+    code = "def handler(request):\n" + "    total = compute(request)\n" * 400 + "    return total\n"
+    builder = PromptBuilder('qa_test', budgets={'code': 200})
+    text = await builder.section('code', code, 'truncate')
+    assert text.startswith("def handler(request):\n    total = compute(request)")
+    assert text.rstrip().endswith("return total") and "已省略" in text
+    print("✓ truncate: 保留代码首尾")
+
+    # structure: Markdown 只保留标题与列表；无结构行时退回截断
+    doc = "\n".join(f"## 第{i}节\n- 要点{i}\n" + "正文内容较长。" * 40 for i in range(10))
+    builder = PromptBuilder('writer_create', budgets={'research': 300})
+    text = await builder.section('research', doc, 'structure')
+    assert "## 第0节" in text and "- 要点0" in text and "正文内容较长" not in text
+    plain = await builder.section('research', "没有任何结构的长文本。" * 200, 'structure')
+    assert plain.startswith("没有任何结构的长文本") and "仅保留结构" not in plain
+    print("✓ structure: 提取标题与列表，无结构时退回截断")
+
+    # summarize: 摘要一次并缓存；摘要失败时退回结构提取
+    calls = []
+
+    async def summarizer(text, budget):
+        calls.append(budget)
+        return "摘要：" + text[:50]
+
+    builder = PromptBuilder('writer_create', summarizer=summarizer, budgets={'research': 300})
+    first = await builder.section('research', doc, 'summarize')
+    second = await builder.section('research', doc, 'summarize')
+    assert first == second and first.startswith("摘要：") and len(calls) == 1 and summary_cache.hits >= 1
+
+    async def failing(text, budget):
+        raise RuntimeError("summarizer down")
+
+    builder = PromptBuilder('writer_create', summarizer=failing, budgets={'research': 300})
+    fallback = await builder.section('research', doc + "\n## 附录", 'summarize')
+    assert "## 第0节" in fallback
+    print("✓ summarize: 摘要缓存复用，失败时退回结构提取")
+
+    # 未超预算时原样返回；统计写入指标
+    builder = PromptBuilder('reviewer_check', budgets={'tests': 1000})
+    assert await builder.section('tests', "assert True", 'truncate') == "assert True"
+    assert builder.stats[0]["strategy"] is None
+    assert metrics.get("prompt_compactions_total", node="coder_execute", section="architecture", strategy="json") >= 1
+    assert metrics.get("prompt_tokens_saved_total", node="qa_test", section="code") > 0
+    print("✓ 未超预算原样保留，压缩统计写入指标")
+
+    print("\n✅ 提示词预算测试通过\n")
+    return True
+
+async def test_model_policy():
+    """测试按复杂度分档与质量信号"""
+    print("=" * 60)
+    print("测试22: 模型分档")
+    print("=" * 60)
+
+    from core import model_policy as policy_module
+    from core.model_policy import ModelPolicy
+
+    # 按复杂度分档：简单请求使用快速模型，Coder 始终使用旗舰模型
+    policy = ModelPolicy()
+    assert policy.decide(AgentType.ECHO, "你好").tier == "fast"
+    assert policy.decide(AgentType.CODER, "你好").tier == "flagship"
+    assert not policy.decide(AgentType.CODER, "你好").penalized
+    print("\n✓ 按复杂度分档")
+
+    # 快速模型连续失败后升到旗舰模型
+    for _ in range(5):
+        policy.report_quality(False, policy.decide(AgentType.ECHO, "你好"))
+    decision = policy.decide(AgentType.ECHO, "你好")
+    assert decision.tier == "flagship" and decision.penalized
+    print(f"✓ 失败率 {policy.fast_failure_rate[AgentType.ECHO]:.2f}，升到旗舰模型")
+
+    # 旗舰模型的合格输出让失败率衰减，最终回到快速模型
+    for _ in range(10):
+        decision = policy.decide(AgentType.ECHO, "你好")
+        if decision.tier == "fast":
+            break
+        policy.report_quality(True, decision)
+    assert decision.tier == "fast"
+    print(f"✓ 失败率衰减到 {policy.fast_failure_rate[AgentType.ECHO]:.2f}，回到快速模型")
+
+    # 旗舰模型失败不计入快速模型失败率
+    rate = policy.fast_failure_rate[AgentType.ECHO]
+    policy.report_quality(False, policy.decide(AgentType.ECHO, "你好" * 2000))
+    assert policy.fast_failure_rate[AgentType.ECHO] == rate
+
+    # 升档期间定期用快速模型探测
+    original = policy_module.PROBE_INTERVAL
+    policy_module.PROBE_INTERVAL = 3
+    try:
+        policy = ModelPolicy()
+        policy.fast_failure_rate[AgentType.ECHO] = 1.0
+        tiers = [policy.decide(AgentType.ECHO, "你好").tier for _ in range(6)]
+        assert tiers == ["flagship", "flagship", "fast"] * 2
+        probe = policy.decide(AgentType.ECHO, "你好")
+        while probe.tier != "fast":
+            probe = policy.decide(AgentType.ECHO, "你好")
+        assert "fast probe" in probe.reasons
+        policy.report_quality(True, probe)
+        assert policy.fast_failure_rate[AgentType.ECHO] < 1.0
+    finally:
+        policy_module.PROBE_INTERVAL = original
+    print("✓ 定期快速模型探测")
+
+    # 各节点的输出都反馈质量信号：Writer 缺少要求的段落计为不合格
+    from core.model_policy import last_decision, model_policy
+    from core.workflows import report_output_quality
+
+    saved = dict(model_policy.fast_failure_rate)
+    try:
+        model_policy.fast_failure_rate.pop(AgentType.WRITER, None)
+        model_policy.record(model_policy.decide(AgentType.WRITER, "撰写发布说明"))
+        report_output_quality("**PR描述：**\n新增接口", "PR描述", "Release Notes")
+        assert model_policy.fast_failure_rate[AgentType.WRITER] > 0
+        rate = model_policy.fast_failure_rate[AgentType.WRITER]
+        report_output_quality("**PR描述：**\n新增接口\n**Release Notes：**\n修复", "PR描述", "Release Notes")
+        assert model_policy.fast_failure_rate[AgentType.WRITER] < rate
+    finally:
+        model_policy.fast_failure_rate.clear()
+        model_policy.fast_failure_rate.update(saved)
+        last_decision.set(None)
+    print("✓ 非Echo节点反馈质量信号")
+
+    print("\n✅ 模型分档测试通过\n")
+    return True
+
+async def test_checkpoint_resume():
+    """测试中断工作流的认领与恢复"""
+    print("=" * 60)
+    print("测试23: 中断恢复")
+    print("=" * 60)
+
+    import sqlite3
+    import tempfile
+    from pathlib import Path
+    from core.checkpoint_store import CheckpointStore
+    from core.dag_scheduler import DAGWorkflow, NodeSpec
+
+    executed = []
+    crash = {"on": True}
+
+    def node(name, key, source):
+        async def run(state):
+            if name == "publish" and crash["on"]:
+                raise RuntimeError("进程中断")
+            executed.append(name)
+            return {key: f"{name}({state.get(source)})"}
+        return run
+
+    workflow = DAGWorkflow('resume', [
+        NodeSpec('research', node('research', 'research', 'task'), reads=('task',), writes=('research',)),
+        NodeSpec('draft', node('draft', 'draft', 'research'), reads=('research',), writes=('draft',)),
+        NodeSpec('publish', node('publish', 'published', 'draft'), reads=('draft',), writes=('published',)),
+    ])
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = Path(tmp) / "checkpoints.db"
+        # 进程A执行到第三个节点时中断，工作流仍为 running
+        crashed = CheckpointStore(db_path=db_path, lease=0.05)
+        initial_state = {"task": "生成周报", "task_id": "t_resume"}
+        crashed.start_run("t_resume", "writer", "生成周报", initial_state)
+        try:
+            await workflow.run(initial_state, checkpointer=crashed)
+            assert False, "应当中断"
+        except RuntimeError:
+            pass
+        assert executed == ["research", "draft"]
+
+        # 租约未过期时不视为中断
+        worker_b = CheckpointStore(db_path=db_path)
+        worker_c = CheckpointStore(db_path=db_path)
+        assert worker_b.list_interrupted_runs() == [] and not worker_b.claim_run("t_resume")
+
+        # 租约过期后，多个进程同时认领只有一个成功
+        await asyncio.sleep(0.1)
+        assert [run["task_id"] for run in worker_c.list_interrupted_runs()] == ["t_resume"]
+        claims = await asyncio.gather(asyncio.to_thread(worker_b.claim_run, "t_resume"),
+                                      asyncio.to_thread(worker_c.claim_run, "t_resume"))
+        assert sorted(claims) == [False, True]
+        owner = worker_b if claims[0] else worker_c
+        other = worker_c if claims[0] else worker_b
+        assert owner.get_run("t_resume")["owner"] == owner.owner
+        assert other.list_interrupted_runs() == []
+        print(f"\n✓ 并发认领结果: {claims}")
+
+        # 认领成功的进程从检查点继续，已完成的节点不再执行
+        crash["on"] = False
+        executed.clear()
+        run = owner.get_run("t_resume")
+        state, report = await workflow.run(run["initial_state"], checkpointer=owner)
+        owner.finish_run("t_resume", "completed")
+        assert executed == ["publish"] and report.restored == ["research", "draft"]
+        assert state["published"] == "publish(draft(research(生成周报)))"
+        print(f"✓ 恢复执行: 复用 {report.restored}，重算 {executed}")
+
+        # 续租只针对本进程执行中的工作流；正常退出时释放租约，其他进程可立即认领
+        owner.start_run("t_next", "writer", "生成月报", {"task": "生成月报"})
+        assert owner.renew_runs() == 1 and other.renew_runs() == 0
+        assert not other.claim_run("t_next")
+        owner.release_runs()
+        assert other.claim_run("t_next")
+        print("✓ 续租与释放")
+
+        # 手动恢复失败的工作流同样需要认领，并发请求只有一个成功；已完成的工作流不能认领
+        other.finish_run("t_next", "failed")
+        claims = await asyncio.gather(asyncio.to_thread(owner.claim_run, "t_next"),
+                                      asyncio.to_thread(other.claim_run, "t_next"))
+        assert sorted(claims) == [False, True]
+        assert not owner.claim_run("t_resume")
+        print("✓ 手动恢复失败的工作流需认领")
+
+        # 结束超过保留时长的工作流连同检查点一起清理，执行中的工作流不受影响
+        conn = sqlite3.connect(db_path)
+        conn.execute("UPDATE workflow_runs SET updated_at = datetime('now', '-8 days')")
+        conn.commit()
+        conn.close()
+        other.finish_run("t_next", "running")
+        assert owner.prune_runs() == 1
+        assert owner.get_run("t_resume") is None and owner.load_nodes("t_resume") == {}
+        assert owner.get_run("t_next") is not None
+        print("✓ 清理过期检查点")
+
+    # 旧版本数据库自动补齐 owner / lease_until 字段，遗留的运行记录可以直接认领
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = Path(tmp) / "checkpoints.db"
+        conn = sqlite3.connect(db_path)
+        conn.execute("""
+            CREATE TABLE workflow_runs (
+                task_id TEXT PRIMARY KEY, agent_type TEXT NOT NULL, message TEXT NOT NULL,
+                initial_state TEXT NOT NULL, status TEXT DEFAULT 'running',
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP, updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        conn.execute("INSERT INTO workflow_runs (task_id, agent_type, message, initial_state) VALUES ('t_old', 'echo', 'hi', '{}')")
+        conn.commit()
+        conn.close()
+        store = CheckpointStore(db_path=db_path)
+        assert [run["task_id"] for run in store.list_interrupted_runs()] == ["t_old"]
+        assert store.claim_run("t_old")
+    print("✓ 旧版本数据库迁移")
+
+    print("\n✅ 中断恢复测试通过\n")
+    return True
+
+async def test_intent_classifier():
+    """测试Echo意图快速分类"""
+    print("=" * 60)
+    print("测试24: 意图快速分类")
+    print("=" * 60)
+
+    from core.intent_classifier import IntentClassifier
+    from core.metrics import metrics
+
+    # 纯技术/纯市场任务不调用LLM，混合任务交给LLM
+    classifier = IntentClassifier(model_path=None)
+    assert classifier.classify("修复数据库接口的性能问题").label == "tech"
+    assert classifier.classify("为新版本撰写社区推文和营销文案").label == "market"
+    assert not classifier.classify("创建新的API接口并在社区推广").confident
+    assert classifier.hits == 2
+    print("\n✓ 关键词分类")
+
+    # 英文关键词按单词匹配：capital 不命中 api，Seoul 不命中 seo
+    assert classifier.classify_keywords("Visit Seoul capital city").confidence == 0.0
+    assert classifier.classify_keywords("Deploy the api to the Seoul region").label == "tech"
+    assert classifier.classify_keywords("修复api接口").label == "tech"
+    print("✓ 英文关键词按单词边界匹配")
+
+    # 关键词不确定时交给本地模型；模型推理失败时沿用关键词结果
+    class Probabilities(list):
+        def argmax(self):
+            return self.index(max(self))
+
+    class StubModel:
+        classes_ = ["market", "mixed", "tech"]
+
+        def __init__(self, fail=False):
+            self.fail = fail
+
+        def predict_proba(self, texts):
+            if self.fail:
+                raise ValueError("feature mismatch")
+            return [Probabilities([0.1, 0.1, 0.8])]
+
+    classifier = IntentClassifier(model_path=None)
+    classifier._model, classifier._model_loaded = StubModel(), True
+    result = classifier.classify("创建新的API接口并在社区推广")
+    assert result.label == "tech" and result.source == "model" and result.confident
+
+    errors = metrics.get("echo_intent_model_errors_total")
+    classifier = IntentClassifier(model_path=None)
+    classifier._model, classifier._model_loaded = StubModel(fail=True), True
+    result = classifier.classify("创建新的API接口并在社区推广")
+    assert result.label == "mixed" and result.source == "keywords" and not result.confident
+    assert metrics.get("echo_intent_model_errors_total") == errors + 1
+    print("✓ 模型推理失败时退回关键词结果")
+
+    # 异步分类：模型加载与推理在线程中执行，关键词已确定时不进线程
+    import threading
+
+    class ThreadModel(StubModel):
+        def predict_proba(self, texts):
+            self.thread = threading.current_thread()
+            return super().predict_proba(texts)
+
+    classifier = IntentClassifier(model_path="intent.joblib")
+    model = ThreadModel()
+    classifier._model, classifier._model_loaded = model, True
+    assert (await classifier.aclassify("修复数据库接口的性能问题")).source == "keywords"
+    assert not hasattr(model, "thread")
+    result = await classifier.aclassify("创建新的API接口并在社区推广")
+    assert result.source == "model" and model.thread is not threading.main_thread()
+    print("✓ 模型推理不阻塞事件循环")
+
+    print("\n✅ 意图快速分类测试通过\n")
+    return True
+
+async def test_workflow_replay():
+    """测试工作流录制与多次回放"""
+    print("=" * 60)
+    print("测试25: 录制与回放")
+    print("=" * 60)
+
+    import tempfile
+    from pathlib import Path
+    from core.agents import get_agent_workflow
+    from core.llm import llm_override
+    from core.prompt_budget import isolated_summary_cache
+    from core.replay import ReplayLLM, WorkflowRecorder, load_recording, replay
+
+    workflow = get_agent_workflow(AgentType.HENRY)
+    initial_state = {
+        "messages": [], "task": "发布新版本并在社区推广", "task_id": "test_replay", "audit_logs": [], "progress": 0.0
+    }
+
+    # 调研结果超过 writer 的预算，writer_create 先摘要再创作（同一节点两次LLM调用）
+    overrides = {"LLM_PROVIDER": "mock", "MOCK_LLM_LATENCY_MS": "0", "MOCK_LLM_TOKEN_SCALE": "5"}
+    saved = {name: os.environ.get(name) for name in overrides}
+    os.environ.update(overrides)
+    try:
+        recorder = WorkflowRecorder(AgentType.HENRY)
+        recorded = await recorder.run(workflow, dict(initial_state))
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+    assert len(recorder.calls["writer_create"]) == 2
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "henry.jsonl.gz"
+        recorder.save(path)
+        recording = load_recording(path)
+
+    async def replay_once():
+        queues = {node["node"]: list(node["llm_calls"]) for node in recording["nodes"]}
+        with llm_override(lambda agent_type: ReplayLLM(agent_type, queues)), isolated_summary_cache():
+            state = await workflow.ainvoke(dict(initial_state))
+        assert not any(queues.values())
+        return state["content"], state["henry_output"]
+
+    outputs = [await replay_once() for _ in range(3)]
+    assert outputs[0] == outputs[1] == outputs[2] == (recorded["content"], recorded["henry_output"])
+    print(f"\n✓ 3次回放输出与录制一致")
+
+    # 回放工具连续多次回放，摘要调用不会被进程共享的缓存跳过（录制调用全部按序使用）
+    report = await replay(recording, workflow, iterations=3)
+    assert set(report["nodes"]) == {node["node"] for node in recording["nodes"]}
+    print(f"✓ 回放节点: {list(report['nodes'])}")
+
+    print("\n✅ 录制与回放测试通过\n")
+    return True
+
 async def run_all_tests():
     """运行所有测试"""
     print("\n")
@@ -193,9 +1784,30 @@ async def run_all_tests():
     results.append(("目标对齐检查", test_goal_alignment()))
     results.append(("安全检查", test_safety_check()))
     results.append(("频率限制", test_rate_limit()))
+    results.append(("任务存储", await test_task_store()))
+    results.append(("快照缓存", await test_snapshot_cache()))
 
     # 异步测试
     results.append(("工作流执行", await test_workflow_async()))
+    results.append(("DAG调度器", await test_dag_scheduler()))
+    results.append(("节点事件推送", await test_task_event_listener()))
+    results.append(("模拟LLM工作流", await test_mock_llm_workflow()))
+    results.append(("LLM调用策略", await test_call_policy()))
+    results.append(("模型路由", await test_llm_router()))
+    results.append(("请求合并", await test_singleflight()))
+    results.append(("任务调度器", await test_task_scheduler()))
+    results.append(("自适应并发控制", await test_adaptive_limiter()))
+    results.append(("WebSocket广播", await test_broadcaster()))
+    results.append(("任务状态增量", await test_task_feed()))
+    results.append(("响应压缩", await test_compression()))
+    results.append(("跨进程共享状态", await test_shared_state()))
+    results.append(("持久化任务队列", await test_job_queue()))
+    results.append(("派生任务", await test_workflow_fork()))
+    results.append(("提示词预算", await test_prompt_budget()))
+    results.append(("模型分档", await test_model_policy()))
+    results.append(("中断恢复", await test_checkpoint_resume()))
+    results.append(("意图快速分类", await test_intent_classifier()))
+    results.append(("录制与回放", await test_workflow_replay()))
 
     # 总结
     print("\n" + "=" * 60)